@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""
+Benchmark for loading, indexing and searching the hymn catalogue.
+
+Generates synthetic sitemap .xml.gz files of the requested sizes, loads them
+through SitemapManager exactly as the bot does (without touching the network),
+and reports load times, peak Python memory (of this process only) and search
+latency percentiles as JSON.
+
+    python benchmark.py --sizes 10000,100000 --output bench.json
+"""
+
+import sys
+import gzip
+import json
+import time
+import random
+import logging
+import argparse
+import platform
+import tempfile
+import tracemalloc
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Sequence
+
+from sitemap_manager import CATALOGUE_BACKEND, CATALOGUE_BACKENDS, PARSE_WORKERS, SITEMAP_NAMESPACE, SitemapManager
+from sqlite_catalogue import DATABASE_FILENAME
+from catalogue_snapshot import SNAPSHOT_SUFFIX
+
+DEFAULT_SIZES = [10_000, 100_000]
+DEFAULT_QUERIES = 2000
+URLS_PER_SITEMAP = 50_000  # Roughly how many URLs hymnary.org puts in each sitemap
+BASE_URL = "https://hymnary.org"
+
+# Common words in hymn titles, most frequent first
+COMMON_WORDS = """
+the of o to my and lord god in is be jesus a thou thy me come all christ love
+we our you holy praise will i spirit king for with from on his he great glory
+heart day us sing grace lamb blessed life way let song hymn light peace joy
+father savior how who at hear by faith night cross now rejoice earth heaven
+name shall thee what when are power prayer hope hallelujah morning am this
+sweet amazing wonderful mighty shepherd friend rock eternal glorious word
+""".split()
+
+# Where each kind of query comes from, and how often users send it
+QUERY_MIX = [
+    ('title', 0.35),     # A whole title, e.g. picked from memory
+    ('word', 0.2),       # One common word
+    ('prefix', 0.15),    # The start of a title, as typed so far
+    ('fragment', 0.1),   # A few words from the middle of a title
+    ('typo', 0.1),       # A title word with a typo
+    ('short', 0.05),     # One or two letters, matching nearly everything
+    ('miss', 0.05),      # Nothing matches
+]
+
+
+def make_titles(count: int, seed: int) -> List[str]:
+    """Return count synthetic hymn title slugs with a realistic word distribution."""
+    rng = random.Random(seed)
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+    # Rare words grow with the catalogue, as names and places do in real titles
+    rare = [''.join(rng.choice(letters) for _ in range(rng.randint(3, 10)))
+            for _ in range(max(100, count // 10))]
+    weights = [1 / (rank + 1) for rank in range(len(COMMON_WORDS))]
+
+    titles = []
+    for _ in range(count):
+        length = rng.randint(2, 8)
+        words = [rng.choice(rare) if rng.random() < 0.25 else rng.choices(COMMON_WORDS, weights)[0]
+                 for _ in range(length)]
+        titles.append('_'.join(words))
+    return titles
+
+
+def write_sitemaps(sitemap_dir: Path, titles: Sequence[str]) -> List[str]:
+    """Write titles as gzipped sitemaps plus a sitemap.xml index; return the sitemap names."""
+    names = []
+    for start in range(0, len(titles), URLS_PER_SITEMAP):
+        name = f"index_text_{len(names)}.xml.gz"
+        with gzip.open(sitemap_dir / name, 'wt', encoding='utf-8') as f:
+            f.write(f'<?xml version="1.0" encoding="UTF-8"?><urlset xmlns="{SITEMAP_NAMESPACE}">')
+            for title in titles[start:start + URLS_PER_SITEMAP]:
+                f.write(f'<url><loc>{BASE_URL}/text/{title}</loc><changefreq>weekly</changefreq></url>')
+            f.write('</urlset>')
+        names.append(name)
+
+    index = [f'<sitemapindex xmlns="{SITEMAP_NAMESPACE}">']
+    for name in names:
+        index.append(f'<sitemap><loc>{BASE_URL}/{name}</loc><lastmod>2024-01-01</lastmod></sitemap>')
+    index.append('</sitemapindex>')
+    (sitemap_dir / "sitemap.xml").write_text(''.join(index))
+    return names
+
+
+def make_queries(titles: Sequence[str], count: int, seed: int) -> List[str]:
+    """Return count queries drawn from QUERY_MIX."""
+    rng = random.Random(seed + 1)
+    kinds = rng.choices([kind for kind, _ in QUERY_MIX], [share for _, share in QUERY_MIX], k=count)
+
+    queries = []
+    for kind in kinds:
+        words = rng.choice(titles).split('_')
+        if kind == 'title':
+            query = ' '.join(words)
+        elif kind == 'word':
+            query = rng.choice(COMMON_WORDS[:40])
+        elif kind == 'prefix':
+            text = ' '.join(words)
+            query = text[:rng.randint(3, max(3, len(text)))]
+        elif kind == 'fragment':
+            start = rng.randrange(len(words))
+            query = ' '.join(words[start:start + 2])
+        elif kind == 'typo':
+            word = max(words, key=len)
+            i = rng.randrange(len(word))
+            query = word[:i] + word[i + 1:] if len(word) > 4 else word
+        elif kind == 'short':
+            query = ''.join(rng.choices('abcdefghijklmnopqrstuvwxyz', k=rng.randint(1, 2)))
+        else:
+            query = 'zzqx' + str(rng.randint(0, 999))
+        queries.append(query)
+    return queries
+
+
+def percentiles(samples: Sequence[float]) -> Dict[str, float]:
+    """Summarize latencies in seconds as milliseconds."""
+    ordered = sorted(samples)
+
+    def at(fraction: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] * 1000, 4)
+
+    return {
+        'count': len(ordered),
+        'mean_ms': round(sum(ordered) / len(ordered) * 1000, 4),
+        'p50_ms': at(0.5),
+        'p90_ms': at(0.9),
+        'p99_ms': at(0.99),
+        'max_ms': round(ordered[-1] * 1000, 4),
+    }
+
+
+def timed(function: Callable[[], Any]) -> float:
+    """Return how long function takes, in seconds."""
+    start = time.perf_counter()
+    function()
+    return time.perf_counter() - start
+
+
+def peak_memory(function: Callable[[], Any]) -> int:
+    """
+    Return the peak bytes allocated by Python objects in this process while function runs.
+
+    tracemalloc only sees the calling process, so memory used by parse
+    workers on other processes isn't included.
+    """
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def clear_snapshots(sitemap_dir: Path):
+    """Delete catalogue snapshots and the database so the next load parses the sitemaps."""
+    for path in sitemap_dir.glob(f"*{SNAPSHOT_SUFFIX}"):
+        path.unlink()
+    database = sitemap_dir / DATABASE_FILENAME
+    if database.exists():
+        database.unlink()
+
+
+def run_benchmark(size: int, query_count: int = DEFAULT_QUERIES, seed: int = 0,
+                  measure_memory: bool = True, backend: str = CATALOGUE_BACKEND) -> Dict[str, Any]:
+    """Benchmark one catalogue size and return the results."""
+    titles = make_titles(size, seed)
+    queries = make_queries(titles, query_count, seed)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        sitemap_dir = Path(tmpdir)
+        names = write_sitemaps(sitemap_dir, titles)
+
+        def manager(**kwargs) -> SitemapManager:
+            return SitemapManager(sitemap_dir=sitemap_dir, index_url=f"{BASE_URL}/sitemap.xml",
+                                  backend=backend, **kwargs)
+
+        parse_seconds = timed(lambda: manager().parse_sitemap_file(sitemap_dir / names[0]))
+
+        clear_snapshots(sitemap_dir)
+        cold_seconds = timed(lambda: manager().load_all_hymns())
+        warm_seconds = timed(lambda: manager().load_all_hymns())
+
+        memory = {}
+        if measure_memory:
+            memory['parse_peak_bytes'] = peak_memory(lambda: manager().parse_sitemap_file(sitemap_dir / names[0]))
+            clear_snapshots(sitemap_dir)
+            # Parsing runs on worker processes, so this is the parent's share of a cold load only
+            memory['cold_load_parent_peak_bytes'] = peak_memory(lambda: manager().load_all_hymns())
+            memory['warm_load_peak_bytes'] = peak_memory(lambda: manager().load_all_hymns())
+
+        # Searches bypass the query cache so every query is really searched
+        searcher = manager(query_cache_size=0)
+        searcher.load_all_hymns()
+        search = [timed(lambda: searcher.search_hymns(query, max_results=25)) for query in queries]
+        complete = [timed(lambda: searcher.complete_titles(query, limit=25)) for query in queries]
+
+        cached = manager(query_cache_size=len(queries))
+        cached.load_all_hymns()
+        for query in queries:
+            cached.search_hymns(query, max_results=25)
+        cache_hits = [timed(lambda: cached.search_hymns(query, max_results=25)) for query in queries]
+
+        return {
+            'size': size,
+            'backend': backend,
+            'sitemaps': len(names),
+            'parse_sitemap_file_seconds': round(parse_seconds, 4),
+            'parse_sitemap_file_urls': min(size, URLS_PER_SITEMAP),
+            'cold_load_seconds': round(cold_seconds, 4),
+            'warm_load_seconds': round(warm_seconds, 4),
+            **memory,
+            'search': percentiles(search),
+            'complete': percentiles(complete),
+            'cached_search': percentiles(cache_hits),
+        }
+
+
+def main(argv: Sequence[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)),
+                        help="comma-separated catalogue sizes in URLs (default: %(default)s)")
+    parser.add_argument('--queries', type=int, default=DEFAULT_QUERIES,
+                        help="searches to time per size (default: %(default)s)")
+    parser.add_argument('--seed', type=int, default=0, help="random seed (default: %(default)s)")
+    parser.add_argument('--no-memory', action='store_true',
+                        help="skip the slower peak-memory passes")
+    parser.add_argument('--backend', choices=CATALOGUE_BACKENDS, default=CATALOGUE_BACKEND,
+                        help="catalogue backend to benchmark (default: %(default)s)")
+    parser.add_argument('--output', type=Path, help="write JSON here instead of stdout")
+    args = parser.parse_args(argv)
+
+    # The loader logs every sitemap; keep the benchmark output readable
+    logging.basicConfig(level=logging.WARNING)
+
+    results = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'seed': args.seed,
+        'parse_workers': PARSE_WORKERS,
+        'queries': args.queries,
+        'results': [],
+    }
+    for size in (int(size) for size in args.sizes.split(',')):
+        print(f"Benchmarking {size} URLs...", file=sys.stderr)
+        results['results'].append(run_benchmark(size, args.queries, args.seed, not args.no_memory,
+                                                 args.backend))
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        args.output.write_text(output + '\n')
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
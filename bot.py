@@ -12,7 +12,11 @@ from discord import app_commands
 from discord.ui import Select, View, Button
 from dotenv import load_dotenv
 from typing import List, Optional
-from sitemap_manager import SitemapManager, initialize_sitemaps
+from sitemap_manager import CATALOGUE_BACKEND, PARSE_WORKERS, CatalogueState, SitemapManager
+from metrics import METRICS, log_metrics, monitor_event_loop, start_metrics_server
+from hymn_payloads import HymnPayloads
+from result_cursors import CURSOR_MAX_RESULTS, CURSOR_TTL, PAGE_SIZE, CursorStore
+from send_queue import ChannelSendQueue
 
 # Configure logging
 logging.basicConfig(
@@ -25,95 +29,210 @@ logger = logging.getLogger(__name__)
 load_dotenv()
 DISCORD_TOKEN = os.getenv('DISCORD_TOKEN')
 GUILD_ID = os.getenv('GUILD_ID')
+CATALOGUE_REFRESH_HOURS = float(os.getenv('CATALOGUE_REFRESH_HOURS', '24'))
+QUERY_CACHE_SIZE = int(os.getenv('QUERY_CACHE_SIZE', '1024'))
+QUERY_CACHE_TTL = float(os.getenv('QUERY_CACHE_TTL', '0')) or None
+
+# Sharding: SHARD_COUNT is a number or "auto"; SHARD_IDS (e.g. "0,1") picks this process's shards
+# and needs a numeric SHARD_COUNT
+SHARD_COUNT = os.getenv('SHARD_COUNT')
+SHARD_IDS = os.getenv('SHARD_IDS')
+
+# "load" downloads and snapshots the sitemaps; "attach" maps the snapshots another process wrote
+CATALOGUE_MODE = os.getenv('CATALOGUE_MODE', 'load').lower()
+CATALOGUE_ATTACH_SECONDS = 300  # How often attached processes look for updated snapshots
+CATALOGUE_RETRY_SECONDS = 60    # First wait before retrying a failed load; doubles up to the refresh interval
+
+# Which hymnary.org record types to index, by the path segment in their URLs
+CATALOGUE_TYPES = [t.strip().lower() for t in os.getenv('CATALOGUE_TYPES', 'text,tune,person').split(',')
+                   if t.strip()]
+# Processes parsing sitemaps on a cold load (default: one per core)
+PARSE_WORKERS = int(os.getenv('PARSE_WORKERS', '0')) or PARSE_WORKERS
+# "memory" searches indexes held in (shared) memory; "sqlite" searches an SQLite database on disk
+CATALOGUE_BACKEND = os.getenv('CATALOGUE_BACKEND', CATALOGUE_BACKEND).lower()
+
+# Metrics: serve them on 127.0.0.1:METRICS_PORT/metrics, and/or log them every METRICS_LOG_SECONDS
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))
+METRICS_LOG_SECONDS = float(os.getenv('METRICS_LOG_SECONDS', '0'))
 
 if not DISCORD_TOKEN:
     raise ValueError("DISCORD_TOKEN not found in environment variables")
 
+# discord.py can't split shards between processes without knowing how many there are
+if SHARD_IDS and not (SHARD_COUNT or '').isdigit():
+    raise ValueError("SHARD_IDS requires SHARD_COUNT to be set to the total number of shards (not \"auto\")")
+
 # Initialize Discord client with required intents
 intents = discord.Intents.default()
 intents.message_content = True
 
-client = discord.Client(intents=intents)
+if SHARD_COUNT or SHARD_IDS:
+    # One process can run several shards; they all share this process's catalogue
+    client = discord.AutoShardedClient(
+        intents=intents,
+        shard_count=int(SHARD_COUNT) if SHARD_COUNT and SHARD_COUNT != 'auto' else None,
+        shard_ids=[int(shard_id) for shard_id in SHARD_IDS.split(',')] if SHARD_IDS else None
+    )
+else:
+    client = discord.Client(intents=intents)
 tree = app_commands.CommandTree(client)
 
 # Global sitemap manager with thread-safe initialization
 sitemap_manager: Optional[SitemapManager] = None
 sitemap_manager_lock = asyncio.Lock()
 
+# Background task loading the hymn catalogue (kept referenced so it isn't garbage collected)
+catalogue_task: Optional[asyncio.Task] = None
+
+# Background tasks measuring and publishing metrics
+metrics_tasks: List[asyncio.Task] = []
+
+# Select options and share embeds, reused across searches
+hymn_payloads = HymnPayloads()
+
+# Results of recent /find searches, paged through by HymnSelectView
+result_cursors = CursorStore()
+
+# Hymns shared to channels, posted through one rate-limited queue per channel
+send_queue = ChannelSendQueue()
+
 
 class HymnSelectView(View):
-    """View with a dropdown menu for selecting a hymn."""
+    """View with a dropdown menu for selecting a hymn, a page of results at a time."""
     
-    def __init__(self, hymns: List[dict], interaction: discord.Interaction):
-        super().__init__(timeout=180)  # 3 minute timeout
-        self.hymns = hymns
+    def __init__(self, cursor_id: int, total: int, interaction: discord.Interaction, query: str = ""):
+        super().__init__(timeout=CURSOR_TTL)  # 3 minute timeout, as long as the cursor lives
+        self.cursor_id = cursor_id
+        self.total = total
         self.original_interaction = interaction
+        self.query = query
+        self.page = 0
+        self.page_size = PAGE_SIZE
+        self.hymns: List[dict] = []
+        self.show_page(result_cursors.get(cursor_id))
+    
+    def show_page(self, cursor):
+        """Rebuild the menu and buttons for the current page of the cursor."""
+        self.clear_items()
+        self.page_size = cursor.page_size
+        self.hymns = cursor.page(self.page)
+        has_next = cursor.has_next(self.page)
         
-        # Create select menu
-        options = []
-        for i, hymn in enumerate(hymns[:25]):  # Discord limit is 25 options
-            # Truncate title if too long (100 char limit for option labels)
-            title = hymn['title']
-            if len(title) > 100:
-                title = title[:97] + "..."
-            
-            options.append(
-                discord.SelectOption(
-                    label=title,
-                    description=hymn['url'][:100] if len(hymn['url']) <= 100 else hymn['url'][:97] + "...",
-                    value=str(i)
-                )
-            )
-        
+        # Create select menu from cached options (labels truncated to Discord's 100 characters)
         select = Select(
             placeholder="Choose a hymn to share with the channel...",
-            options=options
+            options=hymn_payloads.options(self.hymns)
         )
         select.callback = self.select_callback
         self.add_item(select)
         
+        # Page buttons, only when the results don't fit in one menu
+        if self.page > 0 or has_next:
+            previous_button = Button(label="◀ Previous", style=discord.ButtonStyle.secondary,
+                                     disabled=self.page == 0)
+            previous_button.callback = self.previous_callback
+            self.add_item(previous_button)
+            
+            next_button = Button(label="Next ▶", style=discord.ButtonStyle.secondary, disabled=not has_next)
+            next_button.callback = self.next_callback
+            self.add_item(next_button)
+        
         # Add cancel button
         cancel_button = Button(label="Cancel", style=discord.ButtonStyle.secondary)
         cancel_button.callback = self.cancel_callback
         self.add_item(cancel_button)
     
+    def embed(self) -> discord.Embed:
+        """Return the embed describing the current page of results."""
+        pages = ""
+        if self.total > self.page_size:
+            first = self.page * self.page_size + 1
+            pages = f"\nShowing {first}-{first + len(self.hymns) - 1}"
+        more = "+" if self.total >= CURSOR_MAX_RESULTS else ""
+        return discord.Embed(
+            title=f"Found {self.total}{more} result{'s' if self.total != 1 else ''}",
+            description=f"Searching for: **{self.query}**{pages}\n\n"
+                        f"Select a hymn below to share it with the channel.",
+            color=discord.Color.green()
+        )
+    
+    async def turn_page(self, interaction: discord.Interaction, step: int):
+        """Show the next or previous page, pulled from the cursor without searching again."""
+        cursor = result_cursors.get(self.cursor_id)
+        if cursor is None:
+            await interaction.response.edit_message(
+                content="⌛ These results have expired. Please run /find again.",
+                embed=None,
+                view=None
+            )
+            self.stop()
+            return
+        
+        # Clamped both ways, so a double-click past either end can't ask for an empty page
+        last_page = max(self.total - 1, 0) // cursor.page_size
+        self.page = min(max(self.page + step, 0), last_page)
+        self.show_page(cursor)
+        await interaction.response.edit_message(embed=self.embed(), view=self)
+    
+    async def next_callback(self, interaction: discord.Interaction):
+        """Handle the Next button."""
+        await self.turn_page(interaction, 1)
+    
+    async def previous_callback(self, interaction: discord.Interaction):
+        """Handle the Previous button."""
+        await self.turn_page(interaction, -1)
+    
+    async def on_timeout(self):
+        """Free the cursor once nobody can page through it any more."""
+        result_cursors.close(self.cursor_id)
+    
+    def stop(self):
+        result_cursors.close(self.cursor_id)
+        super().stop()
+    
     async def select_callback(self, interaction: discord.Interaction):
         """Handle hymn selection."""
         # Get the selected hymn
         selected_index = int(interaction.data['values'][0])
         selected_hymn = self.hymns[selected_index]
+        self.stop()
         
         # Send the selected hymn to the channel (non-ephemeral)
-        embed = discord.Embed(
-            title=selected_hymn['title'],
-            url=selected_hymn['url'],
-            description=f"[View on Hymnary]({selected_hymn['url']})",
-            color=discord.Color.blue()
-        )
-        embed.set_footer(text=f"Shared by {interaction.user.display_name}")
+        embed = hymn_payloads.share_embed(selected_hymn, interaction.user.display_name)
         
-        # Acknowledge the interaction first to avoid timeout
-        await interaction.response.defer()
+        async def confirm():
+            # Acknowledging by editing the menu's message updates it in the same round trip
+            with METRICS.timer('hymnbot_select_stage_seconds', stage='confirm'):
+                await interaction.response.edit_message(
+                    content=f"✅ Shared: **{selected_hymn['title']}**",
+                    embed=None,
+                    view=None
+                )
         
-        # Send to the channel as a standalone message (not a reply)
-        await interaction.channel.send(embed=embed)
+        async def share():
+            # Posted as a standalone message (not a reply), paced and batched per channel
+            with METRICS.timer('hymnbot_select_stage_seconds', stage='send'):
+                await send_queue.send(interaction.channel, embed)
         
-        # Update the ephemeral message to confirm
-        await self.original_interaction.edit_original_response(
-            content=f"✅ Shared: **{selected_hymn['title']}**",
-            view=None
-        )
-        
-        self.stop()
+        # Neither call depends on the other, so both go out at once
+        confirmed, shared = await asyncio.gather(confirm(), share(), return_exceptions=True)
+        if isinstance(confirmed, Exception):
+            logger.error(f"Error confirming share: {confirmed}", exc_info=confirmed)
+        if isinstance(shared, Exception):
+            logger.error(f"Error sharing hymn: {shared}", exc_info=shared)
+            await self.original_interaction.edit_original_response(
+                content=f"❌ Couldn't share **{selected_hymn['title']}** to this channel. Please try again.",
+                view=None
+            )
     
     async def cancel_callback(self, interaction: discord.Interaction):
         """Handle cancellation."""
-        await interaction.response.defer()
-        await self.original_interaction.edit_original_response(
+        self.stop()
+        await interaction.response.edit_message(
             content="❌ Cancelled - no hymn was shared.",
+            embed=None,
             view=None
         )
-        self.stop()
 
 
 @tree.command(
@@ -121,23 +240,59 @@ class HymnSelectView(View):
     description="Search for a hymn on hymnary.org and share it with the channel"
 )
 @app_commands.describe(
-    song_title="The title or partial title of the hymn to search for"
+    song_title="The title or partial title of the hymn to search for",
+    type="Only search this kind of record (default: everything)"
 )
-async def find_hymn(interaction: discord.Interaction, song_title: str):
+@app_commands.choices(type=[
+    app_commands.Choice(name="Texts", value="text"),
+    app_commands.Choice(name="Tunes", value="tune"),
+    app_commands.Choice(name="People", value="person"),
+])
+async def find_hymn(
+    interaction: discord.Interaction,
+    song_title: str,
+    type: Optional[app_commands.Choice[str]] = None
+):
     """
     Find a hymn from hymnary.org and allow the user to select which one to share.
     
     Args:
         interaction: The Discord interaction
         song_title: The hymn title to search for
+        type: Restrict the search to texts, tunes or people
     """
+    # Don't search a catalogue that is still loading; answer straight away instead
+    if sitemap_manager is None or not sitemap_manager.hymn_data:
+        failed = sitemap_manager is not None and sitemap_manager.state == CatalogueState.FAILED
+        await interaction.response.send_message(
+            "❌ The hymn catalogue failed to load and will be retried shortly. "
+            "If this keeps happening, please contact the bot administrator."
+            if failed else
+            "⏳ The hymn catalogue is still warming up. Please try again in a moment.",
+            ephemeral=True
+        )
+        return
+    
     # Defer the response as searching might take a moment
-    await interaction.response.defer(ephemeral=True)
+    with METRICS.timer('hymnbot_find_stage_seconds', stage='defer'):
+        await interaction.response.defer(ephemeral=True)
     
     try:
         # Search for hymns
         logger.info(f"Searching for: {song_title}")
-        results = sitemap_manager.search_hymns(song_title, max_results=25)
+        try:
+            # Runs on a worker thread, so a broad query can't stall other interactions
+            with METRICS.timer('hymnbot_find_stage_seconds', stage='search'):
+                # Keep a few pages' worth so Next doesn't have to search again
+                results = await sitemap_manager.search_hymns_async(
+                    song_title, max_results=CURSOR_MAX_RESULTS, record_type=type.value if type else None)
+        except asyncio.TimeoutError:
+            logger.warning(f"Search timed out: {song_title}")
+            await interaction.followup.send(
+                f"⏳ Searching for **{song_title}** took too long. Try a more specific search term.",
+                ephemeral=True
+            )
+            return
         
         if not results:
             await interaction.followup.send(
@@ -146,21 +301,16 @@ async def find_hymn(interaction: discord.Interaction, song_title: str):
             )
             return
         
-        # Create embed with search results
-        embed = discord.Embed(
-            title=f"Found {len(results)} result{'s' if len(results) != 1 else ''}",
-            description=f"Searching for: **{song_title}**\n\nSelect a hymn below to share it with the channel.",
-            color=discord.Color.green()
-        )
+        # Create the selection view, showing the first page of results
+        with METRICS.timer('hymnbot_find_stage_seconds', stage='view'):
+            view = HymnSelectView(result_cursors.open(results), len(results), interaction, song_title)
         
-        # Create the selection view
-        view = HymnSelectView(results, interaction)
-        
-        await interaction.followup.send(
-            embed=embed,
-            view=view,
-            ephemeral=True
-        )
+        with METRICS.timer('hymnbot_find_stage_seconds', stage='send'):
+            await interaction.followup.send(
+                embed=view.embed(),
+                view=view,
+                ephemeral=True
+            )
         
     except Exception as e:
         logger.error(f"Error in find_hymn command: {e}", exc_info=True)
@@ -170,31 +320,103 @@ async def find_hymn(interaction: discord.Interaction, song_title: str):
         )
 
 
+@find_hymn.autocomplete('song_title')
+async def song_title_autocomplete(
+    interaction: discord.Interaction,
+    current: str
+) -> List[app_commands.Choice[str]]:
+    """
+    Suggest hymn titles while the user is typing.
+    
+    Discord allows about 3 seconds to answer, so this only does a bounded
+    prefix lookup and never waits on the catalogue loading.
+    """
+    if sitemap_manager is None:
+        return []
+    
+    # Suggest only the kind of record picked in the type option, if it was filled in first
+    record_type = getattr(interaction.namespace, 'type', None)
+    
+    # Choice names and values are both limited to 100 characters
+    return [
+        app_commands.Choice(name=hymn['title'][:100], value=hymn['title'][:100])
+        for hymn in sitemap_manager.complete_titles(current, limit=25, record_type=record_type)
+    ]
+
+
+async def load_catalogue(manager: SitemapManager):
+    """Load hymn data in the background so the event loop keeps running."""
+    logger.info("Loading hymn data...")
+    retry_seconds = CATALOGUE_RETRY_SECONDS
+    while True:
+        try:
+            hymn_count = await manager.load_in_background()
+            logger.info(f"Loaded {hymn_count} hymns")
+        except Exception as e:
+            logger.error(f"Error loading hymns: {e}", exc_info=True)
+        if manager.is_ready:
+            break
+        
+        # Nothing to search yet (e.g. hymnary.org was unreachable); keep trying with backoff
+        logger.warning(f"Hymn catalogue not loaded; retrying in {retry_seconds:.0f} seconds")
+        await asyncio.sleep(retry_seconds)
+        retry_seconds = min(retry_seconds * 2, max(CATALOGUE_REFRESH_HOURS * 3600, CATALOGUE_RETRY_SECONDS))
+    
+    if CATALOGUE_REFRESH_HOURS <= 0:
+        return
+    
+    # Periodically pick up changed sitemaps; only the changed ones are re-fetched and re-indexed
+    while True:
+        await asyncio.sleep(CATALOGUE_REFRESH_HOURS * 3600)
+        try:
+            if manager.is_ready:
+                await manager.refresh_in_background()
+            else:
+                await manager.load_in_background()
+        except Exception as e:
+            logger.error(f"Error refreshing hymns: {e}", exc_info=True)
+
+
+async def attach_catalogue(manager: SitemapManager):
+    """Keep mapping the catalogue snapshots written by the loader process."""
+    logger.info("Attaching to the shared hymn catalogue...")
+    while True:
+        try:
+            hymn_count = await manager.attach_in_background()
+            if hymn_count:
+                logger.info(f"Attached {hymn_count} hymns")
+        except Exception as e:
+            logger.error(f"Error attaching to hymn catalogue: {e}", exc_info=True)
+        
+        # Retry quickly until the loader has written its first snapshots
+        await asyncio.sleep(CATALOGUE_ATTACH_SECONDS if manager.is_ready else 10)
+
+
+async def start_metrics():
+    """Start measuring event loop lag, and publishing metrics if configured."""
+    metrics_tasks.append(asyncio.create_task(monitor_event_loop()))
+    if METRICS_LOG_SECONDS > 0:
+        metrics_tasks.append(asyncio.create_task(log_metrics(METRICS_LOG_SECONDS)))
+    if METRICS_PORT:
+        try:
+            await start_metrics_server(METRICS_PORT)
+        except Exception as e:
+            logger.error(f"Error starting metrics server: {e}", exc_info=True)
+
+
 @client.event
 async def on_ready():
     """Called when the bot is ready."""
-    global sitemap_manager
+    global sitemap_manager, catalogue_task
     
     logger.info(f'Logged in as {client.user} (ID: {client.user.id})')
     
-    # Initialize sitemap manager with thread-safe lock
-    async with sitemap_manager_lock:
-        if sitemap_manager is None:
-            logger.info("Initializing sitemap manager...")
-            sitemap_manager = initialize_sitemaps()
-            
-            # Load hymn data in the background
-            logger.info("Loading hymn data...")
-            try:
-                hymn_count = len(sitemap_manager.load_all_hymns())
-                logger.info(f"Loaded {hymn_count} hymns")
-            except Exception as e:
-                logger.error(f"Error loading hymns: {e}", exc_info=True)
-                logger.warning("Bot will continue but /find may not work properly")
-    
-    # Sync commands
+    # Sync commands straight away; /find reports when the catalogue isn't ready yet
     try:
-        if GUILD_ID:
+        if CATALOGUE_MODE == 'attach':
+            # The loader process registers the same commands
+            logger.info("Leaving command sync to the loader process")
+        elif GUILD_ID:
             # Sync to specific guild for faster testing
             guild = discord.Object(id=int(GUILD_ID))
             tree.copy_global_to(guild=guild)
@@ -207,6 +429,27 @@ async def on_ready():
     except Exception as e:
         logger.error(f"Error syncing commands: {e}", exc_info=True)
     
+    # Initialize sitemap manager with thread-safe lock
+    async with sitemap_manager_lock:
+        if sitemap_manager is None:
+            logger.info("Initializing sitemap manager...")
+            sitemap_manager = SitemapManager(query_cache_size=QUERY_CACHE_SIZE,
+                                             query_cache_ttl=QUERY_CACHE_TTL,
+                                             record_types=CATALOGUE_TYPES,
+                                             parse_workers=PARSE_WORKERS,
+                                             backend=CATALOGUE_BACKEND)
+            METRICS.register_collector(sitemap_manager.stats)
+            METRICS.register_collector(hymn_payloads.stats)
+            METRICS.register_collector(result_cursors.stats)
+            METRICS.register_collector(send_queue.stats)
+            await start_metrics()
+            
+            # Download, parse and index off the event loop so heartbeats keep flowing
+            if CATALOGUE_MODE == 'attach':
+                catalogue_task = asyncio.create_task(attach_catalogue(sitemap_manager))
+            else:
+                catalogue_task = asyncio.create_task(load_catalogue(sitemap_manager))
+    
     logger.info("Bot is ready!")
 
 
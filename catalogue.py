@@ -0,0 +1,143 @@
+"""
+Hymn Catalogue
+
+This module groups hymns into shards, one per sitemap file and record type
+(texts, tunes, people, ...), so a refresh can rebuild just the sitemaps that
+changed and swap them in atomically, and a search limited to one type only
+touches that type's shards.
+"""
+
+import heapq
+import logging
+from bisect import bisect_right
+from operator import itemgetter
+from collections.abc import Sequence as SequenceABC
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from search_index import RANK_BUDGET, HymnSearchIndex, add_fuzzy_matches, complete_titles
+
+logger = logging.getLogger(__name__)
+
+
+class CatalogueShard:
+    """Records of one type parsed from one sitemap file, with their own search index."""
+
+    def __init__(
+        self,
+        name: str,
+        hymns: Sequence,
+        index: Optional[HymnSearchIndex] = None,
+        lastmod: Optional[str] = None,
+        manifest: Optional[Dict[str, List[int]]] = None,
+        record_type: str = ""
+    ):
+        self.name = name
+        self.record_type = record_type  # e.g. "text", from the records' URL paths
+        self.hymns = hymns
+        self.index = index if index is not None else HymnSearchIndex(hymns)
+        self.lastmod = lastmod  # <lastmod> of the sitemap when it was loaded
+        self.manifest = manifest  # Name, mtime and size of the file it was parsed from
+
+
+class CatalogueHymns(SequenceABC):
+    """Read-only view of every hymn in a set of shards, without copying them."""
+
+    def __init__(self, shards: Sequence[CatalogueShard]):
+        self._shards = shards
+        self._starts = []  # Index of each shard's first hymn
+        total = 0
+        for shard in shards:
+            self._starts.append(total)
+            total += len(shard.hymns)
+        self._length = total
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._length))]
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError("hymn index out of range")
+        shard = bisect_right(self._starts, index) - 1
+        return self._shards[shard].hymns[index - self._starts[shard]]
+
+    def __iter__(self):
+        for shard in self._shards:
+            yield from shard.hymns
+
+
+class Catalogue:
+    """
+    An ordered, read-only collection of shards.
+
+    Nothing in a Catalogue is modified after it is built. Readers take one
+    reference to it, so replacing that reference swaps the whole data set at
+    once and in-flight searches never see a half-built catalogue.
+    """
+
+    def __init__(self, shards: Sequence[CatalogueShard] = ()):
+        self.shards = tuple(shards)
+        self.hymns = CatalogueHymns(self.shards)  # All hymns, in sitemap order
+
+    @classmethod
+    def from_hymns(cls, hymns: Sequence) -> 'Catalogue':
+        """Wrap a plain list of hymns as a single-shard catalogue."""
+        return cls([CatalogueShard("", hymns)]) if hymns else cls()
+
+    def __len__(self) -> int:
+        return len(self.hymns)
+
+    def sitemap_shards(self, name: str) -> List[CatalogueShard]:
+        """Return the shards loaded from the named sitemap, one per record type."""
+        return [shard for shard in self.shards if shard.name == name]
+
+    def record_types(self) -> List[str]:
+        """Return the record types in the catalogue, sorted."""
+        return sorted({shard.record_type for shard in self.shards})
+
+    def _shards_of_type(self, record_type: Optional[str]) -> List[CatalogueShard]:
+        """Return the shards holding record_type records, or every shard if it's None."""
+        if record_type is None:
+            return list(self.shards)
+        return [shard for shard in self.shards if shard.record_type == record_type]
+
+    def search(self, query: str, max_results: int = 10, record_type: Optional[str] = None) -> List[Dict[str, str]]:
+        """
+        Return the best max_results hymns matching the query, best first.
+
+        With record_type, only shards holding that type of record are searched.
+        """
+        shards = self._shards_of_type(record_type)
+        if not shards:
+            return []
+        # Share the scoring budget between shards so broad queries stay bounded
+        budget = max(RANK_BUDGET // len(shards), max_results)
+
+        ranked = []
+        for shard_number, shard in enumerate(shards):
+            for (tier, length, hymn_id), hymn in shard.index.search_ranked(query, max_results, budget):
+                ranked.append(((tier, length, shard_number, hymn_id), hymn))
+        results = [hymn for _, hymn in heapq.nsmallest(max_results, ranked, key=itemgetter(0))]
+        return add_fuzzy_matches(results, max_results,
+                                 lambda count: self._search_fuzzy(shards, query, count, budget))
+
+    @staticmethod
+    def _search_fuzzy(
+        shards: Sequence[CatalogueShard],
+        query: str,
+        max_results: int,
+        budget: int
+    ) -> List[Tuple[Tuple[int, int, int, int, int], Dict[str, str]]]:
+        """Return the best max_results (rank key, hymn) fuzzy matches across shards, best first."""
+        ranked = []
+        for shard_number, shard in enumerate(shards):
+            for (distance, tier, length, hymn_id), hymn in shard.index.search_fuzzy(query, max_results, budget):
+                ranked.append(((distance, tier, length, shard_number, hymn_id), hymn))
+        return heapq.nsmallest(max_results, ranked, key=itemgetter(0))
+
+    def complete(self, text: str, limit: int = 25, record_type: Optional[str] = None) -> List[Dict[str, str]]:
+        """Return up to limit hymns for autocompleting a partially typed title."""
+        return complete_titles([shard.index for shard in self._shards_of_type(record_type)], text, limit)
@@ -0,0 +1,301 @@
+"""
+Hymn Catalogue Snapshot
+
+This module saves the records parsed from a sitemap, and their search indexes, to
+a binary file next to it so that a warm restart can skip re-parsing the sitemap.
+
+File layout (preamble integers little-endian, arrays in native byte order):
+
+    magic        8 bytes  b'HYMNSNAP'
+    version      uint32
+    header size  uint32
+    header       JSON: source manifest, record types and counts, section table
+    sections     raw bytes, located by (offset, length) in the header
+
+A sitemap can list several record types (texts, tunes, people), so each type
+gets its own store and index, saved as a separate set of sections.
+
+The loader also writes SHARD_ORDER_FILENAME, listing the sitemaps it serves in
+the order it serves them, so processes attaching to its snapshots rank ties the
+same way and skip sitemaps it no longer serves.
+
+The snapshot is only used when the manifest (name, mtime and size of every
+source sitemap) matches the files on disk.
+
+Snapshots are memory-mapped rather than read, and sections are aligned so the
+arrays can be used in place. Every process that loads the same snapshot shares
+one copy of the hymns and posting lists through the page cache. Snapshots are
+only ever replaced with os.replace, never rewritten in place, so a process
+that has one mapped keeps a consistent view until it loads the new one.
+"""
+
+import os
+import sys
+import mmap
+import json
+import struct
+import logging
+from array import array
+from bisect import bisect_left
+from pathlib import Path
+from collections.abc import Mapping
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from hymn_store import HymnStore
+from search_index import HymnSearchIndex
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_SUFFIX = ".snapshot"
+SHARD_ORDER_FILENAME = "catalogue_order.json"  # Which snapshots the loader serves, in order
+SNAPSHOT_MAGIC = b'HYMNSNAP'
+SNAPSHOT_VERSION = 6
+SECTION_ALIGNMENT = 8  # Sections start on a multiple of this, so arrays can be mapped in place
+
+_PREAMBLE = struct.Struct('<8sII')
+
+Manifest = Dict[str, List[int]]
+
+# (record type, hymns, index) for the records of one type in a sitemap
+SnapshotPart = Tuple[str, HymnStore, HymnSearchIndex]
+
+
+def _itemsizes() -> List[int]:
+    """Sizes of the array types used in a snapshot, which vary by platform."""
+    return [array('I').itemsize]
+
+
+def snapshot_path_for(source: Path) -> Path:
+    """Return where the snapshot of a sitemap file is stored."""
+    return source.with_name(source.name + SNAPSHOT_SUFFIX)
+
+
+def build_manifest(sources: Sequence[Path]) -> Manifest:
+    """Describe the source sitemaps by name, modification time and size."""
+    manifest = {}
+    for path in sources:
+        stat = path.stat()
+        manifest[path.name] = [stat.st_mtime_ns, stat.st_size]
+    return manifest
+
+
+def write_shard_order(sitemap_dir: Path, names: Sequence[str]) -> bool:
+    """Record which sitemaps the loader serves, in the order it serves them."""
+    path = sitemap_dir / SHARD_ORDER_FILENAME
+    try:
+        tmp_path = path.with_suffix('.tmp')
+        tmp_path.write_text(json.dumps({'sitemaps': list(names)}), encoding='utf-8')
+        os.replace(tmp_path, path)
+        return True
+    except Exception as e:
+        logger.error(f"Error writing shard order {path}: {e}")
+        return False
+
+
+def read_shard_order(sitemap_dir: Path) -> Optional[List[str]]:
+    """Return the sitemaps the loader serves, in order, or None if it hasn't said yet."""
+    path = sitemap_dir / SHARD_ORDER_FILENAME
+    if not path.exists():
+        return None
+    try:
+        return list(json.loads(path.read_text(encoding='utf-8'))['sitemaps'])
+    except Exception as e:
+        logger.error(f"Error reading shard order {path}: {e}")
+        return None
+
+
+def _join(strings: Sequence[str]) -> bytes:
+    """Pack strings into one newline-separated UTF-8 blob."""
+    return '\n'.join(strings).encode('utf-8')
+
+
+def _split(blob: bytes, count: int) -> List[str]:
+    """Unpack a blob of count strings written by _join."""
+    return str(blob, 'utf-8').split('\n') if count else []
+
+
+def _padding(size: int) -> int:
+    """Bytes needed after size bytes to reach the next section boundary."""
+    return -size % SECTION_ALIGNMENT
+
+
+def _pack_postings(postings: Mapping[str, Sequence[int]]) -> Tuple[List[str], array, array]:
+    """Flatten posting lists into sorted keys, offsets and one array of ids."""
+    keys = sorted(postings)
+    offsets = array('I', [0])
+    packed = array('I')
+    for key in keys:
+        packed.extend(postings[key])
+        offsets.append(len(packed))
+    return keys, offsets, packed
+
+
+class _PackedPostings(Mapping):
+    """
+    Read-only token -> posting list mapping over a snapshot's packed postings.
+
+    Posting lists are slices of one mapped array, found by bisecting the
+    sorted vocabulary, so no per-token arrays are copied into the process.
+    """
+
+    def __init__(self, vocabulary: List[str], offsets: memoryview, postings: memoryview):
+        self._vocabulary = vocabulary
+        self._offsets = offsets
+        self._postings = postings
+
+    def __getitem__(self, token: str) -> memoryview:
+        i = bisect_left(self._vocabulary, token)
+        if i == len(self._vocabulary) or self._vocabulary[i] != token:
+            raise KeyError(token)
+        return self._postings[self._offsets[i]:self._offsets[i + 1]]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._vocabulary)
+
+    def __len__(self) -> int:
+        return len(self._vocabulary)
+
+
+def _part_sections(store: HymnStore, index: HymnSearchIndex) -> Dict[str, bytes]:
+    """Serialize one record type's store and index into named sections."""
+    vocabulary, posting_offsets, postings = _pack_postings(index.postings)
+    # Saved so processes sharing the snapshot don't each build their own
+    trigrams, trigram_offsets, trigram_postings = _pack_postings(index.trigram_index())
+
+    # The hymn store's columns, search keys included, are written as-is; titles are derived from slugs
+    return {
+        'prefixes': _join(store.prefixes),
+        'prefix_ids': bytes(store.prefix_ids),
+        'slugs': bytes(store.slugs),
+        'offsets': bytes(store.offsets),
+        'keys': bytes(store.keys),
+        'key_offsets': bytes(store.key_offsets),
+        'vocabulary': _join(vocabulary),
+        'posting_offsets': posting_offsets.tobytes(),
+        'postings': postings.tobytes(),
+        'sorted_ids': bytes(index.sorted_ids),
+        'trigrams': _join(trigrams),
+        'trigram_offsets': trigram_offsets.tobytes(),
+        'trigram_postings': trigram_postings.tobytes(),
+    }
+
+
+def write_snapshot(path: Path, manifest: Manifest, parts: Sequence[SnapshotPart]) -> bool:
+    """
+    Write the records parsed from a sitemap to path, replacing any previous snapshot.
+
+    parts holds one (record type, hymns, index) entry per record type found
+    in the sitemap, all saved together so a snapshot is always complete.
+    """
+    try:
+        sections: Dict[str, bytes] = {}
+        part_headers = []
+        for number, (record_type, hymns, index) in enumerate(parts):
+            store = hymns if isinstance(hymns, HymnStore) else HymnStore.from_hymns(hymns)
+            for name, data in _part_sections(store, index).items():
+                sections[f'{number}/{name}'] = data
+            part_headers.append({
+                'record_type': record_type,
+                'count': len(store),
+                'prefix_count': len(store.prefixes),
+            })
+
+        table = {}
+        offset = 0
+        for name, data in sections.items():
+            table[name] = [offset, len(data)]
+            offset += len(data) + _padding(len(data))
+
+        header = json.dumps({
+            'manifest': manifest,
+            'parts': part_headers,
+            'byteorder': sys.byteorder,
+            'itemsizes': _itemsizes(),
+            'sections': table,
+        }).encode('utf-8')
+        # Pad the header with spaces so the first section is aligned too
+        header += b' ' * _padding(_PREAMBLE.size + len(header))
+
+        # Write to a temporary file first so a crash never leaves a torn snapshot,
+        # and so processes that have the old one mapped are unaffected
+        tmp_path = path.with_suffix('.tmp')
+        with open(tmp_path, 'wb') as f:
+            f.write(_PREAMBLE.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(header)))
+            f.write(header)
+            for data in sections.values():
+                f.write(data)
+                f.write(bytes(_padding(len(data))))
+        os.replace(tmp_path, path)
+
+        logger.info(f"Wrote catalogue snapshot {path} ({_PREAMBLE.size + len(header) + offset} bytes)")
+        return True
+    except Exception as e:
+        logger.error(f"Error writing catalogue snapshot {path}: {e}")
+        return False
+
+
+def read_snapshot(path: Path, manifest: Manifest) -> Optional[List[SnapshotPart]]:
+    """
+    Map the records and indexes in path into memory.
+
+    Returns one (record type, hymns, index) entry per record type. The stores
+    and indexes read straight from the mapped file, so processes loading the
+    same snapshot share its memory. Returns None if there is no snapshot, it
+    was written by another version or machine, or the source sitemaps have
+    changed since it was written.
+    """
+    if not path.exists():
+        return None
+
+    try:
+        with open(path, 'rb') as f:
+            # The mapping stays open for as long as any of its sections are in use
+            data = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+        magic, version, header_size = _PREAMBLE.unpack_from(data)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            logger.info(f"Ignoring catalogue snapshot {path}: unsupported version")
+            return None
+
+        start = _PREAMBLE.size + header_size
+        header = json.loads(bytes(data[_PREAMBLE.size:start]))
+        if header['manifest'] != manifest:
+            logger.info(f"Ignoring catalogue snapshot {path}: sitemaps have changed")
+            return None
+        if header['byteorder'] != sys.byteorder or header['itemsizes'] != _itemsizes():
+            logger.info(f"Ignoring catalogue snapshot {path}: written on another platform")
+            return None
+
+        parts = []
+        for number, part in enumerate(header['parts']):
+            def section(name: str, typecode: Optional[str] = None) -> memoryview:
+                offset, length = header['sections'][f'{number}/{name}']
+                view = data[start + offset:start + offset + length]
+                return view.cast(typecode) if typecode else view
+
+            hymns = HymnStore(
+                _split(section('prefixes'), part['prefix_count']),
+                section('prefix_ids', 'I'),
+                section('slugs'),
+                section('offsets', 'I'),
+                section('keys'),
+                section('key_offsets', 'I')
+            )
+            if (len(hymns) != part['count'] or len(hymns.prefix_ids) != part['count']
+                    or len(hymns.key_offsets) != part['count'] + 1):
+                raise ValueError("record count mismatch")
+
+            posting_offsets = section('posting_offsets', 'I')
+            vocabulary = _split(section('vocabulary'), len(posting_offsets) - 1)
+            postings = _PackedPostings(vocabulary, posting_offsets, section('postings', 'I'))
+            trigram_offsets = section('trigram_offsets', 'I')
+            trigrams = _PackedPostings(_split(section('trigrams'), len(trigram_offsets) - 1),
+                                       trigram_offsets, section('trigram_postings', 'I'))
+            index = HymnSearchIndex.from_postings(hymns, postings, section('sorted_ids', 'I'), trigrams)
+            parts.append((part['record_type'], hymns, index))
+
+        logger.info(f"Loaded {sum(len(hymns) for _, hymns, _ in parts)} records "
+                    f"from catalogue snapshot {path}")
+        return parts
+    except Exception as e:
+        logger.error(f"Error reading catalogue snapshot {path}: {e}")
+        return None
@@ -0,0 +1,248 @@
+"""
+Fake Discord
+
+In-process stand-ins for the parts of discord.py the bot's commands use: the
+Interaction, its response and followup webhook, the user and the channel.
+Every API call waits a simulated network latency, may be answered with a 429
+that is retried after its Retry-After (as discord.py's HTTP client does), and
+is counted, so /find and hymn sharing can be driven and measured without a
+connection to Discord.
+"""
+
+import time
+import random
+import asyncio
+from types import SimpleNamespace
+from collections import Counter, deque
+from typing import Any, Callable, Deque, Dict, Hashable, List, Optional, Tuple
+
+import discord
+
+INTERACTION_DEADLINE = 3.0  # Seconds Discord waits for an interaction to be acknowledged
+
+_MISSING: Any = object()  # An argument that wasn't passed, as opposed to None
+
+
+class FakeDiscord:
+    """
+    The simulated Discord API shared by a set of fake objects.
+
+    Calls take latency seconds, give or take jitter. Each call is rate
+    limited with probability rate_limit_chance, and channel_limit, as
+    (messages, seconds), limits how fast one channel can be posted to, as
+    Discord does. A rate-limited call waits retry_after (or until the
+    channel's window frees up) and is sent again; like discord.py, it gives
+    up with an HTTPException after max_tries attempts.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        rate_limit_chance: float = 0.0,
+        retry_after: float = 0.5,
+        channel_limit: Optional[Tuple[int, float]] = None,
+        max_tries: int = 5,
+        seed: int = 0,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit_chance = rate_limit_chance
+        self.retry_after = retry_after
+        self.channel_limit = channel_limit
+        self.max_tries = max_tries
+        self.clock = clock
+        self._random = random.Random(seed)
+        self._sent: Dict[Hashable, Deque[float]] = {}  # Channel -> times of its recent messages
+        self.calls: Counter = Counter()         # Route -> calls completed
+        self.rate_limited: Counter = Counter()  # Route -> 429s received
+        self.expired_interactions = 0  # Interactions first answered after INTERACTION_DEADLINE
+        self.failed: Counter = Counter()  # Route -> calls that gave up after max_tries 429s
+
+    async def request(self, route: str, channel: Optional[Hashable] = None):
+        """Make one simulated API call, retrying it while it's rate limited."""
+        for tries in range(1, self.max_tries + 1):
+            delay = self.latency + self._random.uniform(-self.jitter, self.jitter)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            retry_after = self._retry_after(channel)
+            if retry_after is None:
+                self.calls[route] += 1
+                return
+            self.rate_limited[route] += 1
+            if tries < self.max_tries:
+                await asyncio.sleep(retry_after)
+        self.failed[route] += 1
+        raise discord.HTTPException(_TooManyRequests(), "You are being rate limited.")
+
+    def _retry_after(self, channel: Optional[Hashable]) -> Optional[float]:
+        """Return how long to wait if this call gets a 429, or None if it goes through."""
+        if self.rate_limit_chance and self._random.random() < self.rate_limit_chance:
+            return self.retry_after
+        if channel is None or self.channel_limit is None:
+            return None
+
+        messages, window = self.channel_limit
+        now = self.clock()
+        sent = self._sent.setdefault(channel, deque())
+        while sent and now - sent[0] >= window:
+            sent.popleft()
+        if len(sent) >= messages:
+            return sent[0] + window - now
+        sent.append(now)
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the calls made and 429s received, by route."""
+        return {
+            'calls': dict(self.calls),
+            'rate_limited': dict(self.rate_limited),
+            'failed': dict(self.failed),
+            'expired_interactions': self.expired_interactions,
+        }
+
+
+class _TooManyRequests:
+    """The parts of an aiohttp response that discord.HTTPException reads."""
+
+    status = 429
+    reason = "Too Many Requests"
+
+
+class FakeMessage:
+    """A message the bot sent or edited."""
+
+    def __init__(self, content: Optional[str] = None, embed: Optional[discord.Embed] = None,
+                 view: Optional[discord.ui.View] = None, ephemeral: bool = False,
+                 embeds: Optional[List[discord.Embed]] = None):
+        self.content = content
+        self.embed = embed
+        self.embeds = embeds if embeds is not None else [embed] if embed is not None else []
+        self.view = view
+        self.ephemeral = ephemeral
+
+    def edit(self, content: Any = _MISSING, embed: Any = _MISSING, view: Any = _MISSING):
+        """Apply an edit; arguments that weren't passed are left as they were."""
+        if content is not _MISSING:
+            self.content = content
+        if embed is not _MISSING:
+            self.embed = embed
+            self.embeds = [embed] if embed is not None else []
+        if view is not _MISSING:
+            self.view = view
+
+
+class FakeUser:
+    """The member who used a command."""
+
+    def __init__(self, user_id: int, display_name: str):
+        self.id = user_id
+        self.display_name = display_name
+        self.name = display_name
+
+
+class FakeChannel:
+    """A text channel, keeping every message posted to it."""
+
+    def __init__(self, api: FakeDiscord, channel_id: int):
+        self.api = api
+        self.id = channel_id
+        self.messages: List[FakeMessage] = []
+
+    async def send(self, content: Optional[str] = None, *, embed: Optional[discord.Embed] = None,
+                   embeds: Optional[List[discord.Embed]] = None,
+                   view: Optional[discord.ui.View] = None) -> FakeMessage:
+        await self.api.request('channel.send', channel=self.id)
+        message = FakeMessage(content, embed, view, embeds=embeds)
+        self.messages.append(message)
+        return message
+
+
+class FakeInteractionResponse:
+    """The initial response to an interaction, which can only be sent once."""
+
+    def __init__(self, interaction: 'FakeInteraction'):
+        self._interaction = interaction
+        self._done = False
+
+    def is_done(self) -> bool:
+        return self._done
+
+    async def _respond(self, route: str):
+        if self._done:
+            raise discord.InteractionResponded(self._interaction)
+        self._done = True
+        if self._interaction.api.clock() - self._interaction.created_at > INTERACTION_DEADLINE:
+            # Discord would answer 404 Unknown interaction; count it and carry on
+            self._interaction.api.expired_interactions += 1
+        await self._interaction.api.request(route)
+
+    async def defer(self, *, ephemeral: bool = False, thinking: bool = False):
+        await self._respond('interaction.defer')
+        self._interaction.original_response = FakeMessage(ephemeral=ephemeral)
+
+    async def send_message(self, content: Optional[str] = None, *, embed: Optional[discord.Embed] = None,
+                           view: Optional[discord.ui.View] = None, ephemeral: bool = False):
+        await self._respond('interaction.send_message')
+        self._interaction.original_response = FakeMessage(content, embed, view, ephemeral)
+
+    async def edit_message(self, *, content: Any = _MISSING, embed: Any = _MISSING, view: Any = _MISSING):
+        """Edit the message the component was attached to."""
+        await self._respond('interaction.edit_message')
+        if self._interaction.message is not None:
+            self._interaction.message.edit(content, embed, view)
+
+
+class FakeFollowup:
+    """The interaction's webhook, for messages after the initial response."""
+
+    def __init__(self, interaction: 'FakeInteraction'):
+        self._interaction = interaction
+
+    async def send(self, content: Optional[str] = None, *, embed: Optional[discord.Embed] = None,
+                   view: Optional[discord.ui.View] = None, ephemeral: bool = False) -> FakeMessage:
+        await self._interaction.api.request('webhook.send')
+        message = FakeMessage(content, embed, view, ephemeral)
+        self._interaction.followups.append(message)
+        return message
+
+
+class FakeInteraction:
+    """
+    A slash command or component interaction.
+
+    Offers the attributes and coroutines the bot uses on discord.Interaction:
+    user, channel, data, namespace, response, followup and
+    edit_original_response. For a component interaction, message is the
+    message holding the component.
+    """
+
+    def __init__(
+        self,
+        api: FakeDiscord,
+        channel: FakeChannel,
+        user: FakeUser,
+        data: Optional[Dict[str, Any]] = None,
+        namespace: Optional[Dict[str, Any]] = None,
+        message: Optional[FakeMessage] = None
+    ):
+        self.api = api
+        self.channel = channel
+        self.user = user
+        self.data = data or {}
+        self.namespace = SimpleNamespace(**(namespace or {}))  # Options the user has filled in
+        self.message = message
+        self.created_at = api.clock()
+        self.response = FakeInteractionResponse(self)
+        self.followup = FakeFollowup(self)
+        self.original_response: Optional[FakeMessage] = None
+        self.followups: List[FakeMessage] = []
+
+    async def edit_original_response(self, *, content: Any = _MISSING, embed: Any = _MISSING,
+                                     view: Any = _MISSING) -> FakeMessage:
+        await self.api.request('webhook.edit')
+        if self.original_response is None:
+            raise discord.ClientException("The interaction hasn't been responded to")
+        self.original_response.edit(content, embed, view)
+        return self.original_response
@@ -0,0 +1,100 @@
+"""
+Hymn Payloads
+
+This module memoizes the Discord payloads built for hymns: the truncated select
+menu labels and descriptions, whole option lists for repeated result sets, and
+the embed shared with the channel. Hot queries then reuse them instead of
+rebuilding them on the interaction path.
+"""
+
+from typing import Any, Dict, List, Sequence, Tuple
+
+import discord
+
+from query_cache import QueryCache
+
+# Discord's limit for select option labels and descriptions
+OPTION_TEXT_LIMIT = 100
+
+DEFAULT_MAX_HYMNS = 4096
+DEFAULT_MAX_OPTION_LISTS = 1024
+
+
+def truncate(text: str, limit: int = OPTION_TEXT_LIMIT) -> str:
+    """Shorten text to limit characters, marking the cut with an ellipsis."""
+    return text if len(text) <= limit else text[:limit - 3] + "..."
+
+
+class HymnPayload:
+    """Pre-rendered pieces of one hymn's Discord messages."""
+
+    __slots__ = ('title', 'url', 'label', 'description', 'embed')
+
+    def __init__(self, hymn: Dict[str, str]):
+        self.title = hymn['title']
+        self.url = hymn['url']
+        self.label = truncate(self.title)
+        self.description = truncate(self.url)
+        # Kept as a dict so every share gets its own Embed to add a footer to
+        self.embed: Dict[str, Any] = discord.Embed(
+            title=self.title,
+            url=self.url,
+            description=f"[View on Hymnary]({self.url})",
+            color=discord.Color.blue()
+        ).to_dict()
+
+
+class HymnPayloads:
+    """
+    LRU caches of hymn payloads, keyed by URL, and of select option lists.
+
+    A hymn's title is derived from its URL, so entries never go stale when
+    the catalogue is reloaded.
+    """
+
+    def __init__(self, max_hymns: int = DEFAULT_MAX_HYMNS, max_option_lists: int = DEFAULT_MAX_OPTION_LISTS):
+        self.hymns = QueryCache(max_hymns)
+        self.option_lists = QueryCache(max_option_lists)
+
+    def payload(self, hymn: Dict[str, str]) -> HymnPayload:
+        """Return the payload for a hymn, building it on first use."""
+        url = hymn['url']
+        payload = self.hymns.get(url)
+        if payload is None:
+            payload = HymnPayload(hymn)
+            self.hymns.put(url, payload)
+        return payload
+
+    def options(self, hymns: Sequence[Dict[str, str]]) -> List[discord.SelectOption]:
+        """Return select options for hymns, valued by position, reusing lists already built."""
+        key: Tuple[str, ...] = tuple(hymn['url'] for hymn in hymns)
+        options = self.option_lists.get(key)
+        if options is None:
+            options = []
+            for i, hymn in enumerate(hymns):
+                payload = self.payload(hymn)
+                options.append(discord.SelectOption(
+                    label=payload.label,
+                    description=payload.description,
+                    value=str(i)
+                ))
+            self.option_lists.put(key, options)
+        # The cached list is shared, so hand out a copy the menu can own
+        return list(options)
+
+    def share_embed(self, hymn: Dict[str, str], shared_by: str) -> discord.Embed:
+        """Return the embed that shares a hymn with the channel."""
+        embed = discord.Embed.from_dict(self.payload(hymn).embed)
+        embed.set_footer(text=f"Shared by {shared_by}")
+        return embed
+
+    def stats(self) -> Dict[str, float]:
+        """Return cache figures for the metrics endpoint."""
+        hymns = self.hymns.stats()
+        option_lists = self.option_lists.stats()
+        return {
+            'hymnbot_payload_cache_entries': hymns['entries'],
+            'hymnbot_payload_cache_hits_total': hymns['hits'],
+            'hymnbot_option_list_cache_entries': option_lists['entries'],
+            'hymnbot_option_list_cache_hits_total': option_lists['hits'],
+        }
@@ -0,0 +1,219 @@
+"""
+Hymn Store
+
+This module keeps hymn records in a compact columnar layout. Every field of a
+hymn is derivable from its URL, so only the URLs are stored: each is split
+into an interned prefix (e.g. "https://hymnary.org/text/") and a slug, and
+all slugs are packed into one buffer indexed by an offsets array. Each
+title's search key is worked out once when the store is built and packed the
+same way, so searches never normalize titles themselves.
+"""
+
+import re
+import unicodedata
+from array import array
+from urllib.parse import unquote, urlsplit
+from collections.abc import Mapping, Sequence
+from typing import Any, Dict, Iterable, Iterator, List, Tuple, Union
+
+RECORD_FIELDS = ('url', 'title', 'title_lower')
+
+_APOSTROPHES = re.compile("['\u2019\u02bc]")  # Dropped, so "O'er" matches "oer"
+_NON_WORD = re.compile(r'[\W_]+')  # Punctuation, symbols and whitespace, which separate words
+
+
+def split_url(url: str) -> Tuple[str, str]:
+    """Split a URL into its prefix and slug (the last path segment)."""
+    split = url.rstrip('/').rfind('/') + 1
+    return url[:split], url[split:]
+
+
+def record_type(url: str) -> str:
+    """Return the kind of record a URL points to: its first path segment, e.g. "text"."""
+    return urlsplit(url).path.strip('/').split('/')[0]
+
+
+def title_from_slug(slug: str) -> str:
+    """Turn a URL slug into a readable title."""
+    # Decode %-escapes (e.g. accented letters), replace underscores with spaces and capitalize
+    return unquote(slug.rstrip('/')).replace('_', ' ').title()
+
+
+def search_key(text: str) -> str:
+    """
+    Return the form of a title or query that searches compare.
+
+    Accents are folded away (NFKD, dropping combining marks), case is folded,
+    punctuation and symbols become word breaks and whitespace is collapsed,
+    so "Jesu, Joy" and "Ein feste Burg" match "jesu joy" and "ein feste burg".
+    """
+    if not text.isascii():
+        text = ''.join(c for c in unicodedata.normalize('NFKD', text) if not unicodedata.combining(c))
+    return _NON_WORD.sub(' ', _APOSTROPHES.sub('', text.casefold())).strip()
+
+
+class HymnRecord:
+    """
+    Lightweight view of one hymn in a HymnStore.
+
+    Supports the same hymn['url'] / hymn['title'] / hymn['title_lower'] access
+    as the plain dicts used elsewhere, with the title derived on demand.
+    """
+
+    __slots__ = ('_store', '_id')
+
+    def __init__(self, store: 'HymnStore', hymn_id: int):
+        self._store = store
+        self._id = hymn_id
+
+    @property
+    def url(self) -> str:
+        return self._store.url(self._id)
+
+    @property
+    def title(self) -> str:
+        return self._store.title(self._id)
+
+    @property
+    def title_lower(self) -> str:
+        return self._store.title_lower(self._id)
+
+    @property
+    def search_key(self) -> str:
+        return self._store.search_key(self._id)
+
+    def __getitem__(self, key: str) -> str:
+        if key not in RECORD_FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self[key] if key in RECORD_FIELDS else default
+
+    def keys(self) -> Tuple[str, ...]:
+        return RECORD_FIELDS
+
+    def to_dict(self) -> Dict[str, str]:
+        return {key: self[key] for key in RECORD_FIELDS}
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, HymnRecord):
+            return self.url == other.url
+        if isinstance(other, Mapping):
+            return self.to_dict() == dict(other)
+        return NotImplemented
+
+    def __hash__(self) -> int:
+        return hash(self.url)
+
+    def __repr__(self) -> str:
+        return f"HymnRecord({self.to_dict()!r})"
+
+
+class HymnStore(Sequence):
+    """Columnar, read-only sequence of hymns."""
+
+    def __init__(
+        self,
+        prefixes: List[str],
+        prefix_ids: Union[array, memoryview],
+        slugs: Union[bytes, memoryview],
+        offsets: Union[array, memoryview],
+        keys: Union[bytes, memoryview],
+        key_offsets: Union[array, memoryview]
+    ):
+        self.prefixes = prefixes    # Interned URL prefixes
+        self.prefix_ids = prefix_ids  # Prefix of each hymn, as an index into prefixes
+        self.slugs = slugs          # UTF-8 slugs of every hymn, back to back
+        self.offsets = offsets      # Hymn i's slug is slugs[offsets[i]:offsets[i + 1]]
+        self.keys = keys            # UTF-8 search keys of every hymn, back to back
+        self.key_offsets = key_offsets  # Hymn i's key is keys[key_offsets[i]:key_offsets[i + 1]]
+
+    @classmethod
+    def from_urls(cls, urls: Iterable[str]) -> 'HymnStore':
+        """Build a store from hymn URLs."""
+        prefixes: List[str] = []
+        prefix_lookup: Dict[str, int] = {}
+        prefix_ids = array('I')  # 32-bit, so corpora with over 65535 distinct prefixes still fit
+        slugs = bytearray()
+        offsets = array('I', [0])
+        keys = bytearray()
+        key_offsets = array('I', [0])
+
+        for url in urls:
+            prefix, slug = split_url(url)
+            prefix_id = prefix_lookup.get(prefix)
+            if prefix_id is None:
+                prefix_id = prefix_lookup[prefix] = len(prefixes)
+                prefixes.append(prefix)
+            prefix_ids.append(prefix_id)
+            slugs += slug.encode('utf-8')
+            offsets.append(len(slugs))
+            keys += search_key(title_from_slug(slug)).encode('utf-8')
+            key_offsets.append(len(keys))
+
+        return cls(prefixes, prefix_ids, bytes(slugs), offsets, bytes(keys), key_offsets)
+
+    @classmethod
+    def from_hymns(cls, hymns: Iterable[Mapping[str, str]]) -> 'HymnStore':
+        """Build a store from hymn dicts, keeping only their URLs."""
+        return cls.from_urls(hymn['url'] for hymn in hymns)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [HymnRecord(self, i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("hymn index out of range")
+        return HymnRecord(self, index)
+
+    def __iter__(self) -> Iterator[HymnRecord]:
+        for i in range(len(self)):
+            yield HymnRecord(self, i)
+
+    def slug(self, hymn_id: int) -> str:
+        """Return the URL slug of a hymn."""
+        return str(self.slugs[self.offsets[hymn_id]:self.offsets[hymn_id + 1]], 'utf-8')
+
+    def url(self, hymn_id: int) -> str:
+        """Return the full URL of a hymn."""
+        return self.prefixes[self.prefix_ids[hymn_id]] + self.slug(hymn_id)
+
+    def title(self, hymn_id: int) -> str:
+        """Return the readable title of a hymn."""
+        return title_from_slug(self.slug(hymn_id))
+
+    def title_lower(self, hymn_id: int) -> str:
+        """Return the lowercased title of a hymn."""
+        return self.title(hymn_id).lower()
+
+    def search_key(self, hymn_id: int) -> str:
+        """Return the search key of a hymn's title, as matched by searches."""
+        return str(self.keys[self.key_offsets[hymn_id]:self.key_offsets[hymn_id + 1]], 'utf-8')
+
+    def urls(self) -> Iterator[str]:
+        """Yield every URL, in order."""
+        for i in range(len(self)):
+            yield self.url(i)
+
+    def split_by_type(self) -> List[Tuple[str, 'HymnStore']]:
+        """
+        Return (record type, store) pairs with this store's records grouped by type.
+
+        Types are read from the interned prefixes, so a store holding a
+        single type (the usual case for one sitemap) is returned as-is.
+        """
+        prefix_types = [record_type(prefix) for prefix in self.prefixes]
+        types = sorted(set(prefix_types[prefix_id] for prefix_id in set(self.prefix_ids)))
+        if len(types) <= 1:
+            return [(types[0] if types else '', self)]
+
+        return [
+            (kind, HymnStore.from_urls(self.url(i) for i in range(len(self))
+                                       if prefix_types[self.prefix_ids[i]] == kind))
+            for kind in types
+        ]
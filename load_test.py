@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+Load test for /find and hymn sharing, run entirely offline.
+
+Builds a synthetic catalogue as benchmark.py does, then drives the bot's real
+find_hymn command and HymnSelectView.select_callback through fake_discord's
+interactions: each flow searches, then shares one of the results to its
+channel. Flows run CONCURRENCY at a time against a simulated Discord API with
+configurable latency and 429s, and throughput, per-stage latency percentiles
+and event loop lag are reported as JSON.
+
+    python load_test.py --flows 5000 --concurrency 500 --latency 0.05 --rate-limit 0.01
+"""
+
+import os
+import sys
+import json
+import random
+import asyncio
+import logging
+import argparse
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from benchmark import BASE_URL, make_queries, make_titles, percentiles, write_sitemaps
+from send_queue import ChannelSendQueue
+from fake_discord import FakeChannel, FakeDiscord, FakeInteraction, FakeUser
+from sitemap_manager import CATALOGUE_BACKEND, CATALOGUE_BACKENDS, SitemapManager
+
+DEFAULT_SIZE = 50_000
+DEFAULT_FLOWS = 2000
+DEFAULT_CONCURRENCY = 200
+DEFAULT_CHANNELS = 50
+LAG_INTERVAL = 0.01  # Seconds between event loop lag samples
+
+
+def load_bot():
+    """Import bot.py without a real token; it only connects when main() runs."""
+    os.environ.setdefault('DISCORD_TOKEN', 'load-test')
+    import bot
+    # bot.py logs every search at INFO; keep the report readable
+    logging.getLogger().setLevel(logging.WARNING)
+    return bot
+
+
+def outcome(interaction: FakeInteraction) -> str:
+    """Classify how /find answered: a menu of results, no results, a timeout or an error."""
+    message = interaction.followups[-1] if interaction.followups else interaction.original_response
+    if message is None:
+        return 'unanswered'
+    if message.view is not None:
+        return 'results'
+    content = message.content or ''
+    if content.startswith('❌ No hymns'):
+        return 'no_results'
+    if content.startswith('⏳'):
+        return 'timeout'
+    return 'error'
+
+
+async def sample_loop_lag(samples: List[float], interval: float = LAG_INTERVAL):
+    """Record how late the event loop wakes up from sleeps, until cancelled."""
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        samples.append(max(loop.time() - start - interval, 0.0))
+
+
+async def drive(
+    manager: SitemapManager,
+    queries: Sequence[str],
+    api: FakeDiscord,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    channel_count: int = DEFAULT_CHANNELS,
+    seed: int = 0
+) -> Dict[str, Any]:
+    """Run one /find + share flow per query, concurrency at a time, and return the measurements."""
+    bot = load_bot()
+    bot.sitemap_manager = manager
+    bot.send_queue = ChannelSendQueue()  # Fresh counters for this run
+    loop = asyncio.get_running_loop()
+    rng = random.Random(seed)
+    channels = [FakeChannel(api, channel_id) for channel_id in range(channel_count)]
+    semaphore = asyncio.Semaphore(concurrency)
+
+    latencies: Dict[str, List[float]] = {'find': [], 'share': [], 'flow': []}
+    outcomes: Dict[str, int] = {}
+
+    async def flow(number: int, query: str):
+        async with semaphore:
+            channel = channels[number % len(channels)]
+            user = FakeUser(number, f"user{number}")
+            command = FakeInteraction(api, channel, user)
+            start = loop.time()
+            await bot.find_hymn.callback(command, query, None)
+            found = loop.time()
+            latencies['find'].append(found - start)
+
+            kind = outcome(command)
+            outcomes[kind] = outcomes.get(kind, 0) + 1
+            if kind != 'results':
+                return
+
+            # The user picks one of the first page's results
+            view = command.followups[-1].view
+            choice = str(rng.randrange(len(view.hymns)))
+            select = FakeInteraction(api, channel, user, data={'values': [choice]},
+                                     message=command.followups[-1])
+            await view.select_callback(select)
+            shared = loop.time()
+            latencies['share'].append(shared - found)
+            latencies['flow'].append(shared - start)
+
+    lag: List[float] = []
+    sampler = asyncio.create_task(sample_loop_lag(lag))
+    start = loop.time()
+    try:
+        await asyncio.gather(*(flow(number, query) for number, query in enumerate(queries)))
+    finally:
+        elapsed = loop.time() - start
+        sampler.cancel()
+
+    return {
+        'flows': len(queries),
+        'concurrency': concurrency,
+        'channels': channel_count,
+        'elapsed_seconds': round(elapsed, 4),
+        'flows_per_second': round(len(queries) / elapsed, 2) if elapsed else None,
+        'outcomes': outcomes,
+        **{stage: percentiles(samples) for stage, samples in latencies.items() if samples},
+        'event_loop_lag': percentiles(lag) if lag else None,
+        'messages_posted': sum(len(channel.messages) for channel in channels),
+        'hymns_shared': sum(len(message.embeds) for channel in channels for message in channel.messages),
+        'send_queue': bot.send_queue.stats(),
+        'api': api.stats(),
+    }
+
+
+def run_load_test(
+    size: int = DEFAULT_SIZE,
+    flows: int = DEFAULT_FLOWS,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    channels: int = DEFAULT_CHANNELS,
+    latency: float = 0.0,
+    jitter: float = 0.0,
+    rate_limit: float = 0.0,
+    retry_after: float = 0.5,
+    channel_limit: Optional[Tuple[int, float]] = None,
+    seed: int = 0,
+    backend: str = CATALOGUE_BACKEND
+) -> Dict[str, Any]:
+    """Build a synthetic catalogue of size hymns and run the load test against it."""
+    titles = make_titles(size, seed)
+    queries = make_queries(titles, flows, seed)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        sitemap_dir = Path(tmpdir)
+        write_sitemaps(sitemap_dir, titles)
+        manager = SitemapManager(sitemap_dir=sitemap_dir, index_url=f"{BASE_URL}/sitemap.xml", backend=backend)
+        manager.load_all_hymns()
+
+        api = FakeDiscord(latency, jitter, rate_limit, retry_after, channel_limit, seed=seed)
+        result = asyncio.run(drive(manager, queries, api, concurrency, channels, seed))
+    return {'size': size, 'backend': backend, 'latency': latency, 'jitter': jitter,
+            'rate_limit': rate_limit, **result}
+
+
+def parse_channel_limit(value: str) -> Tuple[int, float]:
+    """Parse MESSAGES/SECONDS, e.g. 5/5."""
+    messages, seconds = value.split('/')
+    return int(messages), float(seconds)
+
+
+def main(argv: Sequence[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--size', type=int, default=DEFAULT_SIZE,
+                        help="catalogue size in URLs (default: %(default)s)")
+    parser.add_argument('--flows', type=int, default=DEFAULT_FLOWS,
+                        help="/find + share flows to run (default: %(default)s)")
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY,
+                        help="flows in progress at once (default: %(default)s)")
+    parser.add_argument('--channels', type=int, default=DEFAULT_CHANNELS,
+                        help="channels the flows are spread over (default: %(default)s)")
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help="seconds each Discord API call takes (default: %(default)s)")
+    parser.add_argument('--jitter', type=float, default=0.02,
+                        help="random +/- seconds added to each call (default: %(default)s)")
+    parser.add_argument('--rate-limit', type=float, default=0.0,
+                        help="chance that a call gets a 429 (default: %(default)s)")
+    parser.add_argument('--retry-after', type=float, default=0.5,
+                        help="Retry-After of those 429s, in seconds (default: %(default)s)")
+    parser.add_argument('--channel-limit', type=parse_channel_limit,
+                        help="rate limit posts per channel, as MESSAGES/SECONDS (e.g. 5/5)")
+    parser.add_argument('--seed', type=int, default=0, help="random seed (default: %(default)s)")
+    parser.add_argument('--backend', choices=CATALOGUE_BACKENDS, default=CATALOGUE_BACKEND,
+                        help="catalogue backend to search (default: %(default)s)")
+    parser.add_argument('--output', type=Path, help="write JSON here instead of stdout")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    print(f"Running {args.flows} flows against {args.size} URLs...", file=sys.stderr)
+    result = run_load_test(args.size, args.flows, args.concurrency, args.channels, args.latency, args.jitter,
+                           args.rate_limit, args.retry_after, args.channel_limit, args.seed, args.backend)
+
+    output = json.dumps(result, indent=2)
+    if args.output:
+        args.output.write_text(output + '\n')
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
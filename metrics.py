@@ -0,0 +1,199 @@
+"""
+Bot Metrics
+
+This module records timing histograms for the bot's hot paths and exposes them,
+along with gauges such as cache and index sizes, in the Prometheus text format.
+Recording a sample costs about a microsecond, so metrics are always on;
+serving them over HTTP or dumping them to the log is optional.
+"""
+
+import json
+import time
+import asyncio
+import logging
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds in seconds, from sub-millisecond index lookups to slow Discord round trips
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Catalogue loads take seconds to minutes
+LOAD_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+LOOP_LAG_INTERVAL = 0.5  # Seconds between event loop lag probes
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _format_labels(labels: Labels, extra: str = '') -> str:
+    """Format labels (plus an already formatted extra one) as {key="value",...}."""
+    parts = [f'{key}="{value}"' for key, value in labels]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+class Histogram:
+    """Counts of observed values by bucket, with their sum, for one set of labels."""
+
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # The last bucket is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, fraction: float) -> float:
+        """Estimate a quantile as the upper bound of the bucket containing it."""
+        rank = fraction * self.count
+        seen = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            seen += count
+            if seen >= rank and seen:
+                return bound
+        return 0.0
+
+
+class Metrics:
+    """Thread-safe registry of labelled timing histograms and gauge collectors."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms: Dict[str, Dict[Labels, Histogram]] = {}
+        self._buckets: Dict[str, Sequence[float]] = {}
+        self._help: Dict[str, str] = {}
+        self._collectors: List[Callable[[], Dict[str, float]]] = []
+
+    def describe(self, name: str, help_text: str, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        """Declare a histogram's help text and buckets; undeclared ones use the defaults."""
+        with self._lock:
+            self._help[name] = help_text
+            self._buckets[name] = buckets
+
+    def observe(self, name: str, value: float, **labels: str):
+        """Record one value, in seconds, in the named histogram."""
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram(self._buckets.get(name, DEFAULT_BUCKETS))
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name: str, **labels: str) -> Iterator[None]:
+        """Time the enclosed block into the named histogram, even if it raises."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def register_collector(self, collector: Callable[[], Dict[str, float]]):
+        """
+        Add a function returning gauge values, called each time metrics are read.
+
+        Values whose names end in _total are exported as counters.
+        """
+        with self._lock:
+            self._collectors.append(collector)
+
+    def _gauges(self) -> Dict[str, float]:
+        gauges = {}
+        for collector in list(self._collectors):
+            try:
+                gauges.update(collector())
+            except Exception as e:
+                logger.warning(f"Metrics collector failed: {e}")
+        return gauges
+
+    def render(self) -> str:
+        """Return every metric in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            for name in sorted(self._histograms):
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} histogram")
+                for labels, histogram in sorted(self._histograms[name].items()):
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets + (float('inf'),), histogram.counts):
+                        cumulative += count
+                        le = 'le="+Inf"' if bound == float('inf') else f'le="{bound}"'
+                        lines.append(f"{name}_bucket{_format_labels(labels, le)} {cumulative}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {histogram.sum}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+
+        for name, value in sorted(self._gauges().items()):
+            # Collectors report running totals under names ending in _total
+            lines.append(f"# TYPE {name} {'counter' if name.endswith('_total') else 'gauge'}")
+            lines.append(f"{name} {value}")
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self) -> Dict[str, object]:
+        """Return a compact summary (count, mean, p50, p99) of every metric, for logging."""
+        summary: Dict[str, object] = {}
+        with self._lock:
+            for name, series in self._histograms.items():
+                for labels, histogram in series.items():
+                    if not histogram.count:
+                        continue
+                    summary[name + _format_labels(labels)] = {
+                        'count': histogram.count,
+                        'mean': round(histogram.sum / histogram.count, 6),
+                        'p50': histogram.quantile(0.5),
+                        'p99': histogram.quantile(0.99),
+                    }
+        summary.update(self._gauges())
+        return summary
+
+
+# Registry shared by the whole bot
+METRICS = Metrics()
+METRICS.describe('hymnbot_find_stage_seconds', "Time spent in each stage of /find")
+METRICS.describe('hymnbot_select_stage_seconds', "Time spent in each stage of sharing a selected hymn")
+METRICS.describe('hymnbot_search_seconds', "Time to answer search_hymns, including cache hits")
+METRICS.describe('hymnbot_catalogue_load_seconds', "Time spent in each catalogue load phase", LOAD_BUCKETS)
+METRICS.describe('hymnbot_event_loop_lag_seconds', "How late the event loop ran a scheduled wakeup")
+
+
+async def monitor_event_loop(metrics: Metrics = METRICS, interval: float = LOOP_LAG_INTERVAL):
+    """Measure how late the event loop wakes up from sleeps, forever."""
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        metrics.observe('hymnbot_event_loop_lag_seconds', max(loop.time() - start - interval, 0.0))
+
+
+async def log_metrics(interval: float, metrics: Metrics = METRICS):
+    """Log a JSON summary of every metric every interval seconds, forever."""
+    while True:
+        await asyncio.sleep(interval)
+        logger.info(f"Metrics: {json.dumps(metrics.snapshot(), sort_keys=True)}")
+
+
+async def start_metrics_server(port: int, host: str = '127.0.0.1', metrics: Metrics = METRICS):
+    """Serve metrics at http://host:port/metrics; returns the runner, for cleanup."""
+    from aiohttp import web
+
+    async def handle(request: web.Request) -> web.Response:
+        return web.Response(text=metrics.render(), content_type='text/plain', charset='utf-8')
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Serving metrics on http://{host}:{port}/metrics")
+    return runner
@@ -0,0 +1,113 @@
+"""
+Query Cache
+
+This module keeps the results of recent searches so that popular queries are
+answered without searching the catalogue again. Entries are evicted least
+recently used first and can optionally expire after a fixed time.
+"""
+
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+from hymn_store import search_key
+
+DEFAULT_MAX_ENTRIES = 1024
+DEFAULT_TTL = None  # Seconds an entry stays valid; None keeps it until evicted
+
+
+def normalize_query(query: str) -> str:
+    """
+    Return the form of a query used as a cache key.
+
+    This is the query's search key, which is all that searches match against,
+    so queries differing only in case, accents or punctuation share an entry.
+    """
+    return search_key(query)
+
+
+class QueryCache:
+    """Thread-safe LRU cache of search results with an optional time to live."""
+
+    def __init__(
+        self,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        ttl: Optional[float] = DEFAULT_TTL,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        self._entries: 'OrderedDict[Hashable, Tuple[float, Any]]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0  # Entries dropped to make room, not counting expiries
+        self.expirations = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Return the cached value for key, or None if it is missing or expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            stored_at, value = entry
+            if self.ttl is not None and self.clock() - stored_at > self.ttl:
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: Any):
+        """Store value under key, evicting the least recently used entries if full."""
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (self.clock(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def discard(self, key: Hashable):
+        """Drop the entry for key, if there is one."""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def purge_expired(self) -> int:
+        """Drop every expired entry, returning how many were dropped."""
+        if self.ttl is None:
+            return 0
+        with self._lock:
+            now = self.clock()
+            expired = [key for key, (stored_at, _) in self._entries.items() if now - stored_at > self.ttl]
+            for key in expired:
+                del self._entries[key]
+            self.expirations += len(expired)
+            return len(expired)
+
+    def clear(self):
+        """Drop every entry, e.g. after the catalogue has been replaced."""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """Return the cache's size and hit/miss/eviction counters."""
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
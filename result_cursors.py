@@ -0,0 +1,98 @@
+"""
+Result Cursors
+
+This module keeps a search's ranked results between pages. A select menu can
+show only 25 hymns, so /find hands the rest of the results to a cursor and its
+Next/Previous buttons page through them without searching again. Cursors
+expire along with the view paging through them, and only a bounded number are
+kept, so abandoned ones are reclaimed.
+"""
+
+import time
+import itertools
+from typing import Callable, Dict, Iterable, List, Optional
+
+from query_cache import QueryCache
+
+PAGE_SIZE = 25             # Discord's limit for select menu options
+CURSOR_MAX_RESULTS = 100   # Results a /find search keeps for paging (four pages)
+CURSOR_TTL = 180           # Seconds an unused cursor lives; matches HymnSelectView's timeout
+DEFAULT_MAX_CURSORS = 1000
+
+
+class ResultCursor:
+    """
+    Pages over a stream of results, pulling from it only as far as asked.
+
+    Pages already pulled are kept, so going back is free.
+    """
+
+    __slots__ = ('page_size', '_results', '_fetched', '_exhausted')
+
+    def __init__(self, results: Iterable[Dict[str, str]], page_size: int = PAGE_SIZE):
+        self.page_size = page_size
+        self._results = iter(results)
+        self._fetched: List[Dict[str, str]] = []
+        self._exhausted = False
+
+    def _fill(self, count: int):
+        """Pull results until count are fetched or the stream runs out."""
+        if self._exhausted or len(self._fetched) >= count:
+            return
+        self._fetched.extend(itertools.islice(self._results, count - len(self._fetched)))
+        if len(self._fetched) < count:
+            self._exhausted = True
+            self._results = iter(())
+
+    def page(self, number: int) -> List[Dict[str, str]]:
+        """Return page number (from 0); empty past the last page."""
+        start = number * self.page_size
+        self._fill(start + self.page_size)
+        return self._fetched[start:start + self.page_size]
+
+    def has_next(self, number: int) -> bool:
+        """Whether there are results after page number."""
+        # One result past the page is enough to know
+        self._fill((number + 1) * self.page_size + 1)
+        return len(self._fetched) > (number + 1) * self.page_size
+
+
+class CursorStore:
+    """Bounded, expiring registry of open cursors, looked up by id."""
+
+    def __init__(
+        self,
+        max_cursors: int = DEFAULT_MAX_CURSORS,
+        ttl: Optional[float] = CURSOR_TTL,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        self._cursors = QueryCache(max_cursors, ttl, clock)
+        self._ids = itertools.count(1)
+
+    def open(self, results: Iterable[Dict[str, str]], page_size: int = PAGE_SIZE) -> int:
+        """Start paging over results and return the new cursor's id."""
+        # Reclaim cursors whose views have timed out before adding another
+        self._cursors.purge_expired()
+        cursor_id = next(self._ids)
+        self._cursors.put(cursor_id, ResultCursor(results, page_size))
+        return cursor_id
+
+    def get(self, cursor_id: int) -> Optional[ResultCursor]:
+        """Return an open cursor, keeping it alive for another ttl; None if it has expired."""
+        cursor = self._cursors.get(cursor_id)
+        if cursor is not None:
+            self._cursors.put(cursor_id, cursor)
+        return cursor
+
+    def close(self, cursor_id: int):
+        """Drop a cursor that is no longer needed."""
+        self._cursors.discard(cursor_id)
+
+    def stats(self) -> Dict[str, float]:
+        """Return cursor figures for the metrics endpoint."""
+        stats = self._cursors.stats()
+        return {
+            'hymnbot_result_cursors_open': stats['entries'],
+            'hymnbot_result_cursors_evicted_total': stats['evictions'],
+            'hymnbot_result_cursors_expired_total': stats['expirations'],
+        }
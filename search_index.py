@@ -0,0 +1,666 @@
+"""
+Hymn Search Index
+
+This module provides an inverted token index over hymn titles so that
+searches don't need to scan every hymn in the catalogue. Titles are matched
+by their search keys (see hymn_store.search_key), so only the query has to be
+normalized when a search runs.
+"""
+
+import re
+import heapq
+import logging
+import itertools
+from array import array
+from bisect import bisect_left
+from operator import itemgetter
+from typing import Callable, Dict, Iterable, Iterator, List, Mapping, Optional, Pattern, Sequence, Set, Tuple
+
+from hymn_store import search_key
+
+logger = logging.getLogger(__name__)
+
+# Separators between words in a search key
+TOKEN_SEPARATOR = re.compile(r'[\s_]+')
+
+# Once the candidate set is this small, verify directly instead of intersecting further
+VERIFY_THRESHOLD = 64
+
+# Most hymns an autocomplete lookup will examine, keeping each keystroke sub-millisecond
+COMPLETION_BUDGET = 256
+
+# A typed word starting more vocabulary words than this is common enough that walking
+# the catalogue finds its completions sooner than merging their posting lists
+MAX_COMPLETION_POSTINGS = 64
+
+# Most matching hymns a search will score, so broad queries stay cheap to rank
+RANK_BUDGET = 2000
+
+# Lone fragments found in more words than this are cheaper to answer by scanning
+MAX_MERGED_POSTINGS = 512
+
+# How well a title matches a query, best first
+TIER_EXACT = 0      # The whole title
+TIER_PREFIX = 1     # The start of the title
+TIER_WORD = 2       # The start of a later word
+TIER_SUBSTRING = 3  # Anywhere else
+
+# (tier, search key length, hymn id): smaller is better
+RankKey = Tuple[int, int, int]
+
+# Fall back to fuzzy matching when an exact search finds fewer hits than this
+FUZZY_MIN_RESULTS = 3
+
+# Most trigram postings read per misspelled word, keeping fuzzy lookups in a fixed budget
+FUZZY_POSTINGS_BUDGET = 20000
+
+# Most words sharing trigrams with a misspelled word that get an edit-distance check
+FUZZY_MAX_CANDIDATES = 200
+
+# Spelling corrections considered per word, and corrected queries tried per search
+FUZZY_MAX_VARIANTS = 3
+FUZZY_MAX_QUERIES = 8
+
+# (total edit distance, tier, search key length, hymn id): smaller is better
+FuzzyKey = Tuple[int, int, int, int]
+
+
+def compile_query(query: str) -> Pattern:
+    """Compile a search query into the regex used to match search keys."""
+    return re.compile(re.escape(search_key(query)))
+
+
+class QueryMatcher:
+    """A compiled search query that can also grade how well a title matches."""
+
+    def __init__(self, query: str):
+        self.query = search_key(query)
+        self.regex = compile_query(self.query)
+        # Same pattern, but only where it isn't preceded by part of a word
+        self.word_regex = re.compile(r'(?<![^ ])' + self.regex.pattern)
+
+    def tier(self, key: str) -> Optional[int]:
+        """Return the match tier of a title's search key, or None if it doesn't match."""
+        match = self.regex.search(key)
+        if match is None:
+            return None
+        if match.start() == 0:
+            return TIER_EXACT if self.regex.fullmatch(key) else TIER_PREFIX
+        if self.word_regex.search(key):
+            return TIER_WORD
+        return TIER_SUBSTRING
+
+
+def tokenize(key: str) -> List[str]:
+    """Split a search key into its words."""
+    return [token for token in TOKEN_SEPARATOR.split(key) if token]
+
+
+def trigrams(word: str) -> Set[str]:
+    """Return the trigrams of a word, padded so its first and last letters count fully."""
+    padded = f'${word}$'
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def max_edit_distance(word: str) -> int:
+    """Return how many typos to tolerate in a word of this length."""
+    if len(word) < 4:
+        return 0
+    return 1 if len(word) <= 6 else 2
+
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+    """
+    Return the edit distance between a and b, counting adjacent swaps as one edit.
+
+    Stops early and returns limit + 1 once the distance must exceed limit.
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+
+    previous_previous: List[int] = []
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous_previous[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+        previous_previous, previous = previous, current
+    return min(previous[-1], limit + 1)
+
+
+def rank_matches(
+    matcher: QueryMatcher,
+    prefix_matches: Iterable[Tuple[str, int]],
+    candidates: Iterable[Tuple[str, int]],
+    max_results: int,
+    budget: int
+) -> List[RankKey]:
+    """
+    Return the rank keys of the best max_results matches, best first.
+
+    prefix_matches are (title, hymn id) pairs for titles starting with the
+    query, in title order; candidates are pairs that might match anywhere,
+    in catalogue order. A bounded heap keeps only the best max_results, and
+    at most budget matches are scored.
+    """
+    # Worst match on top, so it can be dropped as better ones arrive
+    heap: List[Tuple[int, int, int]] = []
+
+    def offer(hymn_id: int, tier: int, title: str):
+        entry = (-tier, -len(title), -hymn_id)
+        if len(heap) < max_results:
+            heapq.heappush(heap, entry)
+        elif entry > heap[0]:
+            heapq.heapreplace(heap, entry)
+
+    # Exact and prefix matches come first
+    prefix_ids = set()
+    for title, hymn_id in prefix_matches:
+        prefix_ids.add(hymn_id)
+        tier = matcher.tier(title)
+        if tier is not None:
+            offer(hymn_id, tier, title)
+
+    # Then everything else, in catalogue order
+    scored = len(prefix_ids)
+    for title, hymn_id in candidates:
+        if scored >= budget:
+            break
+        if hymn_id in prefix_ids:
+            continue
+        # Verify the phrase: fragments must be adjacent and in order
+        tier = matcher.tier(title)
+        if tier is not None:
+            offer(hymn_id, tier, title)
+            scored += 1
+
+    return sorted((-tier, -length, -hymn_id) for tier, length, hymn_id in heap)
+
+
+def search_corrected(
+    query: str,
+    max_results: int,
+    is_word: Callable[[str], bool],
+    similar_words: Callable[[str, int], List[Tuple[int, str]]],
+    search_ranked: Callable[[str, int], List[Tuple[RankKey, Dict[str, str]]]]
+) -> List[Tuple[FuzzyKey, Dict[str, str]]]:
+    """
+    Return the best max_results (rank key, hymn) pairs for a query with typos.
+
+    Each word is_word rejects is swapped for its closest similar_words, and
+    the corrected queries are run through search_ranked. Hymns are ranked
+    by how many edits their query needed, then as search_ranked ranks them.
+    """
+    words = tokenize(search_key(query))
+    if not words:
+        return []
+
+    options = []
+    for word in words:
+        if is_word(word):
+            options.append([(0, word)])
+            continue
+        similar = similar_words(word, max_edit_distance(word))[:FUZZY_MAX_VARIANTS]
+        if not similar:
+            return []
+        options.append(similar)
+
+    # Try the corrected queries needing the fewest edits first
+    best: Dict[int, Tuple[FuzzyKey, Dict[str, str]]] = {}
+    for correction in cheapest_corrections(options, FUZZY_MAX_QUERIES):
+        distance = sum(d for d, _ in correction)
+        if distance == 0:
+            continue  # Nothing was corrected, so the exact search already covered it
+        phrase = ' '.join(word for _, word in correction)
+        for (tier, length, hymn_id), hymn in search_ranked(phrase, max_results):
+            key = (distance, tier, length, hymn_id)
+            if hymn_id not in best or key < best[hymn_id][0]:
+                best[hymn_id] = (key, hymn)
+
+    return heapq.nsmallest(max_results, best.values(), key=itemgetter(0))
+
+
+def cheapest_corrections(
+    options: Sequence[Sequence[Tuple[int, str]]],
+    count: int
+) -> Iterator[Tuple[Tuple[int, str], ...]]:
+    """
+    Yield up to count picks of one (distance, word) option per word, fewest edits first.
+
+    Each word's options must be sorted by distance. Picks are found best
+    first from a heap rather than by ranking every combination, so a long
+    query full of typos costs about count * len(options) steps, not one
+    step per combination. Ties come out in the order the product of the
+    options would list them.
+    """
+    start = (0,) * len(options)
+    heap = [(sum(choices[0][0] for choices in options), start)]
+    queued = {start}
+    while heap and count > 0:
+        distance, picks = heapq.heappop(heap)
+        yield tuple(choices[pick] for choices, pick in zip(options, picks))
+        count -= 1
+        # The next cheapest pick differs from one already taken in one word
+        for number, pick in enumerate(picks):
+            if pick + 1 < len(options[number]):
+                successor = picks[:number] + (pick + 1,) + picks[number + 1:]
+                if successor not in queued:
+                    queued.add(successor)
+                    step = options[number][pick + 1][0] - options[number][pick][0]
+                    heapq.heappush(heap, (distance + step, successor))
+
+
+def choose_trigrams(counts: Mapping[str, int], max_distance: int) -> Tuple[List[str], int]:
+    """
+    Choose which of a word's trigrams to read when looking for similar words.
+
+    counts maps each trigram to the number of words having it. Trigrams are
+    read rarest first, skipping any that would take the total past
+    FUZZY_POSTINGS_BUDGET. Returns the trigrams to read and how many of
+    them a word must share to be within max_distance edits.
+    """
+    # Each edit changes at most three trigrams; skipped trigrams lower the bar too
+    required = len(counts) - 3 * max_distance
+    read = 0
+    chosen = []
+    for gram in sorted(counts, key=lambda gram: (counts[gram], gram)):
+        if read + counts[gram] > FUZZY_POSTINGS_BUDGET:
+            required -= 1
+            continue
+        read += counts[gram]
+        chosen.append(gram)
+    return chosen, max(required, 1)
+
+
+def closest_words(word: str, max_distance: int, candidates: Iterable[Tuple[str, int]]) -> List[Tuple[int, str]]:
+    """Return (edit distance, candidate) pairs within max_distance of word, closest first."""
+    similar = []
+    for token, hymn_count in candidates:
+        distance = edit_distance(word, token, max_distance)
+        if distance <= max_distance:
+            # Prefer closer words, then more common ones
+            similar.append((distance, -hymn_count, token))
+    similar.sort()
+    return [(distance, token) for distance, _, token in similar]
+
+
+def add_fuzzy_matches(
+    results: List[Dict[str, str]],
+    max_results: int,
+    search_fuzzy: Callable[[int], Iterable[Tuple[Tuple[int, ...], Dict[str, str]]]]
+) -> List[Dict[str, str]]:
+    """
+    Top up results with fuzzy matches when there are fewer than FUZZY_MIN_RESULTS.
+
+    Too few exact hits usually means a typo. search_fuzzy(count) returns up
+    to count (rank key, hymn) pairs, best first; hymns already in results
+    are skipped, so enough are asked for to fill up after skipping them.
+    """
+    if len(results) >= min(max_results, FUZZY_MIN_RESULTS):
+        return results
+    seen = {hymn['url'] for hymn in results}
+    for _, hymn in search_fuzzy(max_results + len(seen)):
+        if hymn['url'] not in seen:
+            seen.add(hymn['url'])
+            results.append(hymn)
+            if len(results) >= max_results:
+                break
+    return results
+
+
+def key_lookup(hymns: Sequence[Dict[str, str]]) -> Callable[[int], str]:
+    """Return a function giving the search key of the hymn with a given id."""
+    # Hymn stores keep their keys packed, without building a record per hymn
+    direct = getattr(hymns, 'search_key', None)
+    if callable(direct):
+        return direct
+    # Other records are keyed once here rather than on every search
+    keys = [search_key(hymn['title']) for hymn in hymns]
+    return keys.__getitem__
+
+
+def complete_titles(indexes: Sequence['HymnSearchIndex'], text: str, limit: int = 25) -> List[Dict[str, str]]:
+    """
+    Return up to limit hymns from indexes for autocompleting a partially typed title.
+
+    Titles starting with the text come first, in title order, followed by
+    titles with a later word starting with it, in catalogue order. Each
+    part looks at no more than COMPLETION_BUDGET hymns across all the
+    indexes, so every keystroke does a bounded amount of work; when common
+    words leave more candidates than that, later ones are left out.
+    """
+    text = search_key(text)
+    if not text or not indexes:
+        return []
+
+    results: List[Dict[str, str]] = []
+    seen: Set[str] = set()
+
+    def add(title: str, hymn: Dict[str, str]) -> bool:
+        if title not in seen:
+            seen.add(title)
+            results.append(hymn)
+        return len(results) >= limit
+
+    # Whole-title prefix matches straight from the sorted arrays
+    prefix_matches = [index.iter_title_prefix(text, COMPLETION_BUDGET) for index in indexes]
+    for title, hymn in itertools.islice(heapq.merge(*prefix_matches, key=itemgetter(0)), COMPLETION_BUDGET):
+        if add(title, hymn):
+            return results
+
+    # Titles where a later word starts the typed text, sharing one budget between indexes
+    needle = ' ' + text
+    budget = COMPLETION_BUDGET
+    for index in indexes:
+        if budget <= 0:
+            break
+        hymn_ids, examined = index.word_candidates(text, budget)
+        budget -= examined
+        for hymn_id in hymn_ids:
+            title = index.search_key(hymn_id)
+            if needle in title and add(title, index.hymns[hymn_id]):
+                return results
+    return results
+
+
+class HymnSearchIndex:
+    """Inverted index mapping title tokens to sorted posting lists of hymn ids."""
+
+    def __init__(self, hymns: Sequence[Dict[str, str]]):
+        key = key_lookup(hymns)
+        postings: Dict[str, array] = {}
+        for hymn_id in range(len(hymns)):
+            for token in set(tokenize(key(hymn_id))):
+                posting = postings.get(token)
+                if posting is None:
+                    posting = postings[token] = array('I')
+                # Ids are visited in order, so every posting list stays sorted
+                posting.append(hymn_id)
+
+        # Hymn ids in search key order, for prefix completion
+        order = sorted(range(len(hymns)), key=key)
+
+        self._set_structures(hymns, postings, array('I', order))
+        logger.info(f"Indexed {len(hymns)} hymns ({len(postings)} distinct tokens)")
+
+    @classmethod
+    def from_postings(
+        cls,
+        hymns: Sequence[Dict[str, str]],
+        postings: Mapping[str, Sequence[int]],
+        sorted_ids: Sequence[int],
+        trigrams: Optional[Mapping[str, Sequence[int]]] = None
+    ) -> 'HymnSearchIndex':
+        """
+        Rebuild an index from previously computed posting lists and title order.
+
+        Any read-only mapping of sorted id sequences works, such as memoryviews
+        over a mapped snapshot. trigrams is a saved trigram_index(), if any.
+        """
+        index = cls.__new__(cls)
+        index._set_structures(hymns, postings, sorted_ids)
+        index._trigrams = trigrams
+        return index
+
+    def _set_structures(
+        self,
+        hymns: Sequence[Dict[str, str]],
+        postings: Mapping[str, Sequence[int]],
+        sorted_ids: Sequence[int]
+    ):
+        """Store the index structures and derive the sorted vocabularies."""
+        self.hymns = hymns
+        self.search_key = key_lookup(hymns)
+        self.postings = postings
+        self.vocabulary = sorted(postings)
+        self.reversed_vocabulary = sorted(token[::-1] for token in postings)
+        self.sorted_ids = sorted_ids
+        # Built on the first fuzzy search, since most searches never need it
+        self._trigrams: Optional[Mapping[str, Sequence[int]]] = None
+
+    def search(self, query: str, max_results: int = 10) -> List[Dict[str, str]]:
+        """Return the best max_results hymns matching the query."""
+        return [hymn for _, hymn in self.search_ranked(query, max_results)]
+
+    def search_ranked(
+        self,
+        query: str,
+        max_results: int = 10,
+        budget: int = RANK_BUDGET
+    ) -> List[Tuple[RankKey, Dict[str, str]]]:
+        """
+        Return the best max_results (rank key, hymn) pairs matching the query, best first.
+
+        Hymns are ranked by match tier, then by title length, then by catalogue
+        order. A bounded heap keeps only the best max_results, and at most
+        budget matches are scored, so very broad queries stay cheap.
+        """
+        matcher = QueryMatcher(query)
+        query = matcher.query
+
+        # Exact and prefix matches come straight from the title-sorted ids
+        prefix_matches = self._iter_title_prefix_ids(query, budget)
+
+        # Then everything else the index can find, in catalogue order
+        fragments = query.split(' ')
+        if not query:
+            # An empty query (or one of only punctuation) matches every hymn
+            candidates: Iterable[int] = range(len(self.hymns))
+        else:
+            candidates = self._candidates(fragments)
+
+        ranked = rank_matches(matcher, prefix_matches,
+                              ((self.search_key(hymn_id), hymn_id) for hymn_id in candidates),
+                              max_results, budget)
+        return [(key, self.hymns[key[2]]) for key in ranked]
+
+    def search_fuzzy(
+        self,
+        query: str,
+        max_results: int = 10,
+        budget: int = RANK_BUDGET
+    ) -> List[Tuple[FuzzyKey, Dict[str, str]]]:
+        """
+        Return the best max_results (rank key, hymn) pairs for a query with typos.
+
+        Each word that isn't in the index is swapped for its closest spellings,
+        found through the trigram index and checked with a bounded edit
+        distance. The corrected queries are then searched normally, and hymns
+        are ranked by how many edits their query needed, then as in
+        search_ranked.
+        """
+        return search_corrected(query, max_results, self.postings.__contains__, self.similar_words,
+                                lambda phrase, count: self.search_ranked(phrase, count, budget))
+
+    def similar_words(self, word: str, max_distance: int) -> List[Tuple[int, str]]:
+        """
+        Return (edit distance, word) pairs for indexed words close to word, closest first.
+
+        Candidates must share enough trigrams with word to be within
+        max_distance edits. Rare trigrams are read first and at most
+        FUZZY_POSTINGS_BUDGET postings are read in total.
+        """
+        if max_distance <= 0:
+            return []
+
+        index = self.trigram_index()
+        grams, required = choose_trigrams({gram: len(index.get(gram, ())) for gram in trigrams(word)},
+                                          max_distance)
+        shared: Dict[int, int] = {}
+        for gram in grams:
+            for token_id in index.get(gram, ()):
+                shared[token_id] = shared.get(token_id, 0) + 1
+
+        # Most trigrams in common first, then vocabulary order
+        candidates = heapq.nsmallest(
+            FUZZY_MAX_CANDIDATES,
+            (token_id for token_id, count in shared.items() if count >= required),
+            key=lambda token_id: (-shared[token_id], token_id)
+        )
+        tokens = [self.vocabulary[token_id] for token_id in candidates]
+        return closest_words(word, max_distance, ((token, len(self.postings[token])) for token in tokens))
+
+    def trigram_index(self) -> Mapping[str, Sequence[int]]:
+        """Return the index from trigrams to ids of vocabulary words, building it if needed."""
+        if self._trigrams is None:
+            index: Dict[str, array] = {}
+            for token_id, token in enumerate(self.vocabulary):
+                for gram in trigrams(token):
+                    posting = index.get(gram)
+                    if posting is None:
+                        posting = index[gram] = array('I')
+                    posting.append(token_id)
+            self._trigrams = index
+        return self._trigrams
+
+    def complete(self, text: str, limit: int = 25) -> List[Dict[str, str]]:
+        """Return up to limit hymns for autocompleting a partially typed title."""
+        return complete_titles([self], text, limit)
+
+    def iter_title_prefix(self, text: str, budget: int) -> Iterator[Tuple[str, Dict[str, str]]]:
+        """Yield (title, hymn) pairs in title order for titles starting with text."""
+        for title, hymn_id in self._iter_title_prefix_ids(text, budget):
+            yield title, self.hymns[hymn_id]
+
+    def _iter_title_prefix_ids(self, text: str, budget: int) -> Iterator[Tuple[str, int]]:
+        """Yield (title, hymn id) pairs in title order for titles starting with text."""
+        # Binary search over ids in search key order; keys are looked up, not stored
+        low, high = 0, len(self.sorted_ids)
+        while low < high:
+            mid = (low + high) // 2
+            if self.search_key(self.sorted_ids[mid]) < text:
+                low = mid + 1
+            else:
+                high = mid
+
+        for i in range(low, min(low + budget, len(self.sorted_ids))):
+            hymn_id = self.sorted_ids[i]
+            title = self.search_key(hymn_id)
+            if not title.startswith(text):
+                break
+            yield title, hymn_id
+
+    def word_candidates(self, text: str, budget: int) -> Tuple[List[int], int]:
+        """
+        Return ids, in catalogue order, of hymns that may have a word starting text.
+
+        Walks the shortest of the typed words' posting lists, or the whole
+        catalogue when the last word is a common prefix, bisecting into the
+        other whole words' lists and looking at no more than budget ids. Also
+        returns how many were looked at, so callers can share one budget
+        between indexes.
+        """
+        fragments = text.split(' ')
+        # Every fragment but the last is a whole word
+        words = []
+        for fragment in dict.fromkeys(fragments[:-1]):
+            posting = self.postings.get(fragment)
+            if posting is None:
+                return [], 0
+            words.append(posting)
+        words.sort(key=len)
+
+        walk: Optional[Iterable[int]] = words.pop(0) if words else None
+        if fragments[-1]:
+            prefix_tokens = list(itertools.islice(self._with_prefix(self.vocabulary, fragments[-1]),
+                                                  MAX_COMPLETION_POSTINGS + 1))
+            if not prefix_tokens:
+                return [], 0
+            if len(prefix_tokens) <= MAX_COMPLETION_POSTINGS:
+                postings = [self.postings[t] for t in prefix_tokens]
+                if walk is None or sum(len(p) for p in postings) < len(walk):
+                    if walk is not None:
+                        words.append(walk)
+                    walk = self._merge(postings)
+        if walk is None:
+            # The last word is a common prefix, so walking the catalogue finds its completions fastest
+            walk = range(len(self.hymns))
+
+        hymn_ids = []
+        examined = 0
+        for hymn_id in itertools.islice(walk, budget):
+            examined += 1
+            if all(self._contains(posting, hymn_id) for posting in words):
+                hymn_ids.append(hymn_id)
+        return hymn_ids, examined
+
+    def _candidates(self, fragments: List[str]) -> Iterable[int]:
+        """Return ids, in ascending order, of hymns that could match the fragments."""
+        if len(fragments) == 1:
+            # A lone fragment may fall anywhere inside a single word
+            tokens = self._tokens_containing(fragments[0])
+            if len(tokens) > MAX_MERGED_POSTINGS:
+                # Matches are everywhere, so walking the catalogue finds them fastest
+                return range(len(self.hymns))
+            return self._merge([self.postings[t] for t in tokens])
+
+        # The first fragment ends a word, the last one starts a word, and
+        # everything in between must be a whole word.
+        groups = [[self.postings[t[::-1]]
+                   for t in self._with_prefix(self.reversed_vocabulary, fragments[0][::-1])]]
+        for fragment in fragments[1:-1]:
+            posting = self.postings.get(fragment)
+            groups.append([posting] if posting is not None else [])
+        groups.append([self.postings[t]
+                       for t in self._with_prefix(self.vocabulary, fragments[-1])])
+        return self._intersect(groups)
+
+    def _intersect(self, groups: List[List[array]]) -> List[int]:
+        """Return ids, in ascending order, of hymns in at least one posting list of every group."""
+        if not all(groups):
+            return []
+
+        groups.sort(key=lambda group: sum(len(p) for p in group))
+        candidates: Set[int] = set().union(*groups[0])
+        for group in groups[1:]:
+            if len(candidates) <= VERIFY_THRESHOLD:
+                break
+            candidates.intersection_update(set().union(*group))
+        return sorted(candidates)
+
+    def _tokens_containing(self, fragment: str) -> List[str]:
+        """Return the vocabulary words containing fragment, in vocabulary order."""
+        if len(fragment) < 3:
+            # Too short to have a trigram, but there are few such fragments to try
+            return [t for t in self.vocabulary if fragment in t]
+
+        # A word containing the fragment has all of its trigrams; intersect rarest first
+        index = self.trigram_index()
+        grams = sorted({fragment[i:i + 3] for i in range(len(fragment) - 2)},
+                       key=lambda gram: len(index.get(gram, ())))
+        token_ids: Set[int] = set()
+        for number, gram in enumerate(grams):
+            posting = index.get(gram, ())
+            token_ids = set(posting) if number == 0 else token_ids.intersection(posting)
+            if len(token_ids) <= VERIFY_THRESHOLD:
+                break
+        return [self.vocabulary[i] for i in sorted(token_ids) if fragment in self.vocabulary[i]]
+
+    @staticmethod
+    def _with_prefix(vocabulary: List[str], prefix: str) -> Iterator[str]:
+        """Yield entries of a sorted vocabulary that start with prefix."""
+        for i in range(bisect_left(vocabulary, prefix), len(vocabulary)):
+            token = vocabulary[i]
+            if not token.startswith(prefix):
+                break
+            yield token
+
+    @staticmethod
+    def _contains(posting: Sequence[int], hymn_id: int) -> bool:
+        """Return whether a sorted posting list holds hymn_id."""
+        i = bisect_left(posting, hymn_id)
+        return i < len(posting) and posting[i] == hymn_id
+
+    @staticmethod
+    def _merge(postings: List[array]) -> Iterator[int]:
+        """Lazily merge sorted posting lists into one ascending, de-duplicated stream."""
+        previous = -1
+        for hymn_id in heapq.merge(*postings):
+            if hymn_id != previous:
+                previous = hymn_id
+                yield hymn_id
@@ -0,0 +1,146 @@
+"""
+Channel Send Queue
+
+This module posts hymn shares through one queue per channel. Posts are paced
+to Discord's per-channel rate limit instead of running into 429s, shares that
+pile up while a post is in flight go out together as one message of up to ten
+embeds, and a post that is rate limited anyway is retried with backoff rather
+than failing the share.
+"""
+
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Hashable, List, Tuple
+
+import discord
+
+logger = logging.getLogger(__name__)
+
+CHANNEL_RATE_LIMIT = (5, 5.0)  # Messages Discord accepts per channel, per this many seconds
+MAX_EMBEDS = 10                # Discord's limit for embeds in one message
+SEND_ATTEMPTS = 5              # Tries per post before a rate-limited share fails
+RETRY_DELAY = 1.0              # Seconds before the first retry; doubles on each one
+
+
+class ChannelSendQueue:
+    """
+    Posts embeds to channels, one worker per channel with shares waiting.
+
+    A worker starts when a channel's first share arrives and exits once its
+    queue is empty, so idle channels cost nothing.
+    """
+
+    def __init__(
+        self,
+        rate_limit: Tuple[int, float] = CHANNEL_RATE_LIMIT,
+        max_embeds: int = MAX_EMBEDS,
+        attempts: int = SEND_ATTEMPTS,
+        retry_delay: float = RETRY_DELAY,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        self.rate_limit = rate_limit
+        self.max_embeds = max_embeds
+        self.attempts = attempts
+        self.retry_delay = retry_delay
+        self.clock = clock
+        self._pending: Dict[Hashable, Deque[Tuple[discord.Embed, 'asyncio.Future[Any]']]] = {}
+        self._workers: Dict[Hashable, 'asyncio.Task[None]'] = {}
+        self._sent: Dict[Hashable, Deque[float]] = {}  # Channel -> times of its recent posts
+        self._last_sweep = clock()  # When _sent was last cleared of idle channels
+        self.shares = 0
+        self.posts = 0
+        self.coalesced = 0  # Shares posted in a message with other shares
+        self.retries = 0
+
+    async def send(self, channel: Any, embed: discord.Embed) -> Any:
+        """Queue embed for channel and return the message it was posted in."""
+        future = asyncio.get_running_loop().create_future()
+        self._pending.setdefault(channel.id, deque()).append((embed, future))
+        if channel.id not in self._workers:
+            self._forget_idle_channels()
+            self._workers[channel.id] = asyncio.create_task(self._run(channel))
+        return await future
+
+    async def _run(self, channel: Any):
+        """Post everything queued for one channel, then exit."""
+        pending = self._pending[channel.id]
+        try:
+            while pending:
+                await self._wait_for_slot(channel.id)
+                # Everything that queued up while waiting goes out together
+                batch = [pending.popleft() for _ in range(min(len(pending), self.max_embeds))]
+                try:
+                    message = await self._post(channel, [embed for embed, _ in batch])
+                except Exception as e:
+                    logger.error(f"Error posting {len(batch)} shares to channel {channel.id}: {e}")
+                    for _, future in batch:
+                        if not future.done():
+                            future.set_exception(e)
+                    continue
+
+                self.shares += len(batch)
+                if len(batch) > 1:
+                    self.coalesced += len(batch)
+                for _, future in batch:
+                    if not future.done():
+                        future.set_result(message)
+        finally:
+            # Nothing can be queued between the loop ending and this, since neither awaits
+            del self._workers[channel.id]
+            if not pending:
+                del self._pending[channel.id]
+
+    def _forget_idle_channels(self):
+        """Drop the post times of channels with no worker whose rate limit window has passed."""
+        _, window = self.rate_limit
+        now = self.clock()
+        # At most one sweep per window, so starting a worker stays cheap with many channels
+        if now - self._last_sweep < window:
+            return
+        self._last_sweep = now
+        idle = [channel_id for channel_id, sent in self._sent.items()
+                if channel_id not in self._workers and (not sent or now - sent[-1] >= window)]
+        for channel_id in idle:
+            del self._sent[channel_id]
+
+    async def _wait_for_slot(self, channel_id: Hashable):
+        """Wait until another post fits in the channel's rate limit, and claim it."""
+        messages, window = self.rate_limit
+        sent = self._sent.setdefault(channel_id, deque())
+        while True:
+            now = self.clock()
+            while sent and now - sent[0] >= window:
+                sent.popleft()
+            if len(sent) < messages:
+                sent.append(now)
+                return
+            await asyncio.sleep(sent[0] + window - now)
+
+    async def _post(self, channel: Any, embeds: List[discord.Embed]) -> Any:
+        """Send one message, retrying with backoff if it's still rate limited."""
+        for attempt in range(self.attempts):
+            try:
+                if len(embeds) == 1:
+                    message = await channel.send(embed=embeds[0])
+                else:
+                    message = await channel.send(embeds=embeds)
+                self.posts += 1
+                return message
+            except discord.HTTPException as e:
+                if e.status != 429 or attempt == self.attempts - 1:
+                    raise
+                self.retries += 1
+                await asyncio.sleep(self.retry_delay * 2 ** attempt)
+
+    def stats(self) -> Dict[str, float]:
+        """Return send queue figures for the metrics endpoint."""
+        return {
+            'hymnbot_send_queue_pending': sum(len(pending) for pending in self._pending.values()),
+            'hymnbot_send_queue_channels': len(self._workers),
+            'hymnbot_send_queue_shares_total': self.shares,
+            'hymnbot_send_queue_posts_total': self.posts,
+            'hymnbot_send_queue_coalesced_total': self.coalesced,
+            'hymnbot_send_queue_retries_total': self.retries,
+        }
@@ -0,0 +1,250 @@
+"""
+Hymnary Sitemap Fetcher
+
+This module downloads sitemap files concurrently over a shared aiohttp session,
+using conditional GETs so unchanged sitemaps aren't downloaded again. Bodies are
+streamed to a temporary file that is checked and then renamed into place, so an
+interrupted download never leaves a truncated sitemap behind; the next attempt
+resumes it with a Range request.
+"""
+
+import os
+import gzip
+import json
+import zlib
+import random
+import asyncio
+import logging
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+VALIDATORS_FILENAME = "fetch_validators.json"
+
+DEFAULT_CONCURRENCY = 4
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_BACKOFF = 1.0  # Seconds before the first retry, doubled on each attempt
+DEFAULT_TIMEOUT = 30  # Seconds to connect, and to wait for each read of the body
+
+CHUNK_SIZE = 64 * 1024
+PARTIAL_SUFFIX = ".part"  # Downloads in progress, kept so they can be resumed
+
+# Responses worth retrying; anything else is treated as a permanent failure
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class IntegrityError(Exception):
+    """A downloaded file is truncated or corrupt."""
+
+
+def is_intact(path: Path, gzipped: Optional[bool] = None) -> bool:
+    """
+    Whether a file is complete; for .gz files, whether it decompresses with a valid CRC.
+
+    gzip checks each member's CRC-32 and uncompressed size once it's read to
+    the end. gzipped defaults to whether path ends in .gz.
+    """
+    if gzipped is None:
+        gzipped = path.suffix == '.gz'
+    if not gzipped:
+        return path.exists()
+    try:
+        with gzip.open(path, 'rb') as f:
+            while f.read(CHUNK_SIZE):
+                pass
+        return True
+    except (OSError, EOFError, zlib.error):
+        return False
+
+
+def _expected_size(headers: Any, offset: int) -> Optional[int]:
+    """Return the full size of the file being downloaded, if the response says."""
+    content_range = headers.get('Content-Range', '')
+    if '/' in content_range and not content_range.endswith('/*'):
+        return int(content_range.rsplit('/', 1)[1])
+    length = headers.get('Content-Length')
+    return offset + int(length) if length is not None else None
+
+
+class SitemapFetcher:
+    """Downloads sitemap files with bounded concurrency, retries and conditional GETs."""
+
+    def __init__(
+        self,
+        sitemap_dir: Path,
+        concurrency: int = DEFAULT_CONCURRENCY,
+        max_retries: int = DEFAULT_MAX_RETRIES,
+        backoff: float = DEFAULT_BACKOFF,
+        timeout: float = DEFAULT_TIMEOUT
+    ):
+        self.sitemap_dir = sitemap_dir
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.validators_path = sitemap_dir / VALIDATORS_FILENAME
+        self.validators: Dict[str, Dict[str, str]] = self._load_validators()
+
+    def _timeout(self) -> aiohttp.ClientTimeout:
+        # No total limit, so a large sitemap can take as long as it keeps making progress
+        return aiohttp.ClientTimeout(total=None, sock_connect=self.timeout, sock_read=self.timeout)
+
+    def _load_validators(self) -> Dict[str, Dict[str, str]]:
+        """Load the ETag/Last-Modified values saved by earlier fetches."""
+        try:
+            if self.validators_path.exists():
+                return json.loads(self.validators_path.read_text())
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable {self.validators_path}: {e}")
+        return {}
+
+    def _save_validators(self):
+        """Persist the ETag/Last-Modified values for the next run."""
+        try:
+            self.validators_path.write_text(json.dumps(self.validators, indent=2, sort_keys=True))
+        except Exception as e:
+            logger.warning(f"Could not save {self.validators_path}: {e}")
+
+    async def fetch_all(self, urls: Sequence[str], revalidate: bool = True) -> List[Optional[Path]]:
+        """
+        Fetch every URL into the sitemap directory.
+
+        Files already on disk are revalidated with a conditional GET, or reused
+        as-is when revalidate is False. Returns the local path for each URL, or
+        None where the file couldn't be fetched and no copy exists.
+        """
+        semaphore = asyncio.Semaphore(self.concurrency)
+        connector = aiohttp.TCPConnector(limit=self.concurrency)
+
+        async with aiohttp.ClientSession(connector=connector, timeout=self._timeout()) as session:
+            async def fetch_one(url: str) -> Optional[Path]:
+                destination = self.sitemap_dir / url.split('/')[-1]
+                if destination.exists() and not self._is_cached_intact(url, destination):
+                    logger.warning(f"Discarding corrupt {destination}")
+                    destination.unlink()
+                if destination.exists() and not revalidate:
+                    logger.info(f"Already exists: {destination}")
+                    return destination
+                async with semaphore:
+                    if await self.fetch(session, url, destination):
+                        return destination
+                # Keep serving the copy we have if the refresh failed
+                return destination if destination.exists() else None
+
+            results = await asyncio.gather(*(fetch_one(url) for url in urls))
+
+        self._save_validators()
+        return list(results)
+
+    async def download(self, url: str, destination: Path) -> bool:
+        """Fetch a single URL to destination on its own session."""
+        async with aiohttp.ClientSession(timeout=self._timeout()) as session:
+            fetched = await self.fetch(session, url, destination)
+        self._save_validators()
+        return fetched
+
+    def _is_cached_intact(self, url: str, path: Path) -> bool:
+        """Check a file on disk, skipping the full check if it's the size it was downloaded at."""
+        size = path.stat().st_size
+        if self.validators.get(url, {}).get('size') == size:
+            return True
+        if not is_intact(path):
+            return False
+        # Remember it's good so the next start doesn't decompress it again
+        self.validators.setdefault(url, {})['size'] = size
+        return True
+
+    async def fetch(self, session: aiohttp.ClientSession, url: str, destination: Path) -> bool:
+        """
+        Fetch one URL to destination, retrying transient failures with backoff.
+
+        The body is streamed into destination + PARTIAL_SUFFIX and renamed into
+        place once its size (and gzip CRC) check out. A partial file left by an
+        earlier attempt is resumed with a Range request if the server still
+        has the same version. Returns True if destination is up to date,
+        whether it was downloaded or the server reported it unchanged.
+        """
+        partial = destination.with_name(destination.name + PARTIAL_SUFFIX)
+        cached = self.validators.get(url, {})
+
+        for attempt in range(self.max_retries + 1):
+            # Ranges count raw bytes, so ask for the file exactly as stored
+            headers = {'Accept-Encoding': 'identity'}
+            if destination.exists():
+                if cached.get('etag'):
+                    headers['If-None-Match'] = cached['etag']
+                if cached.get('last_modified'):
+                    headers['If-Modified-Since'] = cached['last_modified']
+
+            # Resume only when the server can confirm it's still the same version
+            resume_from = cached.get('partial', {})
+            offset = partial.stat().st_size if partial.exists() else 0
+            if offset and resume_from.get('etag', resume_from.get('last_modified')):
+                headers['Range'] = f'bytes={offset}-'
+                headers['If-Range'] = resume_from.get('etag', resume_from.get('last_modified'))
+            else:
+                offset = 0
+
+            try:
+                async with session.get(url, headers=headers) as response:
+                    if response.status == 304:
+                        logger.info(f"Not modified: {url}")
+                        return True
+
+                    response.raise_for_status()
+                    validators = {
+                        key: value for key, value in (
+                            ('etag', response.headers.get('ETag')),
+                            ('last_modified', response.headers.get('Last-Modified')),
+                        ) if value
+                    }
+                    if response.status != 206:
+                        offset = 0  # The server sent the whole file
+                    cached = self.validators[url] = {**cached, 'partial': validators}
+
+                    if offset:
+                        logger.info(f"Resuming {url} from byte {offset}...")
+                    else:
+                        logger.info(f"Downloading {url}...")
+                    expected = _expected_size(response.headers, offset)
+                    with open(partial, 'ab' if offset else 'wb') as f:
+                        async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                            f.write(chunk)
+
+                size = partial.stat().st_size
+                if expected is not None and size != expected:
+                    raise IntegrityError(f"got {size} bytes, expected {expected}")
+                if not is_intact(partial, gzipped=destination.suffix == '.gz'):
+                    raise IntegrityError("gzip CRC or size check failed")
+
+                os.replace(partial, destination)
+                cached = self.validators[url] = {**validators, 'size': size}
+                logger.info(f"Downloaded to {destination}")
+                return True
+            except IntegrityError as e:
+                # Start over next time rather than resuming a bad file
+                partial.unlink()
+                cached = self.validators[url] = {key: value for key, value in cached.items()
+                                                 if key != 'partial'}
+                if attempt >= self.max_retries:
+                    logger.error(f"Error downloading {url}: {e}")
+                    return False
+                logger.warning(f"Retrying {url} after a corrupt download: {e}")
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                retryable = not isinstance(e, aiohttp.ClientResponseError) or e.status in RETRY_STATUSES
+                if isinstance(e, aiohttp.ClientResponseError) and e.status == 416:
+                    # The partial file is no use for this version; start over
+                    partial.unlink(missing_ok=True)
+                    retryable = True
+                if not retryable or attempt >= self.max_retries:
+                    logger.error(f"Error downloading {url}: {e}")
+                    return False
+
+                delay = self.backoff * (2 ** attempt) * (1 + random.random() / 2)
+                logger.warning(f"Retrying {url} in {delay:.1f}s after error: {e}")
+                await asyncio.sleep(delay)
+
+        return False
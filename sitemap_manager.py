@@ -1,73 +1,216 @@
 """
 Hymnary Sitemap Downloader and Parser
 
-This module handles downloading, extracting, and parsing sitemap files from hymnary.org.
+This module handles downloading and parsing sitemap files from hymnary.org.
 """
 
 import os
-import re
+import time
 import gzip
-import shutil
+import asyncio
 import logging
+import threading
+import multiprocessing
+import concurrent.futures
+from enum import Enum
 import xml.etree.ElementTree as ET
 from pathlib import Path
-from typing import List, Dict, Optional
-import requests
+from typing import Any, Awaitable, List, Dict, Iterator, Optional, Sequence, Set, Union
+
+from catalogue import Catalogue, CatalogueShard
+from hymn_store import HymnStore, split_url, title_from_slug
+from query_cache import DEFAULT_MAX_ENTRIES, DEFAULT_TTL, QueryCache, normalize_query
+from catalogue_snapshot import (
+    build_manifest, read_shard_order, read_snapshot, snapshot_path_for, write_shard_order, write_snapshot
+)
+from sitemap_fetcher import SitemapFetcher
+from sqlite_catalogue import DATABASE_FILENAME, SqliteCatalogue, build_database
+from metrics import METRICS
 
 logger = logging.getLogger(__name__)
 
 SITEMAP_DIR = Path("sitemaps")
 SITEMAP_INDEX_URL = "https://hymnary.org/sitemap.xml"
 HYMN_SITEMAP_FILTER = "text"  # Filter for sitemaps containing hymn texts
+# Sitemaps whose names mention one of these are loaded into the catalogue
+CATALOGUE_RECORD_TYPES = ("text", "tune", "person")
+SITEMAP_NAMESPACE = 'http://www.sitemaps.org/schemas/sitemap/0.9'
+
+SEARCH_WORKERS = 2     # Threads running searches off the event loop
+SEARCH_TIMEOUT = 5.0   # Seconds a caller waits for an async search
+PARSE_WORKERS = os.cpu_count() or 1  # Processes parsing and indexing sitemaps on a cold load
+CATALOGUE_BACKENDS = ("memory", "sqlite")  # Where the catalogue is held while it's searched
+CATALOGUE_BACKEND = "memory"
+
+
+def _run_coroutine(coroutine: Awaitable[Any]) -> Any:
+    """Run a coroutine to completion from synchronous code."""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+    
+    # Called from inside an event loop, so run it on a fresh loop in another thread
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coroutine).result()
+
+
+class CatalogueState(str, Enum):
+    """Loading state of the hymn catalogue."""
+    COLD = "cold"        # Nothing loaded yet
+    LOADING = "loading"  # A load is in progress
+    READY = "ready"      # hymn_data is loaded and searchable
+    FAILED = "failed"    # The last load raised an error or found no hymns; it can be retried
+
+
+def _wanted(filename: str, name_filter: Union[str, Sequence[str], None]) -> bool:
+    """Whether a sitemap filename contains name_filter, or any of several filters."""
+    if name_filter is None:
+        return True
+    filters = (name_filter,) if isinstance(name_filter, str) else name_filter
+    return any(part in filename.lower() for part in filters)
+
+
+def iter_sitemap_urls(sitemap_path: Path) -> Iterator[str]:
+    """
+    Stream the page URLs out of a sitemap file.
+    
+    Gzipped sitemaps are decompressed on the fly, and each element is
+    cleared once it has been read, so memory use stays flat no matter
+    how large the file is.
+    """
+    url_tag = f'{{{SITEMAP_NAMESPACE}}}url'
+    loc_tag = f'{{{SITEMAP_NAMESPACE}}}loc'
+    
+    opener = gzip.open if sitemap_path.suffix == '.gz' else open
+    with opener(sitemap_path, 'rb') as f:
+        root = None
+        for event, element in ET.iterparse(f, events=('start', 'end')):
+            if root is None:
+                root = element
+            if event != 'end' or element.tag != url_tag:
+                continue
+            
+            loc = element.find(loc_tag)
+            if loc is not None and loc.text:
+                yield loc.text
+            
+            # Drop the parsed <url> elements so the tree never grows
+            root.clear()
+
+
+def snapshot_sitemap(sitemap_file: Path) -> bool:
+    """
+    Parse, index and snapshot one sitemap; run in a worker process on cold loads.
+    
+    The snapshot is the batch handed back: the parent maps it rather than
+    receiving pickled records. Returns whether it was written.
+    """
+    try:
+        manifest = build_manifest([sitemap_file])
+        store = HymnStore.from_urls(iter_sitemap_urls(sitemap_file))
+        shards = [CatalogueShard(sitemap_file.name, part, record_type=kind)
+                  for kind, part in store.split_by_type()]
+        return write_snapshot(snapshot_path_for(sitemap_file), manifest,
+                              [(shard.record_type, shard.hymns, shard.index) for shard in shards])
+    except Exception:
+        # The parent parses the file itself and logs the error
+        return False
+
+
+class _InflightSearch:
+    """A search running on a worker thread and the number of callers awaiting it."""
+    
+    __slots__ = ('work', 'future', 'waiters')
+    
+    def __init__(self, work: 'concurrent.futures.Future[List[Dict[str, str]]]'):
+        self.work = work  # The job on the worker thread, which can only be cancelled before it starts
+        self.future = asyncio.wrap_future(work)  # Finishes when work does
+        self.waiters = 0
 
 
 class SitemapManager:
     """Manages downloading and parsing of Hymnary sitemaps."""
     
-    def __init__(self, sitemap_dir: Path = SITEMAP_DIR):
+    def __init__(
+        self,
+        sitemap_dir: Path = SITEMAP_DIR,
+        index_url: str = SITEMAP_INDEX_URL,
+        query_cache_size: int = DEFAULT_MAX_ENTRIES,
+        query_cache_ttl: Optional[float] = DEFAULT_TTL,
+        record_types: Sequence[str] = CATALOGUE_RECORD_TYPES,
+        parse_workers: int = PARSE_WORKERS,
+        backend: str = CATALOGUE_BACKEND
+    ):
+        if backend not in CATALOGUE_BACKENDS:
+            raise ValueError(f"Unknown catalogue backend {backend!r}, expected one of {CATALOGUE_BACKENDS}")
         self.sitemap_dir = sitemap_dir
+        self.index_url = index_url
+        self.record_types = tuple(record_types)
+        self.parse_workers = parse_workers
+        self.backend = backend
+        self.database_path = self.sitemap_dir / DATABASE_FILENAME  # Used by the sqlite backend
         self.sitemap_dir.mkdir(exist_ok=True)
         self.sitemap_urls: List[str] = []
-        self.hymn_data: List[Dict[str, str]] = []
+        self.sitemap_lastmods: Dict[str, str] = {}  # Sitemap filename -> <lastmod>
+        self.fetcher = SitemapFetcher(self.sitemap_dir)
+        self._catalogue = Catalogue()
+        self.query_cache = QueryCache(query_cache_size, query_cache_ttl)
+        self._search_executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=SEARCH_WORKERS, thread_name_prefix="hymn-search")
+        # Async searches still running, so identical queries can share them
+        self._inflight: Dict[Any, _InflightSearch] = {}
+        self.coalesced_searches = 0
+        self.state = CatalogueState.COLD
+        self.ready = threading.Event()
+        self._load_lock = threading.Lock()
+    
+    @property
+    def is_ready(self) -> bool:
+        """Whether the catalogue has finished loading."""
+        return self.ready.is_set()
+    
+    @property
+    def catalogue(self) -> Union[Catalogue, SqliteCatalogue]:
+        """The current catalogue; replaced as a whole on every load or refresh."""
+        return self._catalogue
+    
+    @property
+    def hymn_data(self) -> Sequence[Dict[str, str]]:
+        """All loaded hymns, in sitemap order."""
+        return self._catalogue.hymns
+    
+    @hymn_data.setter
+    def hymn_data(self, hymns: Sequence[Dict[str, str]]):
+        self._publish(Catalogue.from_hymns(hymns))
+    
+    def _publish(self, catalogue: Union[Catalogue, SqliteCatalogue]):
+        """Swap in a new catalogue, drop results cached from the old one and close it."""
+        old, self._catalogue = self._catalogue, catalogue
+        self.query_cache.clear()
+        if isinstance(old, SqliteCatalogue) and old is not catalogue:
+            old.close()
+    
+    def _publish_shards(self, catalogue: Catalogue):
+        """Publish a catalogue loaded by this process and tell attached processes which snapshots it uses."""
+        self._publish(catalogue)
+        write_shard_order(self.sitemap_dir, list(dict.fromkeys(shard.name for shard in catalogue.shards)))
         
     def download_file(self, url: str, destination: Path) -> bool:
-        """Download a file from URL to destination."""
+        """Download a file from URL to destination, streaming it through a temporary file."""
         try:
-            logger.info(f"Downloading {url}...")
-            response = requests.get(url, timeout=30)
-            response.raise_for_status()
-            
-            with open(destination, 'wb') as f:
-                f.write(response.content)
-            
-            logger.info(f"Downloaded to {destination}")
-            return True
+            return _run_coroutine(self.fetcher.download(url, destination))
         except Exception as e:
             logger.error(f"Error downloading {url}: {e}")
             return False
     
-    def extract_gz_file(self, gz_path: Path) -> Optional[Path]:
-        """Extract a .gz file and return the path to the extracted file."""
-        try:
-            output_path = gz_path.with_suffix('')
-            
-            with gzip.open(gz_path, 'rb') as f_in:
-                with open(output_path, 'wb') as f_out:
-                    shutil.copyfileobj(f_in, f_out)
-            
-            logger.info(f"Extracted {gz_path} to {output_path}")
-            return output_path
-        except Exception as e:
-            logger.error(f"Error extracting {gz_path}: {e}")
-            return None
-    
     def parse_sitemap_index(self) -> List[str]:
         """Parse the main sitemap index to get URLs of individual sitemaps."""
         index_path = self.sitemap_dir / "sitemap.xml"
         
         # Download if not exists
         if not index_path.exists():
-            if not self.download_file(SITEMAP_INDEX_URL, index_path):
+            if not self.download_file(self.index_url, index_path):
                 logger.error("Failed to download sitemap index")
                 return []
         
@@ -76,138 +219,587 @@ class SitemapManager:
             root = tree.getroot()
             
             # Handle XML namespace
-            namespace = {'ns': 'http://www.sitemaps.org/schemas/sitemap/0.9'}
+            namespace = {'ns': SITEMAP_NAMESPACE}
             
             urls = []
+            lastmods = {}
             for sitemap in root.findall('.//ns:sitemap', namespace):
                 loc = sitemap.find('ns:loc', namespace)
                 if loc is not None and loc.text:
                     urls.append(loc.text)
+                    lastmod = sitemap.find('ns:lastmod', namespace)
+                    if lastmod is not None and lastmod.text:
+                        lastmods[loc.text.split('/')[-1]] = lastmod.text.strip()
             
             self.sitemap_urls = urls
+            self.sitemap_lastmods = lastmods
             logger.info(f"Found {len(urls)} sitemap URLs")
             return urls
         except Exception as e:
             logger.error(f"Error parsing sitemap index: {e}")
             return []
     
-    def download_and_extract_sitemaps(self, limit: Optional[int] = None) -> List[Path]:
-        """Download and extract individual sitemap files."""
+    def download_sitemaps(
+        self,
+        limit: Optional[int] = None,
+        name_filter: Union[str, Sequence[str], None] = HYMN_SITEMAP_FILTER,
+        revalidate: bool = False
+    ) -> List[Path]:
+        """
+        Download individual sitemap files, keeping them compressed on disk.
+        
+        Only sitemaps whose filename contains name_filter (or any of a
+        sequence of filters) are fetched. Files
+        already on disk are reused, or checked with a conditional GET when
+        revalidate is True.
+        """
         if not self.sitemap_urls:
             self.parse_sitemap_index()
         
-        extracted_files = []
-        urls_to_process = self.sitemap_urls[:limit] if limit else self.sitemap_urls
+        urls_to_process = [
+            url for url in self.sitemap_urls
+            if _wanted(url.split('/')[-1], name_filter)
+        ]
+        if limit:
+            urls_to_process = urls_to_process[:limit]
         
+        # Fall back to copies extracted by an older version of the bot
+        legacy_files = {}
         for url in urls_to_process:
-            filename = url.split('/')[-1]
-            gz_path = self.sitemap_dir / filename
-            
-            # Check if already extracted
+            gz_path = self.sitemap_dir / url.split('/')[-1]
             xml_path = gz_path.with_suffix('')
-            if xml_path.exists():
+            if gz_path.suffix == '.gz' and not gz_path.exists() and xml_path.exists():
                 logger.info(f"Already exists: {xml_path}")
-                extracted_files.append(xml_path)
-                continue
-            
-            # Download if needed
-            if not gz_path.exists():
-                if not self.download_file(url, gz_path):
-                    continue
-            
-            # Extract
-            xml_path = self.extract_gz_file(gz_path)
-            if xml_path:
-                extracted_files.append(xml_path)
+                legacy_files[url] = xml_path
+        
+        pending = [url for url in urls_to_process if url not in legacy_files]
+        fetched = dict(zip(pending, _run_coroutine(self.fetcher.fetch_all(pending, revalidate=revalidate))))
         
-        return extracted_files
+        sitemap_files = []
+        for url in urls_to_process:
+            path = legacy_files.get(url) or fetched.get(url)
+            if path is not None:
+                sitemap_files.append(path)
+        return sitemap_files
     
-    def parse_sitemap_file(self, xml_path: Path) -> List[Dict[str, str]]:
-        """Parse a sitemap XML file and extract hymn information."""
-        try:
-            tree = ET.parse(xml_path)
-            root = tree.getroot()
-            
-            namespace = {'ns': 'http://www.sitemaps.org/schemas/sitemap/0.9'}
+    def iter_sitemap_urls(self, sitemap_path: Path) -> Iterator[str]:
+        """Stream the page URLs out of a sitemap file."""
+        return iter_sitemap_urls(sitemap_path)
+    
+    def iter_sitemap_file(self, sitemap_path: Path) -> Iterator[Dict[str, str]]:
+        """Stream hymn records out of a sitemap file."""
+        for url in self.iter_sitemap_urls(sitemap_path):
+            # Extract title from URL
+            # URLs like: https://hymnary.org/text/amazing_grace_how_sweet_the_sound
+            title = self._extract_title_from_url(url)
             
-            hymns = []
-            for url_element in root.findall('.//ns:url', namespace):
-                loc = url_element.find('ns:loc', namespace)
-                if loc is not None and loc.text:
-                    url = loc.text
-                    
-                    # Extract title from URL
-                    # URLs like: https://hymnary.org/text/amazing_grace_how_sweet_the_sound
-                    title = self._extract_title_from_url(url)
-                    
-                    hymns.append({
-                        'url': url,
-                        'title': title,
-                        'title_lower': title.lower()
-                    })
-            
-            return hymns
+            yield {
+                'url': url,
+                'title': title,
+                'title_lower': title.lower()
+            }
+    
+    def parse_sitemap_file(self, sitemap_path: Path) -> List[Dict[str, str]]:
+        """Parse a sitemap file (.xml or .xml.gz) and extract hymn information."""
+        try:
+            return list(self.iter_sitemap_file(sitemap_path))
         except Exception as e:
-            logger.error(f"Error parsing {xml_path}: {e}")
+            logger.error(f"Error parsing {sitemap_path}: {e}")
             return []
     
     def _extract_title_from_url(self, url: str) -> str:
         """Extract readable title from URL."""
-        # Get the last part of the URL
-        parts = url.rstrip('/').split('/')
-        if len(parts) > 0:
-            slug = parts[-1]
-            # Replace underscores with spaces and capitalize
-            title = slug.replace('_', ' ').title()
-            return title
-        return url
-    
-    def load_all_hymns(self, force_reload: bool = False) -> List[Dict[str, str]]:
+        # Use the last part of the URL, as HymnStore records do
+        return title_from_slug(split_url(url)[1])
+    
+    def load_all_hymns(self, force_reload: bool = False) -> Sequence[Dict[str, str]]:
         """Load all hymn data from sitemaps."""
-        if self.hymn_data and not force_reload:
-            return self.hymn_data
-        
-        # Download and extract sitemaps (limit to text sitemaps for hymns)
+        # Only one load runs at a time; later callers reuse its result
+        with self._load_lock:
+            if self.hymn_data and not force_reload:
+                return self.hymn_data
+            
+            self.state = CatalogueState.LOADING
+            try:
+                with METRICS.timer('hymnbot_catalogue_load_seconds', phase='total'):
+                    all_hymns = self._load_catalogue(force_reload)
+            except Exception:
+                self.state = CatalogueState.FAILED
+                raise
+            
+            if not all_hymns:
+                # e.g. the sitemap index couldn't be downloaded; leave it for the next search or load to retry
+                logger.warning("No hymns loaded; the catalogue will be loaded again on the next attempt")
+                self.state = CatalogueState.FAILED
+                self.ready.clear()
+                return all_hymns
+            
+            self.state = CatalogueState.READY
+            self.ready.set()
+            return all_hymns
+    
+    def _load_catalogue(self, force_reload: bool) -> Sequence[Dict[str, str]]:
+        """Download, parse and index the sitemaps, then publish the result."""
+        # Download the sitemaps for every record type the catalogue covers
         logger.info("Loading sitemaps...")
-        extracted_files = self.download_and_extract_sitemaps()
-        
-        all_hymns = []
-        for xml_file in extracted_files:
-            # Focus on text sitemaps which contain hymn texts
-            if HYMN_SITEMAP_FILTER in xml_file.name.lower():
-                hymns = self.parse_sitemap_file(xml_file)
-                all_hymns.extend(hymns)
-                logger.info(f"Loaded {len(hymns)} hymns from {xml_file.name}")
-        
-        self.hymn_data = all_hymns
-        logger.info(f"Total hymns loaded: {len(all_hymns)}")
-        return all_hymns
-    
-    def search_hymns(self, query: str, max_results: int = 10) -> List[Dict[str, str]]:
-        """Search for hymns matching the query using regex."""
-        if not self.hymn_data:
+        with METRICS.timer('hymnbot_catalogue_load_seconds', phase='download'):
+            hymn_files = self.download_sitemaps(name_filter=self.record_types, revalidate=force_reload)
+        
+        if self.backend == "sqlite":
+            database = self._load_database(hymn_files, rebuild=force_reload)
+            if database is None:
+                # Serving an empty catalogue would hide the failure; load_all_hymns marks the load failed
+                raise RuntimeError(f"Couldn't build or open the catalogue database {self.database_path}")
+            self._publish(database)
+            logger.info(f"Total hymns loaded: {len(self._catalogue)}")
+            return self._catalogue.hymns
+        
+        shards = []
+        with METRICS.timer('hymnbot_catalogue_load_seconds', phase='shards'):
+            snapshots = {} if force_reload else {path: self._read_shards(path) for path in hymn_files}
+            stale = [path for path in hymn_files if snapshots.get(path) is None]
+            rebuilt = self._snapshot_in_parallel(stale)
+            # Shards are added in sitemap order however the workers finished
+            for path in hymn_files:
+                shards.extend(snapshots.get(path) or self._load_shards(path, use_snapshot=path in rebuilt) or [])
+        catalogue = Catalogue(shards)
+        
+        # Swap the whole catalogue in with a single assignment
+        self._publish_shards(catalogue)
+        logger.info(f"Total hymns loaded: {len(catalogue)}")
+        return catalogue.hymns
+    
+    def _load_shards(self, sitemap_file: Path, use_snapshot: bool = True) -> Optional[List[CatalogueShard]]:
+        """
+        Load one sitemap file into shards, one per record type it lists.
+        
+        The snapshot is reused if the file hasn't changed. Returns None if
+        the file can't be parsed.
+        """
+        if use_snapshot:
+            shards = self._read_shards(sitemap_file)
+            if shards is not None:
+                return shards
+        
+        name = sitemap_file.name
+        lastmod = self.sitemap_lastmods.get(name)
+        manifest = build_manifest([sitemap_file])
+        try:
+            # Decompressing and parsing are interleaved, so they're timed together
+            with METRICS.timer('hymnbot_catalogue_load_seconds', phase='parse'):
+                hymns = HymnStore.from_urls(iter_sitemap_urls(sitemap_file))
+        except Exception as e:
+            logger.error(f"Error parsing {sitemap_file}: {e}")
+            return None
+        
+        logger.info(f"Loaded {len(hymns)} records from {name}")
+        with METRICS.timer('hymnbot_catalogue_load_seconds', phase='index'):
+            shards = [CatalogueShard(name, store, lastmod=lastmod, manifest=manifest, record_type=kind)
+                      for kind, store in hymns.split_by_type()]
+        with METRICS.timer('hymnbot_catalogue_load_seconds', phase='snapshot_write'):
+            written = write_snapshot(snapshot_path_for(sitemap_file), manifest,
+                                     [(shard.record_type, shard.hymns, shard.index) for shard in shards])
+        if written:
+            # Serve from the mapped snapshot too, sharing memory with attached processes
+            shards = self._read_shards(sitemap_file) or shards
+        return shards
+    
+    def _load_database(self, sitemap_files: Sequence[Path], rebuild: bool = False) -> Optional[SqliteCatalogue]:
+        """
+        Open the catalogue database, first building it if it wasn't built from these files.
+        
+        Sitemaps are parsed one at a time straight into the database, so only
+        one file's records are held in memory while building. Returns None if
+        the database can't be built.
+        """
+        manifest = build_manifest(sitemap_files)
+        if not rebuild:
+            with METRICS.timer('hymnbot_catalogue_load_seconds', phase='database_open'):
+                database = SqliteCatalogue.open(self.database_path, manifest)
+            if database is not None:
+                return database
+        
+        def parts():
+            for sitemap_file in sitemap_files:
+                try:
+                    hymns = HymnStore.from_urls(iter_sitemap_urls(sitemap_file))
+                except Exception as e:
+                    logger.error(f"Error parsing {sitemap_file}: {e}")
+                    continue
+                logger.info(f"Loaded {len(hymns)} records from {sitemap_file.name}")
+                for kind, store in hymns.split_by_type():
+                    yield kind, store.urls()
+        
+        with METRICS.timer('hymnbot_catalogue_load_seconds', phase='database_build'):
+            lastmods = {path.name: self.sitemap_lastmods[path.name] for path in sitemap_files
+                        if path.name in self.sitemap_lastmods}
+            if not build_database(self.database_path, manifest, parts(), lastmods):
+                return None
+        return SqliteCatalogue.open(self.database_path)
+    
+    def _read_shards(self, sitemap_file: Path) -> Optional[List[CatalogueShard]]:
+        """Map a sitemap's snapshot as shards, or return None if it's missing or stale."""
+        name = sitemap_file.name
+        lastmod = self.sitemap_lastmods.get(name)
+        manifest = build_manifest([sitemap_file])
+        with METRICS.timer('hymnbot_catalogue_load_seconds', phase='snapshot_read'):
+            snapshot = read_snapshot(snapshot_path_for(sitemap_file), manifest)
+        if snapshot is None:
+            return None
+        return [CatalogueShard(name, hymns, index, lastmod=lastmod, manifest=manifest, record_type=kind)
+                for kind, hymns, index in snapshot]
+    
+    def _snapshot_in_parallel(self, sitemap_files: Sequence[Path]) -> Set[Path]:
+        """
+        Snapshot sitemaps on a pool of worker processes, one file per task.
+        
+        Returns the files whose snapshots were written; the rest are left for
+        the caller to parse in-process. Does nothing unless there are several
+        files and workers to spread them over.
+        """
+        workers = min(self.parse_workers, len(sitemap_files))
+        if workers < 2:
+            return set()
+        
+        logger.info(f"Parsing {len(sitemap_files)} sitemaps on {workers} processes...")
+        try:
+            # Spawned rather than forked, since this process is running threads
+            with concurrent.futures.ProcessPoolExecutor(
+                    max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+                written = list(pool.map(snapshot_sitemap, sitemap_files))
+        except Exception as e:
+            logger.error(f"Error parsing sitemaps in parallel: {e}")
+            return set()
+        return {path for path, ok in zip(sitemap_files, written) if ok}
+    
+    def attach_catalogue(self) -> int:
+        """
+        Map the snapshots written by another process instead of loading sitemaps.
+        
+        Used by worker processes that share one catalogue: a single loader
+        downloads, parses and snapshots the sitemaps, and every worker maps
+        the same snapshot files, so the hymns and index are held in memory
+        once however many workers run. Calling this again picks up snapshots
+        the loader has rewritten since, reusing shards that haven't changed.
+        Returns the number of hymns attached.
+        """
+        with self._load_lock, METRICS.timer('hymnbot_catalogue_load_seconds', phase='attach'):
+            # Searches must wait for the loader rather than start a load of their own
+            if self.state == CatalogueState.COLD:
+                self.state = CatalogueState.LOADING
+            
+            current = self._catalogue
+            if self.backend == "sqlite":
+                return self._attach_database(current)
+            
+            # Follow the loader's shard order so ties rank the same whichever process answers,
+            # and leave out sitemaps it has stopped serving even if their snapshots remain
+            order = read_shard_order(self.sitemap_dir) or []
+            sources = [self.sitemap_dir / name for name in order if _wanted(name, self.record_types)]
+            sources = [path for path in sources if path.exists()]
+            
+            shards = []
+            for source in sources:
+                source_shards = current.sitemap_shards(source.name)
+                manifest = build_manifest([source])
+                if not source_shards or source_shards[0].manifest != manifest:
+                    snapshot = read_snapshot(snapshot_path_for(source), manifest)
+                    if snapshot is not None:
+                        source_shards = [CatalogueShard(source.name, hymns, index, manifest=manifest,
+                                                        record_type=kind)
+                                         for kind, hymns, index in snapshot]
+                # Otherwise the loader is mid-rewrite; keep the old shards until it's done
+                shards.extend(source_shards)
+            
+            if not shards:
+                logger.info("No catalogue snapshots to attach yet")
+                return 0
+            
+            catalogue = Catalogue(shards)
+            if [s.manifest for s in catalogue.shards] != [s.manifest for s in current.shards]:
+                self._publish(catalogue)
+                logger.info(f"Attached {len(catalogue)} hymns from {len(shards)} snapshots")
+            self.state = CatalogueState.READY
+            self.ready.set()
+            return len(self._catalogue)
+    
+    def _attach_database(self, current: Union[Catalogue, SqliteCatalogue]) -> int:
+        """Open the database the loader built, if it's newer than the one being served."""
+        database = SqliteCatalogue.open(self.database_path)
+        if database is None:
+            logger.info("No catalogue database to attach yet")
+            return len(current)
+        if getattr(current, 'manifest', None) == database.manifest:
+            database.close()
+        else:
+            self._publish(database)
+            logger.info(f"Attached {len(database)} hymns from {self.database_path}")
+        self.state = CatalogueState.READY
+        self.ready.set()
+        return len(self._catalogue)
+    
+    async def attach_in_background(self) -> int:
+        """Run attach_catalogue on a worker thread without blocking the event loop."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.attach_catalogue)
+    
+    def refresh_catalogue(self) -> int:
+        """
+        Re-fetch sitemaps whose <lastmod> changed and rebuild only their shards.
+        
+        Unchanged shards are reused as-is and the new catalogue is swapped in
+        with a single assignment. An empty catalogue (say, the last load
+        failed) is loaded from scratch instead. Returns the number of
+        sitemaps rebuilt.
+        """
+        if not len(self._catalogue):
+            # Nothing to reuse; load_all_hymns takes the load lock itself
+            logger.info("Catalogue is empty, loading it instead of refreshing")
+            self.load_all_hymns(force_reload=True)
+            catalogue = self._catalogue
+            return len({shard.name for shard in catalogue.shards}) or len(getattr(catalogue, 'manifest', ()))
+        
+        with self._load_lock, METRICS.timer('hymnbot_catalogue_load_seconds', phase='refresh'):
+            current = self._catalogue
+            
+            # Revalidate the sitemap index itself, then read the new <lastmod> values
+            _run_coroutine(self.fetcher.fetch_all([self.index_url], revalidate=True))
+            if not self.parse_sitemap_index():
+                return 0
+            
+            if self.backend == "sqlite":
+                return self._refresh_database(current)
+            
+            urls = [url for url in self.sitemap_urls if _wanted(url.split('/')[-1], self.record_types)]
+            changed = []
+            for url in urls:
+                name = url.split('/')[-1]
+                old_shards = current.sitemap_shards(name)
+                lastmod = self.sitemap_lastmods.get(name)
+                if not old_shards or lastmod is None or lastmod != old_shards[0].lastmod:
+                    changed.append(url)
+            
+            fetched = dict(zip(changed, _run_coroutine(self.fetcher.fetch_all(changed, revalidate=True))))
+            
+            shards = []
+            rebuilt = 0
+            for url in urls:
+                name = url.split('/')[-1]
+                sitemap_shards = current.sitemap_shards(name)
+                path = fetched.get(url)
+                if path is not None:
+                    lastmod = self.sitemap_lastmods.get(name)
+                    if sitemap_shards and sitemap_shards[0].manifest == build_manifest([path]):
+                        # Listed as changed, but the server sent back the same file
+                        sitemap_shards = [CatalogueShard(name, shard.hymns, shard.index, lastmod=lastmod,
+                                                         manifest=shard.manifest, record_type=shard.record_type)
+                                          for shard in sitemap_shards]
+                    else:
+                        # Keep serving the old shards if the new file can't be parsed
+                        new_shards = self._load_shards(path)
+                        if new_shards is not None:
+                            sitemap_shards = new_shards
+                            rebuilt += 1
+                shards.extend(sitemap_shards)
+            
+            catalogue = Catalogue(shards)
+            self._publish_shards(catalogue)
+            logger.info(f"Refreshed catalogue: rebuilt {rebuilt} of {len(shards)} sitemaps, "
+                        f"{len(catalogue)} hymns")
+            return rebuilt
+    
+    def _refresh_database(self, current: SqliteCatalogue) -> int:
+        """
+        Rebuild the database if any sitemap's <lastmod> changed.
+        
+        The database can't be rebuilt in parts, so it's rebuilt from every
+        sitemap, reusing the files on disk for those that didn't change.
+        Returns the number of sitemaps that changed.
+        """
+        urls = [url for url in self.sitemap_urls if _wanted(url.split('/')[-1], self.record_types)]
+        changed = []
+        for url in urls:
+            name = url.split('/')[-1]
+            lastmod = self.sitemap_lastmods.get(name)
+            if name not in current.manifest or lastmod is None or lastmod != current.lastmods.get(name):
+                changed.append(url)
+        if not changed and len(urls) == len(current.manifest):
+            logger.info("Refreshed catalogue: no sitemaps changed")
+            return 0
+        
+        _run_coroutine(self.fetcher.fetch_all(changed, revalidate=True))
+        files = self.download_sitemaps(name_filter=self.record_types)
+        if build_manifest(files) == current.manifest:
+            # Listed as changed, but the server sent back the same files
+            return 0
+        
+        # Keep serving the old database if the new one can't be built
+        database = self._load_database(files, rebuild=True)
+        if database is not None:
+            self._publish(database)
+            logger.info(f"Refreshed catalogue: {len(changed)} sitemaps changed, {len(database)} hymns")
+        return len(changed)
+    
+    async def load_in_background(self, force_reload: bool = False) -> int:
+        """
+        Load the catalogue on a worker thread without blocking the event loop.
+        
+        Returns the number of hymns loaded. Check is_ready or state to see
+        whether the catalogue can be searched yet.
+        """
+        # Mark the load as started now so searches don't try to start their own
+        if self.state in (CatalogueState.COLD, CatalogueState.FAILED):
+            self.state = CatalogueState.LOADING
+        
+        loop = asyncio.get_running_loop()
+        hymns = await loop.run_in_executor(None, self.load_all_hymns, force_reload)
+        return len(hymns)
+    
+    async def refresh_in_background(self) -> int:
+        """Run refresh_catalogue on a worker thread without blocking the event loop."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.refresh_catalogue)
+    
+    def _needs_load(self) -> bool:
+        """Whether a search should load the catalogue first: nobody has loaded it, or the last load failed."""
+        return not self.hymn_data and self.state in (CatalogueState.COLD, CatalogueState.FAILED)
+    
+    def search_hymns(
+        self,
+        query: str,
+        max_results: int = 10,
+        record_type: Optional[str] = None
+    ) -> List[Dict[str, str]]:
+        """
+        Search for hymns matching the query using the inverted index.
+        
+        With record_type (e.g. "tune"), only records of that type are returned.
+        """
+        if self._needs_load():
             self.load_all_hymns()
         
+        return self._search(self._catalogue, query, max_results, record_type)
+    
+    def _cached_search(self, catalogue: Catalogue, key: Any) -> Optional[List[Dict[str, str]]]:
+        """Return cached results for key if they came from this catalogue."""
+        # Results are cached along with the catalogue they came from, so a
+        # search racing a catalogue swap can never serve stale hymns
+        cached = self.query_cache.get(key)
+        if cached is not None and cached[0] is catalogue:
+            return list(cached[1])
+        return None
+    
+    def _search(
+        self,
+        catalogue: Catalogue,
+        query: str,
+        max_results: int,
+        record_type: Optional[str] = None
+    ) -> List[Dict[str, str]]:
+        """Search one catalogue, going through the query cache."""
+        start = time.perf_counter()
+        key = (normalize_query(query), max_results, record_type)
+        cached = self._cached_search(catalogue, key)
+        if cached is not None:
+            METRICS.observe('hymnbot_search_seconds', time.perf_counter() - start, cache='hit')
+            return cached
+        
         try:
-            # Create a regex pattern that's flexible with the query
-            # Replace spaces with optional underscores/spaces
-            pattern = query.lower().strip()
-            pattern = re.escape(pattern)
-            pattern = pattern.replace(r'\ ', r'[\s_]+')
-            
-            regex = re.compile(pattern, re.IGNORECASE)
-            
-            matches = []
-            for hymn in self.hymn_data:
-                if regex.search(hymn['title_lower']):
-                    matches.append(hymn)
-                    if len(matches) >= max_results:
-                        break
-            
-            return matches
+            results = catalogue.search(query, max_results, record_type)
         except Exception as e:
             logger.error(f"Error searching hymns: {e}")
             return []
+        
+        self.query_cache.put(key, (catalogue, results))
+        METRICS.observe('hymnbot_search_seconds', time.perf_counter() - start, cache='miss')
+        return list(results)
+    
+    async def search_hymns_async(
+        self,
+        query: str,
+        max_results: int = 10,
+        timeout: Optional[float] = SEARCH_TIMEOUT,
+        record_type: Optional[str] = None
+    ) -> List[Dict[str, str]]:
+        """
+        Search for hymns on a worker thread so the event loop keeps running.
+        
+        Cached results are returned straight away, and concurrent callers
+        with the same query share one search. Raises asyncio.TimeoutError if
+        the search takes longer than timeout seconds; the search itself keeps
+        running, shared with anyone repeating the query, and caches its results.
+        """
+        if self._needs_load():
+            await self.load_in_background()
+        
+        catalogue = self._catalogue
+        key = (normalize_query(query), max_results, record_type)
+        cached = self._cached_search(catalogue, key)
+        if cached is not None:
+            return cached
+        
+        inflight_key = (key, catalogue)
+        search = self._inflight.get(inflight_key)
+        if search is None or search.future.cancelled():
+            work = self._search_executor.submit(self._search, catalogue, query, max_results, record_type)
+            search = self._inflight[inflight_key] = _InflightSearch(work)
+            # Shared until the worker thread is really done, so a repeat after a timeout joins it
+            search.future.add_done_callback(lambda _, done=search: self._forget_search(inflight_key, done))
+        else:
+            self.coalesced_searches += 1
+        
+        search.waiters += 1
+        try:
+            # Shield the shared search so one caller giving up doesn't cancel it for the rest
+            results = await asyncio.wait_for(asyncio.shield(search.future), timeout)
+        finally:
+            search.waiters -= 1
+            if search.waiters == 0 and not search.future.done():
+                # Nobody is waiting any more; this only stops it if it hasn't started,
+                # otherwise it runs on, caching its results for the next caller
+                search.work.cancel()
+        return list(results)
+    
+    def _forget_search(self, inflight_key: Any, search: _InflightSearch):
+        """Stop sharing a finished search, unless a newer one has replaced it."""
+        if self._inflight.get(inflight_key) is search:
+            del self._inflight[inflight_key]
+    
+    def stats(self) -> Dict[str, float]:
+        """Return catalogue, index and cache figures for the metrics endpoint."""
+        catalogue = self._catalogue
+        cache = self.query_cache.stats()
+        return {
+            'hymnbot_catalogue_ready': 1 if self.is_ready else 0,
+            'hymnbot_catalogue_hymns': len(catalogue),
+            'hymnbot_catalogue_shards': len(catalogue.shards),
+            'hymnbot_index_tokens': sum(len(shard.index.vocabulary) for shard in catalogue.shards),
+            'hymnbot_query_cache_entries': cache['entries'],
+            'hymnbot_query_cache_hits_total': cache['hits'],
+            'hymnbot_query_cache_misses_total': cache['misses'],
+            'hymnbot_query_cache_evictions_total': cache['evictions'],
+            'hymnbot_query_cache_expirations_total': cache['expirations'],
+            'hymnbot_searches_in_flight': len(self._inflight),
+            'hymnbot_searches_coalesced_total': self.coalesced_searches,
+        }
+    
+    def close(self):
+        """Stop the search worker threads once queued searches finish."""
+        self._search_executor.shutdown(wait=False)
+    
+    def complete_titles(
+        self,
+        text: str,
+        limit: int = 25,
+        record_type: Optional[str] = None
+    ) -> List[Dict[str, str]]:
+        """Return hymns whose titles complete the partially typed text."""
+        # Never trigger a catalogue load from autocomplete; it must answer instantly
+        try:
+            return self._catalogue.complete(text, limit, record_type)
+        except Exception as e:
+            logger.error(f"Error completing hymn titles: {e}")
+            return []
 
 
 def initialize_sitemaps():
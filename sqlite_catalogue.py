@@ -0,0 +1,471 @@
+"""
+SQLite Catalogue
+
+This module stores the catalogue in an SQLite database instead of Python
+objects. Titles are indexed by an FTS5 trigram table, so substring matches are
+found from the index, and the candidates are ranked by the same code as the
+in-memory index, so both backends return the same results. A process only has
+to open the database file, so startup time and memory barely grow with the
+size of the catalogue, and processes reading the same file share its pages
+through the OS cache.
+"""
+
+import os
+import json
+import queue
+import sqlite3
+import logging
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from collections.abc import Sequence as SequenceABC
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
+
+from hymn_store import search_key, split_url, title_from_slug
+from search_index import (
+    COMPLETION_BUDGET, FUZZY_MAX_CANDIDATES, RANK_BUDGET, FuzzyKey, QueryMatcher, RankKey, add_fuzzy_matches,
+    choose_trigrams, closest_words, rank_matches, search_corrected, tokenize, trigrams
+)
+
+logger = logging.getLogger(__name__)
+
+DATABASE_FILENAME = "catalogue.sqlite3"
+SCHEMA_VERSION = 2
+
+BATCH_SIZE = 10000       # Records inserted per transaction while building
+READ_CONNECTIONS = 4     # Connections each catalogue keeps for concurrent searches
+MMAP_SIZE = 1 << 30      # Bytes of the database read through a shared memory mapping
+
+SCHEMA = """
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE records (
+    id INTEGER PRIMARY KEY,  -- Catalogue order: sitemap order, then record type
+    record_type TEXT NOT NULL,
+    url TEXT NOT NULL,
+    search_key TEXT NOT NULL  -- hymn_store.search_key of the title
+);
+CREATE VIRTUAL TABLE titles USING fts5(
+    search_key, content='records', content_rowid='id', tokenize='trigram'
+);
+CREATE TABLE words (id INTEGER PRIMARY KEY, word TEXT NOT NULL, hymns INTEGER NOT NULL);
+CREATE TABLE word_trigrams (gram TEXT NOT NULL, word_id INTEGER NOT NULL);
+"""
+
+# Created after the bulk insert, which is much faster than maintaining them row by row
+INDEXES = [
+    "CREATE INDEX records_key ON records (search_key, id)",
+    "CREATE INDEX records_type ON records (record_type, id)",
+    "CREATE UNIQUE INDEX words_word ON words (word)",
+    "CREATE INDEX word_trigrams_gram ON word_trigrams (gram, word_id)",
+]
+
+# Sorts after every character that can follow a prefix
+PREFIX_END = '\U0010ffff'
+
+# (record type, URLs) for the records of one type in a sitemap
+DatabasePart = Tuple[str, Iterable[str]]
+
+
+def build_database(
+    path: Path,
+    manifest: Dict[str, List[int]],
+    parts: Iterable[DatabasePart],
+    lastmods: Optional[Dict[str, str]] = None
+) -> bool:
+    """
+    Write every record in parts to a new database at path, replacing any previous one.
+
+    manifest describes the sitemap files the records came from, and lastmods
+    their <lastmod> values, so later loads and refreshes can tell whether
+    the database is still current.
+
+    Records are inserted in BATCH_SIZE transactions into a temporary file,
+    which is renamed into place once complete, so readers never see a
+    half-built database. Returns whether it was written.
+    """
+    temp_path = path.with_name(path.name + '.tmp')
+    try:
+        if temp_path.exists():
+            temp_path.unlink()
+        connection = sqlite3.connect(str(temp_path))
+        try:
+            # Nothing is lost if this is interrupted; the file is only renamed in when done
+            connection.execute("PRAGMA journal_mode = OFF")
+            connection.execute("PRAGMA synchronous = OFF")
+            connection.executescript(SCHEMA)
+
+            words: Counter = Counter()
+            record_types: Set[str] = set()
+            count = 0
+            batch: List[Tuple[str, str, str]] = []
+
+            def flush():
+                with connection:
+                    connection.executemany(
+                        "INSERT INTO records (record_type, url, search_key) VALUES (?, ?, ?)", batch)
+                batch.clear()
+
+            for record_type, urls in parts:
+                record_types.add(record_type)
+                for url in urls:
+                    key = search_key(title_from_slug(split_url(url)[1]))
+                    words.update(set(tokenize(key)))
+                    batch.append((record_type, url, key))
+                    if len(batch) >= BATCH_SIZE:
+                        count += len(batch)
+                        flush()
+            count += len(batch)
+            flush()
+
+            vocabulary = sorted(words)
+            with connection:
+                connection.execute("INSERT INTO titles (titles) VALUES ('rebuild')")
+                connection.executemany("INSERT INTO words (id, word, hymns) VALUES (?, ?, ?)",
+                                       ((word_id, word, words[word]) for word_id, word in enumerate(vocabulary)))
+                connection.executemany("INSERT INTO word_trigrams (gram, word_id) VALUES (?, ?)",
+                                       ((gram, word_id) for word_id, word in enumerate(vocabulary)
+                                        for gram in trigrams(word)))
+                for statement in INDEXES:
+                    connection.execute(statement)
+                connection.executemany("INSERT INTO meta (key, value) VALUES (?, ?)", [
+                    ('version', str(SCHEMA_VERSION)),
+                    ('manifest', json.dumps(manifest, sort_keys=True)),
+                    ('lastmods', json.dumps(lastmods or {}, sort_keys=True)),
+                    ('records', str(count)),
+                    ('record_types', json.dumps(sorted(record_types))),
+                ])
+            connection.execute("ANALYZE")
+        finally:
+            connection.close()
+
+        os.replace(temp_path, path)
+        logger.info(f"Built catalogue database {path} ({count} records, {len(vocabulary)} words)")
+        return True
+    except Exception as e:
+        logger.error(f"Error building catalogue database {path}: {e}")
+        if temp_path.exists():
+            temp_path.unlink()
+        return False
+
+
+def _record(url: str) -> Dict[str, str]:
+    """Return a hymn dict, as the in-memory catalogue's records read."""
+    title = title_from_slug(split_url(url)[1])
+    return {'url': url, 'title': title, 'title_lower': title.lower()}
+
+
+def _match_phrase(fragment: str) -> str:
+    """Quote a fragment as an FTS5 phrase."""
+    return '"' + fragment.replace('"', '""') + '"'
+
+
+def _like_pattern(fragments: Sequence[str]) -> str:
+    """Return a LIKE pattern matching titles containing the fragments in order."""
+    escaped = [f.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') for f in fragments]
+    return '%' + '%'.join(escaped) + '%'
+
+
+class SqliteHymns(SequenceABC):
+    """Read-only view of every hymn in the database, in catalogue order."""
+
+    def __init__(self, catalogue: 'SqliteCatalogue'):
+        self._catalogue = catalogue
+
+    def __len__(self) -> int:
+        return self._catalogue.record_count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("hymn index out of range")
+        with self._catalogue.connection() as connection:
+            # Record ids are catalogue positions counted from 1
+            url, = connection.execute("SELECT url FROM records WHERE id = ?", (index + 1,)).fetchone()
+        return _record(url)
+
+    def __iter__(self) -> Iterator[Dict[str, str]]:
+        with self._catalogue.connection() as connection:
+            for url, in connection.execute("SELECT url FROM records ORDER BY id"):
+                yield _record(url)
+
+
+class SqliteCatalogue:
+    """
+    The catalogue served from an SQLite database.
+
+    Offers the same reads as Catalogue (search, complete, record_types,
+    hymns and len), so SitemapManager can use either. The database is
+    opened read-only through a small pool of connections shared by the
+    search threads.
+    """
+
+    shards: Tuple = ()  # Nothing is held in memory per sitemap
+
+    def __init__(self, path: Path, pool_size: int = READ_CONNECTIONS):
+        self.path = path
+        self.pool_size = pool_size
+        self._idle: 'queue.LifoQueue[sqlite3.Connection]' = queue.LifoQueue()
+        self._opened = 0
+        self._pool_lock = threading.Lock()
+        self._closed = False
+
+        with self.connection() as connection:
+            meta = dict(connection.execute("SELECT key, value FROM meta"))
+        if int(meta['version']) != SCHEMA_VERSION:
+            raise ValueError(f"schema version {meta['version']}, expected {SCHEMA_VERSION}")
+        self.manifest = json.loads(meta['manifest'])
+        self.lastmods: Dict[str, str] = json.loads(meta['lastmods'])  # Sitemap filename -> <lastmod>
+        self.record_count = int(meta['records'])
+        self._record_types: List[str] = json.loads(meta['record_types'])
+        self.hymns = SqliteHymns(self)
+
+    @classmethod
+    def open(cls, path: Path, manifest: Optional[Dict[str, List[int]]] = None) -> Optional['SqliteCatalogue']:
+        """
+        Open the database at path.
+
+        Returns None if it's missing, from another schema version, or (when a
+        manifest is given) built from different sitemaps.
+        """
+        if not path.exists():
+            return None
+        try:
+            catalogue = cls(path)
+        except (sqlite3.Error, KeyError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable catalogue database {path}: {e}")
+            return None
+        if manifest is not None and catalogue.manifest != manifest:
+            catalogue.close()
+            return None
+        return catalogue
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path.resolve().as_uri() + '?mode=ro', uri=True,
+                                     check_same_thread=False)
+        connection.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+        return connection
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """Borrow a read connection from the pool, opening one if there are fewer than pool_size."""
+        try:
+            connection = self._idle.get_nowait()
+        except queue.Empty:
+            with self._pool_lock:
+                create = self._opened < self.pool_size
+                if create:
+                    self._opened += 1
+            connection = self._connect() if create else self._idle.get()
+        if connection is None:
+            # The pool was closed (see close); pass the word on and use a connection of our own
+            self._idle.put(None)
+            connection = self._connect()
+        try:
+            yield connection
+        finally:
+            if self._closed:
+                connection.close()
+            else:
+                self._idle.put(connection)
+
+    def close(self):
+        """
+        Close the pool's connections.
+
+        Ones in use by searches still running on this catalogue are closed as
+        they're returned, and any later reads get a connection of their own.
+        """
+        self._closed = True
+        while True:
+            try:
+                connection = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            if connection is not None:
+                connection.close()
+        # Wakes reads waiting for a pooled connection, and tells later ones there won't be one
+        self._idle.put(None)
+
+    def __len__(self) -> int:
+        return self.record_count
+
+    def sitemap_shards(self, name: str) -> List:
+        return []
+
+    def record_types(self) -> List[str]:
+        """Return the record types in the catalogue, sorted."""
+        return list(self._record_types)
+
+    @staticmethod
+    def _type_filter(record_type: Optional[str], column: str = 'record_type') -> Tuple[str, Tuple[str, ...]]:
+        """Return an SQL condition (with its parameters) limiting rows to record_type."""
+        if record_type is None:
+            return '', ()
+        return f' AND {column} = ?', (record_type,)
+
+    def search(self, query: str, max_results: int = 10, record_type: Optional[str] = None) -> List[Dict[str, str]]:
+        """Return the best max_results hymns matching the query, best first, as Catalogue.search does."""
+        results = [hymn for _, hymn in self.search_ranked(query, max_results, RANK_BUDGET, record_type)]
+        return add_fuzzy_matches(results, max_results,
+                                 lambda count: self.search_fuzzy(query, count, RANK_BUDGET, record_type))
+
+    def search_ranked(
+        self,
+        query: str,
+        max_results: int = 10,
+        budget: int = RANK_BUDGET,
+        record_type: Optional[str] = None
+    ) -> List[Tuple[RankKey, Dict[str, str]]]:
+        """Return the best max_results (rank key, hymn) pairs, ranked as HymnSearchIndex ranks them."""
+        matcher = QueryMatcher(query)
+        query = matcher.query
+        condition, parameters = self._type_filter(record_type)
+
+        with self.connection() as connection:
+            prefix_matches = connection.execute(
+                "SELECT search_key, id FROM records WHERE search_key >= ? AND search_key < ?"
+                f"{condition} ORDER BY search_key, id LIMIT ?",
+                (query, query + PREFIX_END) + parameters + (budget,))
+            candidates = self._candidates(connection, query, record_type)
+            try:
+                ranked = rank_matches(matcher, prefix_matches, candidates, max_results, budget)
+            finally:
+                candidates.close()
+            records = self._records(connection, [key[2] for key in ranked])
+        return [(key, records[key[2]]) for key in ranked]
+
+    def _candidates(self, connection: sqlite3.Connection, query: str, record_type: Optional[str]) -> sqlite3.Cursor:
+        """Return a cursor over (title, id) rows, in catalogue order, that could match query."""
+        fragments = query.split(' ')
+        if not query:
+            # An empty query (or one of only punctuation) matches every title
+            condition, parameters = self._type_filter(record_type)
+            return connection.execute(
+                f"SELECT search_key, id FROM records WHERE 1{condition} ORDER BY id", parameters)
+
+        # The trigram index finds fragments of three or more letters anywhere in a title
+        terms = [f for f in fragments if len(f) >= 3]
+        if terms:
+            condition, parameters = self._type_filter(record_type, 'records.record_type')
+            return connection.execute(
+                "SELECT records.search_key, records.id FROM titles JOIN records ON records.id = titles.rowid "
+                f"WHERE titles MATCH ?{condition} ORDER BY titles.rowid",
+                (' AND '.join(_match_phrase(f) for f in terms),) + parameters)
+
+        # Shorter fragments can't use the index; LIKE at least filters in C
+        condition, parameters = self._type_filter(record_type)
+        return connection.execute(
+            f"SELECT search_key, id FROM records WHERE search_key LIKE ? ESCAPE '\\'{condition} ORDER BY id",
+            (_like_pattern(fragments),) + parameters)
+
+    @staticmethod
+    def _records(connection: sqlite3.Connection, ids: Sequence[int]) -> Dict[int, Dict[str, str]]:
+        """Return the hymns with the given ids, by id."""
+        if not ids:
+            return {}
+        placeholders = ','.join('?' * len(ids))
+        return {
+            hymn_id: _record(url)
+            for hymn_id, url in connection.execute(
+                f"SELECT id, url FROM records WHERE id IN ({placeholders})", list(ids))
+        }
+
+    def search_fuzzy(
+        self,
+        query: str,
+        max_results: int = 10,
+        budget: int = RANK_BUDGET,
+        record_type: Optional[str] = None
+    ) -> List[Tuple[FuzzyKey, Dict[str, str]]]:
+        """Return the best max_results (rank key, hymn) pairs for a query with typos."""
+        return search_corrected(query, max_results, self.is_word, self.similar_words,
+                                lambda phrase, count: self.search_ranked(phrase, count, budget, record_type))
+
+    def is_word(self, word: str) -> bool:
+        """Whether word appears in any title."""
+        with self.connection() as connection:
+            return connection.execute("SELECT 1 FROM words WHERE word = ?", (word,)).fetchone() is not None
+
+    def similar_words(self, word: str, max_distance: int) -> List[Tuple[int, str]]:
+        """
+        Return (edit distance, word) pairs for title words close to word, closest first.
+
+        Trigrams are chosen and candidates checked by the same choose_trigrams
+        and closest_words as HymnSearchIndex.similar_words.
+        """
+        if max_distance <= 0:
+            return []
+
+        grams = sorted(trigrams(word))
+        with self.connection() as connection:
+            placeholders = ','.join('?' * len(grams))
+            counts = dict.fromkeys(grams, 0)
+            counts.update(connection.execute(
+                f"SELECT gram, COUNT(*) FROM word_trigrams WHERE gram IN ({placeholders}) GROUP BY gram", grams))
+            chosen, required = choose_trigrams(counts, max_distance)
+            used = [gram for gram in chosen if counts[gram]]
+            if not used:
+                return []
+
+            placeholders = ','.join('?' * len(used))
+            rows = connection.execute(
+                "SELECT words.word, words.hymns FROM ("
+                f"  SELECT word_id, COUNT(*) AS shared FROM word_trigrams WHERE gram IN ({placeholders})"
+                "   GROUP BY word_id HAVING shared >= ? ORDER BY shared DESC, word_id LIMIT ?"
+                ") AS candidates JOIN words ON words.id = candidates.word_id",
+                used + [required, FUZZY_MAX_CANDIDATES]).fetchall()
+        return closest_words(word, max_distance, rows)
+
+    def complete(self, text: str, limit: int = 25, record_type: Optional[str] = None) -> List[Dict[str, str]]:
+        """
+        Return up to limit hymns for autocompleting a partially typed title.
+
+        Titles starting with the text come first in title order, then titles
+        with a later word starting with it in catalogue order, taking at most
+        COMPLETION_BUDGET of each. complete_titles returns the same list, or
+        the start of it when common words give it more candidates than its
+        budget lets it look at.
+        """
+        text = search_key(text)
+        if not text:
+            return []
+
+        results: List[Dict[str, str]] = []
+        seen: Set[str] = set()
+
+        def add(key: str, url: str) -> bool:
+            if key not in seen:
+                seen.add(key)
+                results.append(_record(url))
+            return len(results) >= limit
+
+        with self.connection() as connection:
+            condition, parameters = self._type_filter(record_type)
+            for title, url in connection.execute(
+                    "SELECT search_key, url FROM records WHERE search_key >= ? AND search_key < ?"
+                    f"{condition} ORDER BY search_key, id LIMIT ?",
+                    (text, text + PREFIX_END) + parameters + (COMPLETION_BUDGET,)):
+                if add(title, url):
+                    return results
+
+            # A space before the text marks the start of a later word
+            needle = ' ' + text
+            if len(needle) >= 3:
+                condition, parameters = self._type_filter(record_type, 'records.record_type')
+                rows = connection.execute(
+                    "SELECT records.search_key, records.url FROM titles JOIN records ON records.id = titles.rowid "
+                    f"WHERE titles MATCH ?{condition} ORDER BY titles.rowid LIMIT ?",
+                    (_match_phrase(needle),) + parameters + (COMPLETION_BUDGET,))
+            else:
+                rows = connection.execute(
+                    f"SELECT search_key, url FROM records WHERE search_key LIKE ? ESCAPE '\\'{condition} "
+                    "ORDER BY id LIMIT ?",
+                    (_like_pattern([needle]),) + parameters + (COMPLETION_BUDGET,))
+            for key, url in rows:
+                if needle in key and add(key, url):
+                    break
+        return results
@@ -77,10 +77,1282 @@ def test_sitemap_manager():
             for hymn in results:
                 print(f"      - {hymn['title']}")
         
+        # Test 4: Streaming parse of a gzipped sitemap
+        print("\n4. Testing streaming sitemap parsing:")
+        import gzip
+        gz_path = Path(tmpdir) / "index_text_0.xml.gz"
+        with gzip.open(gz_path, 'wt', encoding='utf-8') as f:
+            f.write('<?xml version="1.0" encoding="UTF-8"?>'
+                    '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">')
+            for url in test_urls:
+                f.write(f'<url><loc>{url}</loc><changefreq>weekly</changefreq></url>')
+            f.write('</urlset>')
+        parsed = manager.parse_sitemap_file(gz_path)
+        assert [h['url'] for h in parsed] == test_urls
+        assert parsed[1]['title'] == "How Great Thou Art"
+        print(f"   Parsed {len(parsed)} hymns from {gz_path.name}")
+        
         print("\n" + "=" * 50)
         print("✓ All tests passed!")
         return True
 
+def test_search_index():
+    """Test that the inverted index matches a plain regex scan."""
+    print("\nTesting Search Index...")
+    print("-" * 50)
+    
+    from search_index import HymnSearchIndex, compile_query
+    
+    titles = [
+        "Amazing Grace How Sweet The Sound",
+        "Grace Greater Than Our Sin",
+        "How Great Thou Art",
+        "Great Is Thy Faithfulness",
+        "Be Thou My Vision",
+        "Marvelous Grace Of Our Loving Lord",
+        "Thou Art Worthy",
+    ]
+    hymns = [
+        {'url': f"https://hymnary.org/text/{t.lower().replace(' ', '_')}",
+         'title': t, 'title_lower': t.lower()}
+        for t in titles
+    ]
+    index = HymnSearchIndex(hymns)
+    
+    def rank(hymn, query):
+        """Exact, then prefix, then word start, then substring; shorter titles first."""
+        title = hymn['title_lower']
+        if title == query:
+            tier = 0
+        elif title.startswith(query):
+            tier = 1
+        elif f" {query}" in f" {title}":
+            tier = 2
+        else:
+            tier = 3
+        return (tier, len(title), hymns.index(hymn))
+    
+    queries = ["grace", "race", "great thou", "eat thou a", "thou art",
+               "ace gre", "our", "", "  ", "xyz_not_found", "grace  greater"]
+    for query in queries:
+        regex = compile_query(query)
+        matches = [h for h in hymns if regex.search(h['title_lower'])]
+        expected = sorted(matches, key=lambda h: rank(h, query.lower().strip()))[:3]
+        results = index.search(query, max_results=3)
+        assert results == expected, f"Mismatch for {query!r}"
+        print(f"   Query: {query!r} → {len(results)} result(s)")
+    
+    # Words containing a fragment come from the trigram index, not a vocabulary scan
+    for fragment in ["rac", "race", "ou", "hfulne", "zzz", "thou"]:
+        assert index._tokens_containing(fragment) == [t for t in index.vocabulary if fragment in t]
+    
+    # Prefix match beats word matches; shorter titles break ties
+    assert [h['title'] for h in index.search("grace", max_results=3)] == [
+        "Grace Greater Than Our Sin",
+        "Amazing Grace How Sweet The Sound",
+        "Marvelous Grace Of Our Loving Lord",
+    ]
+    assert index.search("how great thou art", max_results=1)[0]['title'] == "How Great Thou Art"
+    
+    # Autocomplete: whole-title prefixes first, then word prefixes
+    completions = [h['title'] for h in index.complete("gra", limit=5)]
+    print(f"   Complete: 'gra' → {completions}")
+    assert completions == ["Grace Greater Than Our Sin",
+                           "Amazing Grace How Sweet The Sound",
+                           "Marvelous Grace Of Our Loving Lord"]
+    assert [h['title'] for h in index.complete("thou a", limit=5)] == \
+        ["Thou Art Worthy", "How Great Thou Art"]
+    assert index.complete("   ") == []
+    
+    # Typos are corrected to the closest indexed words
+    from catalogue import Catalogue
+    from search_index import edit_distance
+    assert edit_distance("vision", "visoin", 2) == 1
+    assert edit_distance("grace", "great", 1) == 2
+    assert [h['title'] for _, h in index.search_fuzzy("amazng grce")] == \
+        ["Amazing Grace How Sweet The Sound"]
+    assert index.search_fuzzy("xyzzy") == []
+    # Corrections come out cheapest first without listing every combination
+    import time
+    import itertools
+    from search_index import cheapest_corrections
+    options = [[(0, "a")], [(1, "b"), (1, "c"), (2, "d")], [(1, "e"), (2, "f")]]
+    assert list(cheapest_corrections(options, 4)) == \
+        sorted(itertools.product(*options), key=lambda c: sum(d for d, _ in c))[:4]
+    # "grase" is one edit from three words here, so 40 of them have 3^40 corrections
+    typo_index = HymnSearchIndex([{'title': title, 'title_lower': title.lower(), 'url': title}
+                                  for title in ["Grace Alone", "Grate Expectations", "Graze Here"]])
+    started = time.perf_counter()
+    typos = typo_index.search_fuzzy(" ".join(["grase"] * 40))
+    elapsed = time.perf_counter() - started
+    print(f"   Fuzzy: 40 typos → {len(typos)} result(s) in {elapsed * 1000:.1f}ms")
+    assert elapsed < 1.0
+    catalogue = Catalogue.from_hymns(hymns)
+    fuzzy = [h['title'] for h in catalogue.search("faithfulnes", max_results=5)]
+    print(f"   Fuzzy: 'faithfulnes' → {fuzzy}")
+    assert fuzzy == ["Great Is Thy Faithfulness"]
+    # Exact hits come first, topped up with fuzzy ones only when there are too few
+    assert [h['title'] for h in catalogue.search("worthy", max_results=5)] == ["Thou Art Worthy"]
+    assert len(catalogue.search("thou", max_results=5)) == 3
+    
+    print("\n" + "=" * 50)
+    print("✓ Search index tests passed!")
+    return True
+
+def test_catalogue_snapshot():
+    """Test that a catalogue snapshot round-trips and detects changed sitemaps."""
+    print("\nTesting Catalogue Snapshot...")
+    print("-" * 50)
+    
+    import tempfile
+    from catalogue_snapshot import build_manifest, read_snapshot, write_snapshot
+    from search_index import HymnSearchIndex
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        manager = SitemapManager(sitemap_dir=Path(tmpdir))
+        source = Path(tmpdir) / "index_text_0.xml"
+        source.write_text("<urlset/>")
+        
+        urls = [
+            "https://hymnary.org/text/amazing_grace_how_sweet_the_sound",
+            "https://hymnary.org/text/how_great_thou_art",
+            "https://hymnary.org/text/be_thou_my_vision",
+        ]
+        hymns = [
+            {'url': url, 'title': manager._extract_title_from_url(url),
+             'title_lower': manager._extract_title_from_url(url).lower()}
+            for url in urls
+        ]
+        index = HymnSearchIndex(hymns)
+        snapshot_path = Path(tmpdir) / "index_text_0.xml.snapshot"
+        
+        assert write_snapshot(snapshot_path, build_manifest([source]), [("text", hymns, index)])
+        loaded = read_snapshot(snapshot_path, build_manifest([source]))
+        assert loaded is not None
+        [(record_type, loaded_hymns, loaded_index)] = loaded
+        assert record_type == "text"
+        assert list(loaded_hymns) == hymns
+        assert loaded_index.search("thou", 10) == index.search("thou", 10)
+        assert loaded_index.complete("be") == index.complete("be")
+        print(f"   Round-tripped {len(loaded_hymns)} hymns")
+        
+        # More distinct URL prefixes than a 16-bit prefix id could hold
+        from hymn_store import HymnStore
+        many = HymnStore.from_urls(f"https://hymnary.org/text/{n}/hymn" for n in range(70000))
+        assert len(many.prefixes) == 70000 and many[69999]['url'] == "https://hymnary.org/text/69999/hymn"
+        many_path = Path(tmpdir) / "many.snapshot"
+        assert write_snapshot(many_path, build_manifest([source]), [("text", many, HymnSearchIndex(many))])
+        [(_, loaded_many, _)] = read_snapshot(many_path, build_manifest([source]))
+        assert loaded_many[69999]['url'] == "https://hymnary.org/text/69999/hymn"
+        
+        # Any change to a source sitemap invalidates the snapshot
+        source.write_text("<urlset></urlset>")
+        assert read_snapshot(snapshot_path, build_manifest([source])) is None
+        print("   Stale snapshot rejected")
+    
+    print("\n" + "=" * 50)
+    print("✓ Catalogue snapshot tests passed!")
+    return True
+
+def test_sitemap_fetcher():
+    """Test conditional GETs and retries against a local HTTP server."""
+    print("\nTesting Sitemap Fetcher...")
+    print("-" * 50)
+    
+    import gzip
+    import asyncio
+    import tempfile
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from sitemap_fetcher import SitemapFetcher
+    
+    statuses = []
+    failures = {'/index_text_1.xml.gz': 1}  # Fail once before succeeding
+    
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if failures.get(self.path, 0) > 0:
+                failures[self.path] -= 1
+                status, body = 503, b""
+            elif self.headers.get('If-None-Match') == '"v1"':
+                status, body = 304, b""
+            else:
+                status, body = 200, gzip.compress(f"sitemap {self.path}".encode())
+            statuses.append(status)
+            self.send_response(status)
+            if status == 200:
+                self.send_header('ETag', '"v1"')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        
+        def log_message(self, *args):
+            pass
+    
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    urls = [f"{base}/index_text_0.xml.gz", f"{base}/index_text_1.xml.gz"]
+    
+    try:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fetcher = SitemapFetcher(Path(tmpdir), backoff=0.01)
+            paths = asyncio.run(fetcher.fetch_all(urls))
+            assert [gzip.decompress(p.read_bytes()) for p in paths] == [b"sitemap /index_text_0.xml.gz",
+                                                                        b"sitemap /index_text_1.xml.gz"]
+            assert sorted(statuses) == [200, 200, 503]
+            print(f"   First fetch: {sorted(statuses)}")
+            
+            # A new fetcher picks up the saved ETags and gets 304s back
+            statuses.clear()
+            fetcher = SitemapFetcher(Path(tmpdir), backoff=0.01)
+            paths = asyncio.run(fetcher.fetch_all(urls))
+            assert len(paths) == 2 and statuses == [304, 304]
+            print(f"   Revalidation: {statuses}")
+    finally:
+        server.shutdown()
+    
+    print("\n" + "=" * 50)
+    print("✓ Sitemap fetcher tests passed!")
+    return True
+
+def test_resumable_download():
+    """Test that interrupted downloads resume and corrupt files are refetched."""
+    print("\nTesting Resumable Downloads...")
+    print("-" * 50)
+    
+    import gzip
+    import random
+    import asyncio
+    import tempfile
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from sitemap_fetcher import PARTIAL_SUFFIX, SitemapFetcher
+    
+    rng = random.Random(0)
+    body = gzip.compress(''.join(rng.choice('abcdefgh ') for _ in range(200_000)).encode())
+    # Flip a byte of the CRC in the gzip trailer
+    corrupt = body[:-8] + bytes([body[-8] ^ 0xFF]) + body[-7:]
+    ranges = []
+    interrupted = []
+    
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            data = corrupt if self.path == '/corrupt.xml.gz' else body
+            ranges.append(self.headers.get('Range'))
+            if self.headers.get('Range') and self.headers.get('If-Range') == '"v1"':
+                offset = int(self.headers['Range'][len('bytes='):-1])
+                self.send_response(206)
+                self.send_header('Content-Range', f'bytes {offset}-{len(data) - 1}/{len(data)}')
+                data = data[offset:]
+            else:
+                self.send_response(200)
+            self.send_header('ETag', '"v1"')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            if self.path == '/index_text_0.xml.gz' and not interrupted:
+                # Drop the connection halfway through the first download
+                interrupted.append(len(data) // 2)
+                self.wfile.write(data[:len(data) // 2])
+                self.close_connection = True
+                return
+            self.wfile.write(data)
+        
+        def log_message(self, *args):
+            pass
+    
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    
+    try:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fetcher = SitemapFetcher(Path(tmpdir), backoff=0.01)
+            [path] = asyncio.run(fetcher.fetch_all([f"{base}/index_text_0.xml.gz"]))
+            assert path.read_bytes() == body
+            assert ranges == [None, f"bytes={interrupted[0]}-"]
+            assert not list(Path(tmpdir).glob(f"*{PARTIAL_SUFFIX}"))
+            print(f"   Resumed from byte {interrupted[0]} of {len(body)}")
+            
+            # A truncated copy on disk is noticed and fetched again
+            path.write_bytes(body[:1000])
+            fetcher = SitemapFetcher(Path(tmpdir), backoff=0.01)
+            [path] = asyncio.run(fetcher.fetch_all([f"{base}/index_text_0.xml.gz"], revalidate=False))
+            assert path.read_bytes() == body
+            print("   Truncated cache entry refetched")
+            
+            # A download failing its CRC check is never put in place
+            fetcher = SitemapFetcher(Path(tmpdir), backoff=0.01, max_retries=1)
+            assert asyncio.run(fetcher.fetch_all([f"{base}/corrupt.xml.gz"])) == [None]
+            assert not (Path(tmpdir) / "corrupt.xml.gz").exists()
+            assert not list(Path(tmpdir).glob(f"*{PARTIAL_SUFFIX}"))
+            print("   Corrupt download rejected")
+    finally:
+        server.shutdown()
+    
+    print("\n" + "=" * 50)
+    print("✓ Resumable download tests passed!")
+    return True
+
+def write_mock_sitemaps(sitemap_dir: Path, sitemaps: dict):
+    """Write a sitemap index and gzipped sitemaps so no download is needed."""
+    import gzip
+    namespace = "http://www.sitemaps.org/schemas/sitemap/0.9"
+    
+    index = [f'<sitemapindex xmlns="{namespace}">']
+    for name, urls in sitemaps.items():
+        index.append(f'<sitemap><loc>https://hymnary.org/{name}</loc></sitemap>')
+        with gzip.open(sitemap_dir / name, 'wt', encoding='utf-8') as f:
+            f.write(f'<urlset xmlns="{namespace}">')
+            f.writelines(f'<url><loc>{url}</loc></url>' for url in urls)
+            f.write('</urlset>')
+    index.append('</sitemapindex>')
+    (sitemap_dir / "sitemap.xml").write_text(''.join(index))
+
+def test_background_loading():
+    """Test loading the catalogue off the event loop with a readiness state."""
+    print("\nTesting Background Loading...")
+    print("-" * 50)
+    
+    import asyncio
+    import tempfile
+    from sitemap_manager import CatalogueState
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        write_mock_sitemaps(Path(tmpdir), {
+            "index_text_0.xml.gz": ["https://hymnary.org/text/how_great_thou_art",
+                                    "https://hymnary.org/text/be_thou_my_vision"],
+            "index_tune_0.xml.gz": ["https://hymnary.org/tune/thou_art_tune"],
+        })
+        manager = SitemapManager(sitemap_dir=Path(tmpdir))
+        assert manager.state == CatalogueState.COLD and not manager.is_ready
+        
+        async def load():
+            task = asyncio.create_task(manager.load_in_background())
+            # The load has started but the event loop is still free to run
+            await asyncio.sleep(0)
+            assert manager.state in (CatalogueState.LOADING, CatalogueState.READY)
+            return await task
+        
+        count = asyncio.run(load())
+        assert count == 3 and manager.is_ready and manager.state == CatalogueState.READY
+        assert [h['title'] for h in manager.search_hymns("thou", record_type="text")] == \
+            ["Be Thou My Vision", "How Great Thou Art"]
+        print(f"   Loaded {count} hymns, state: {manager.state.value}")
+    
+    # A load that finds nothing (e.g. the index is unreachable) fails and is retried by the next search
+    server, base = serve_files({})
+    try:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            manager = SitemapManager(sitemap_dir=Path(tmpdir), index_url=f"{base}/sitemap.xml")
+            assert len(manager.load_all_hymns()) == 0
+            assert manager.state == CatalogueState.FAILED and not manager.is_ready
+            assert manager.search_hymns("thou") == []
+            
+            write_mock_sitemaps(Path(tmpdir), {
+                "index_text_0.xml.gz": ["https://hymnary.org/text/how_great_thou_art"],
+            })
+            assert [h['title'] for h in manager.search_hymns("thou")] == ["How Great Thou Art"]
+            assert manager.state == CatalogueState.READY and manager.is_ready
+            print("   Empty load marked failed and retried on the next search")
+    finally:
+        server.shutdown()
+    
+    print("\n" + "=" * 50)
+    print("✓ Background loading tests passed!")
+    return True
+
+def test_parallel_parsing():
+    """Test that a cold load parsed on worker processes matches a sequential one."""
+    print("\nTesting Parallel Parsing...")
+    print("-" * 50)
+    
+    import tempfile
+    from catalogue_snapshot import SNAPSHOT_SUFFIX
+    
+    sitemaps = {
+        f"index_text_{n}.xml.gz": [f"https://hymnary.org/text/hymn_{n}_{i}_thou" for i in range(50)]
+        for n in range(4)
+    }
+    sitemaps["index_tune_0.xml.gz"] = ["https://hymnary.org/tune/thou_tune"]
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        write_mock_sitemaps(Path(tmpdir), sitemaps)
+        sequential = SitemapManager(sitemap_dir=Path(tmpdir), parse_workers=1)
+        sequential.load_all_hymns()
+        for path in Path(tmpdir).glob(f"*{SNAPSHOT_SUFFIX}"):
+            path.unlink()
+        
+        parallel = SitemapManager(sitemap_dir=Path(tmpdir), parse_workers=2)
+        parallel.load_all_hymns()
+        assert len(list(Path(tmpdir).glob(f"*{SNAPSHOT_SUFFIX}"))) == len(sitemaps)
+        # Served from the snapshots the workers wrote, in sitemap order
+        assert isinstance(parallel.catalogue.shards[0].hymns.slugs, memoryview)
+        assert [h['url'] for h in parallel.hymn_data] == [h['url'] for h in sequential.hymn_data]
+        assert [(s.name, s.record_type) for s in parallel.catalogue.shards] == \
+            [(s.name, s.record_type) for s in sequential.catalogue.shards]
+        assert parallel.search_hymns("thou", 200) == sequential.search_hymns("thou", 200)
+        print(f"   Loaded {len(parallel.hymn_data)} records from {len(sitemaps)} sitemaps on 2 processes")
+    
+    print("\n" + "=" * 50)
+    print("✓ Parallel parsing tests passed!")
+    return True
+
+def serve_files(files: dict):
+    """Serve a dict of path -> bytes from a local HTTP server; returns (server, base_url)."""
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = files.get(self.path)
+            self.send_response(200 if body is not None else 404)
+            self.send_header('Content-Length', str(len(body or b"")))
+            self.end_headers()
+            self.wfile.write(body or b"")
+        
+        def log_message(self, *args):
+            pass
+    
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+def test_catalogue_refresh():
+    """Test that a refresh rebuilds only sitemaps whose lastmod changed."""
+    print("\nTesting Catalogue Refresh...")
+    print("-" * 50)
+    
+    import gzip
+    import tempfile
+    namespace = "http://www.sitemaps.org/schemas/sitemap/0.9"
+    files = {}
+    
+    def publish(sitemaps: dict):
+        index = [f'<sitemapindex xmlns="{namespace}">']
+        for name, (lastmod, slugs) in sitemaps.items():
+            index.append(f'<sitemap><loc>{base}/{name}</loc><lastmod>{lastmod}</lastmod></sitemap>')
+            files[f'/{name}'] = gzip.compress(
+                f'<urlset xmlns="{namespace}">'.encode() +
+                b''.join(f'<url><loc>https://hymnary.org/text/{slug}</loc></url>'.encode() for slug in slugs) +
+                b'</urlset>'
+            )
+        index.append('</sitemapindex>')
+        files['/sitemap.xml'] = ''.join(index).encode()
+    
+    server, base = serve_files(files)
+    try:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            publish({
+                "index_text_0.xml.gz": ("2024-01-01", ["how_great_thou_art"]),
+                "index_text_1.xml.gz": ("2024-01-01", ["be_thou_my_vision"]),
+            })
+            manager = SitemapManager(sitemap_dir=Path(tmpdir), index_url=f"{base}/sitemap.xml")
+            manager.load_all_hymns()
+            old_catalogue = manager.catalogue
+            assert len(manager.search_hymns("thou")) == 2
+            
+            publish({
+                "index_text_0.xml.gz": ("2024-01-01", ["how_great_thou_art"]),
+                "index_text_1.xml.gz": ("2024-02-01", ["be_thou_my_vision", "thou_art_worthy"]),
+            })
+            rebuilt = manager.refresh_catalogue()
+            assert rebuilt == 1
+            # The unchanged shard is reused and the old catalogue is left untouched
+            assert manager.catalogue.shards[0] is old_catalogue.shards[0]
+            assert len(old_catalogue.search("thou")) == 2
+            assert [h['title'] for h in manager.search_hymns("thou")] == \
+                ["Thou Art Worthy", "Be Thou My Vision", "How Great Thou Art"]
+            print(f"   Rebuilt {rebuilt} of {len(manager.catalogue.shards)} sitemaps")
+            
+            assert manager.refresh_catalogue() == 0
+            print("   Unchanged sitemaps skipped")
+            
+            # A second process attaches to the snapshots instead of parsing sitemaps
+            worker = SitemapManager(sitemap_dir=Path(tmpdir), index_url=f"{base}/sitemap.xml")
+            assert worker.attach_catalogue() == 3
+            assert isinstance(worker.catalogue.shards[0].hymns.slugs, memoryview)
+            assert [s.name for s in worker.catalogue.shards] == [s.name for s in manager.catalogue.shards]
+            assert worker.search_hymns("thou") == manager.search_hymns("thou")
+            attached = worker.catalogue
+            assert worker.attach_catalogue() == 3 and worker.catalogue is attached
+            print("   Worker attached to the loader's snapshots")
+            
+            # Workers follow the loader's sitemap order, and drop sitemaps it stops serving
+            publish({
+                "index_text_1.xml.gz": ("2024-02-01", ["be_thou_my_vision", "thou_art_worthy"]),
+                "index_text_0.xml.gz": ("2024-01-01", ["how_great_thou_art"]),
+            })
+            manager.refresh_catalogue()
+            assert worker.attach_catalogue() == 3
+            assert [s.name for s in worker.catalogue.shards] == \
+                [s.name for s in manager.catalogue.shards] == ["index_text_1.xml.gz", "index_text_0.xml.gz"]
+            publish({"index_text_1.xml.gz": ("2024-02-01", ["be_thou_my_vision", "thou_art_worthy"])})
+            manager.refresh_catalogue()
+            assert (Path(tmpdir) / "index_text_0.xml.gz.snapshot").exists()
+            assert worker.attach_catalogue() == 2
+            assert worker.search_hymns("thou") == manager.search_hymns("thou")
+            print("   Worker follows the loader's sitemap order")
+        
+        # A refresh after a failed first load loads the whole catalogue instead of skipping it
+        with tempfile.TemporaryDirectory() as tmpdir:
+            files.clear()
+            manager = SitemapManager(sitemap_dir=Path(tmpdir), index_url=f"{base}/sitemap.xml")
+            assert len(manager.load_all_hymns()) == 0 and not manager.is_ready
+            publish({
+                "index_text_0.xml.gz": ("2024-01-01", ["how_great_thou_art"]),
+                "index_text_1.xml.gz": ("2024-01-01", ["be_thou_my_vision"]),
+            })
+            assert manager.refresh_catalogue() == 2
+            assert manager.is_ready and len(manager.search_hymns("thou")) == 2
+            print("   Empty catalogue loaded by the next refresh")
+    finally:
+        server.shutdown()
+    
+    print("\n" + "=" * 50)
+    print("✓ Catalogue refresh tests passed!")
+    return True
+
+def test_typed_search():
+    """Test that tune and person sitemaps are indexed and searchable by type."""
+    print("\nTesting Typed Search...")
+    print("-" * 50)
+    
+    import gzip
+    import tempfile
+    from hymn_store import HymnStore
+    namespace = "http://www.sitemaps.org/schemas/sitemap/0.9"
+    sitemaps = {
+        "index_text_0.xml.gz": ["text/holy_holy_holy", "text/be_thou_my_vision"],
+        "index_tune_0.xml.gz": ["tune/nicaea", "tune/slane", "tune/holy_manna"],
+        "index_person_0.xml.gz": ["person/heber_reginald", "person/dykes_jb"],
+        "index_mixed_0.xml.gz": ["tune/st_anne"],  # Not a configured type
+    }
+    files = {}
+    
+    # A sitemap listing several record types is split into one store per type
+    store = HymnStore.from_urls(["https://hymnary.org/tune/slane", "https://hymnary.org/text/slane_hymn",
+                                 "https://hymnary.org/tune/nicaea"])
+    parts = store.split_by_type()
+    assert [(kind, [h['url'] for h in part]) for kind, part in parts] == [
+        ("text", ["https://hymnary.org/text/slane_hymn"]),
+        ("tune", ["https://hymnary.org/tune/slane", "https://hymnary.org/tune/nicaea"]),
+    ]
+    print("   Mixed sitemap split by record type")
+    
+    server, base = serve_files(files)
+    files['/sitemap.xml'] = (
+        f'<sitemapindex xmlns="{namespace}">' +
+        ''.join(f'<sitemap><loc>{base}/{name}</loc></sitemap>' for name in sitemaps) +
+        '</sitemapindex>'
+    ).encode()
+    for name, paths in sitemaps.items():
+        files[f'/{name}'] = gzip.compress(
+            f'<urlset xmlns="{namespace}">'.encode() +
+            b''.join(f'<url><loc>https://hymnary.org/{path}</loc></url>'.encode() for path in paths) +
+            b'</urlset>'
+        )
+    try:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            manager = SitemapManager(sitemap_dir=Path(tmpdir), index_url=f"{base}/sitemap.xml")
+            manager.load_all_hymns()
+            assert len(manager.catalogue) == 7
+            assert manager.catalogue.record_types() == ["person", "text", "tune"]
+            
+            holy = manager.search_hymns("holy")
+            assert {h['url'].split('/')[3] for h in holy} == {"text", "tune"}
+            tunes = manager.search_hymns("holy", record_type="tune")
+            assert [h['title'] for h in tunes] == ["Holy Manna"]
+            assert [h['title'] for h in manager.search_hymns("holy", record_type="text")] == ["Holy Holy Holy"]
+            assert manager.search_hymns("holy", record_type="person") == []
+            assert [h['title'] for h in manager.complete_titles("dy", record_type="person")] == ["Dykes Jb"]
+            print(f"   Searched {len(manager.catalogue)} records across {manager.catalogue.record_types()}")
+            
+            # Worker processes see the same types through the snapshots
+            worker = SitemapManager(sitemap_dir=Path(tmpdir), index_url=f"{base}/sitemap.xml")
+            assert worker.attach_catalogue() == 7
+            assert worker.search_hymns("holy", record_type="tune") == tunes
+            
+            # Only the configured types are loaded
+            texts_only = SitemapManager(sitemap_dir=Path(tmpdir), index_url=f"{base}/sitemap.xml",
+                                        record_types=["text"])
+            texts_only.load_all_hymns()
+            assert texts_only.catalogue.record_types() == ["text"]
+            print("   Record types configurable")
+    finally:
+        server.shutdown()
+    
+    print("\n" + "=" * 50)
+    print("✓ Typed search tests passed!")
+    return True
+
+def test_sqlite_backend():
+    """Test that the SQLite backend returns the same results as the in-memory catalogue."""
+    print("\nTesting SQLite Backend...")
+    print("-" * 50)
+    
+    import gzip
+    import random
+    import tempfile
+    from catalogue import Catalogue, CatalogueShard
+    from hymn_store import HymnStore
+    from sqlite_catalogue import DATABASE_FILENAME, SqliteCatalogue, build_database
+    
+    words = ["amazing", "grace", "holy", "lord", "god", "almighty", "abide", "with", "me", "o", "come",
+             "all", "ye", "faithful", "joy", "to", "the", "world", "be", "thou", "my", "vision"]
+    rng = random.Random(7)
+    urls = sorted({f"https://hymnary.org/{rng.choice(['text', 'tune'])}/" +
+                   "_".join(rng.choice(words) for _ in range(rng.randint(1, 5))) for _ in range(3000)})
+    rng.shuffle(urls)
+    sitemaps = [urls[:len(urls) // 2], urls[len(urls) // 2:]]
+    
+    shards = []
+    for number, sitemap in enumerate(sitemaps):
+        for kind, store in HymnStore.from_urls(sitemap).split_by_type():
+            shards.append(CatalogueShard(f"sitemap_{number}", store, record_type=kind))
+    memory = Catalogue(shards)
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = Path(tmpdir) / DATABASE_FILENAME
+        manifest = {"sitemap_0": [1, 2], "sitemap_1": [3, 4]}
+        assert build_database(path, manifest, [(shard.record_type, shard.hymns.urls()) for shard in shards])
+        database = SqliteCatalogue.open(path, manifest)
+        assert database is not None and len(database) == len(memory)
+        assert database.record_types() == memory.record_types() == ["text", "tune"]
+        assert database.hymns[5] == memory.hymns[5].to_dict()
+        assert SqliteCatalogue.open(path, {"sitemap_0": [1, 2]}) is None
+        
+        # Same hits in the same order: exact, prefix, word, substring, short, separators, typos
+        for query in ["amazing grace", "holy", "lord god", "aith", "o", "ye_faithful", "", "almighy",
+                      "faithfull joy", "zzz"]:
+            for record_type in [None, "tune"]:
+                expected = [h['url'] for h in memory.search(query, 10, record_type)]
+                assert [h['url'] for h in database.search(query, 10, record_type)] == expected, query
+        # Completion budgets cover the whole catalogue, however many shards it's split into.
+        # The memory backend bounds the candidates it looks at, so for common words it may
+        # stop early, but what it returns is always the start of what SQLite returns.
+        for text in ["amaz", "holy l", "vi", "o c", "g", "a", "th", "lord g"]:
+            for limit, record_type in [(25, None), (200, None), (200, "text")]:
+                expected = [h['title'] for h in memory.complete(text, limit, record_type)]
+                found = [h['title'] for h in database.complete(text, limit, record_type)]
+                assert found[:len(expected)] == expected and bool(found) == bool(expected), text
+        assert [h['title'] for h in database.complete("amaz", 200)] == \
+            [h['title'] for h in memory.complete("amaz", 200)]
+        database.close()
+        print(f"   {len(database)} records searched alike by both backends")
+    
+    # The manager builds the database once and reuses it until a sitemap changes
+    namespace = "http://www.sitemaps.org/schemas/sitemap/0.9"
+    files = {}
+    server, base = serve_files(files)
+    
+    def publish(lastmods: list):
+        files['/sitemap.xml'] = (
+            f'<sitemapindex xmlns="{namespace}">' +
+            ''.join(f'<sitemap><loc>{base}/text_{n}.xml.gz</loc><lastmod>{lastmod}</lastmod></sitemap>'
+                    for n, lastmod in enumerate(lastmods)) +
+            '</sitemapindex>'
+        ).encode()
+        for number, sitemap in enumerate(sitemaps):
+            files[f'/text_{number}.xml.gz'] = gzip.compress(
+                f'<urlset xmlns="{namespace}">'.encode() +
+                b''.join(f'<url><loc>{url}</loc></url>'.encode() for url in sitemap) +
+                b'</urlset>'
+            )
+    
+    publish(["2024-01-01", "2024-01-01"])
+    try:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            manager = SitemapManager(sitemap_dir=Path(tmpdir), index_url=f"{base}/sitemap.xml",
+                                     backend="sqlite")
+            manager.load_all_hymns()
+            assert isinstance(manager.catalogue, SqliteCatalogue)
+            assert len(manager.catalogue) == len(memory)
+            assert manager.search_hymns("amazing grace") == memory.search("amazing grace")
+            assert [h['url'] for h in manager.search_hymns("holy", record_type="tune")] == \
+                [h['url'] for h in memory.search("holy", record_type="tune")]
+            built_at = manager.database_path.stat().st_mtime_ns
+            
+            reloaded = SitemapManager(sitemap_dir=Path(tmpdir), index_url=f"{base}/sitemap.xml",
+                                      backend="sqlite")
+            reloaded.load_all_hymns()
+            assert reloaded.database_path.stat().st_mtime_ns == built_at
+            assert reloaded.refresh_catalogue() == 0
+            print("   Database reused across loads and unchanged refreshes")
+            
+            sitemaps[1] = sitemaps[1] + ["https://hymnary.org/text/a_brand_new_hymn"]
+            publish(["2024-01-01", "2024-02-01"])
+            replaced = reloaded.catalogue
+            assert reloaded.refresh_catalogue() == 1
+            # The replaced database's connections are closed, but a straggling read still works
+            assert replaced._closed and len(replaced.search("holy")) > 0
+            assert [h['title'] for h in reloaded.search_hymns("brand new")] == ["A Brand New Hymn"]
+            assert len(reloaded.catalogue) == len(memory) + 1
+            print("   Changed sitemap rebuilds the database")
+            
+            worker = SitemapManager(sitemap_dir=Path(tmpdir), index_url=f"{base}/sitemap.xml",
+                                    backend="sqlite")
+            assert worker.attach_catalogue() == len(memory) + 1
+            assert worker.search_hymns("lord god") == manager.search_hymns("lord god")
+            print("   Attached process searches the same database")
+            
+            # A database that can't be built fails the load rather than serving nothing
+            import sitemap_manager
+            from sitemap_manager import CatalogueState
+            build = sitemap_manager.build_database
+            sitemap_manager.build_database = lambda *args: False
+            try:
+                broken = SitemapManager(sitemap_dir=Path(tmpdir), index_url=f"{base}/sitemap.xml",
+                                        backend="sqlite")
+                try:
+                    broken.load_all_hymns(force_reload=True)
+                    assert False, "load should have failed"
+                except RuntimeError:
+                    pass
+                assert broken.state == CatalogueState.FAILED and not broken.is_ready
+            finally:
+                sitemap_manager.build_database = build
+            print("   Failed database build marks the load failed")
+    finally:
+        server.shutdown()
+    
+    try:
+        SitemapManager(backend="postgres")
+        assert False, "unknown backends are rejected"
+    except ValueError:
+        pass
+    
+    print("\n" + "=" * 50)
+    print("✓ SQLite backend tests passed!")
+    return True
+
+def test_search_keys():
+    """Test that searches ignore accents, punctuation and %-escapes in every backend."""
+    print("\nTesting Search Keys...")
+    print("-" * 50)
+    
+    import tempfile
+    from catalogue import Catalogue, CatalogueShard
+    from catalogue_snapshot import build_manifest, read_snapshot, write_snapshot
+    from hymn_store import HymnStore, search_key
+    from search_index import HymnSearchIndex
+    from sqlite_catalogue import DATABASE_FILENAME, SqliteCatalogue, build_database
+    
+    assert search_key("  Jesu, Joy of Man's Desiring ") == "jesu joy of mans desiring"
+    assert search_key("Ave María – ﬁne") == "ave maria fine"
+    assert search_key("Ein feste Burg") == "ein feste burg"
+    assert search_key("!?") == ""
+    print("   Accents, case and punctuation folded")
+    
+    urls = [
+        "https://hymnary.org/text/j%C3%A9sus_paid_it_all",
+        "https://hymnary.org/text/jesu_joy_of_mans_desiring",
+        "https://hymnary.org/text/o_sacred_head%2C_now_wounded",
+        "https://hymnary.org/text/ave_mar%C3%ADa",
+        "https://hymnary.org/text/holy_holy_holy",
+    ]
+    store = HymnStore.from_urls(urls)
+    assert store[0]['title'] == "Jésus Paid It All"
+    assert store.search_key(2) == "o sacred head now wounded"
+    
+    queries = {
+        "jesus paid": urls[0],
+        "JÉSUS": urls[0],
+        "Jesu, Joy": urls[1],
+        "sacred head, now": urls[2],
+        "maría": urls[3],
+        "holy—holy": urls[4],
+    }
+    memory = Catalogue([CatalogueShard("sitemap_0", store, record_type="text")])
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = Path(tmpdir) / DATABASE_FILENAME
+        assert build_database(path, {}, [("text", urls)])
+        database = SqliteCatalogue.open(path)
+        
+        source = Path(tmpdir) / "index_text_0.xml"
+        source.write_text("<urlset/>")
+        snapshot_path = Path(tmpdir) / "index_text_0.xml.snapshot"
+        assert write_snapshot(snapshot_path, build_manifest([source]), [("text", store, HymnSearchIndex(store))])
+        [(_, loaded_hymns, loaded_index)] = read_snapshot(snapshot_path, build_manifest([source]))
+        assert loaded_hymns.search_key(0) == "jesus paid it all"
+        
+        for engine in [memory, database, loaded_index]:
+            for query, url in queries.items():
+                assert engine.search(query, 10)[0]['url'] == url, (engine, query)
+            assert engine.complete("Ave Mari")[0]['url'] == urls[3]
+            assert len(engine.search("...", 10)) == len(urls)
+        database.close()
+    print(f"   {len(queries)} queries matched alike in memory, SQLite and snapshots")
+    
+    print("\n" + "=" * 50)
+    print("✓ Search key tests passed!")
+    return True
+
+def test_query_cache():
+    """Test LRU eviction, expiry and invalidation of cached search results."""
+    print("\nTesting Query Cache...")
+    print("-" * 50)
+    
+    import tempfile
+    from query_cache import QueryCache, normalize_query
+    
+    now = [0.0]
+    cache = QueryCache(max_entries=2, ttl=10, clock=lambda: now[0])
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1  # "b" is now the least recently used
+    cache.put("c", 3)
+    assert cache.get("b") is None and cache.get("c") == 3
+    now[0] = 11
+    assert cache.get("a") is None
+    assert cache.stats() == {'entries': 1, 'hits': 2, 'misses': 2, 'evictions': 1, 'expirations': 1}
+    print(f"   Stats: {cache.stats()}")
+    
+    assert normalize_query("  How  Great ") == "how great"
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        manager = SitemapManager(sitemap_dir=Path(tmpdir))
+        manager.hymn_data = [
+            {'url': 'https://hymnary.org/text/how_great_thou_art',
+             'title': 'How Great Thou Art', 'title_lower': 'how great thou art'},
+        ]
+        first = manager.search_hymns("great")
+        assert manager.search_hymns(" GREAT ") == first
+        assert manager.query_cache.hits == 1
+        
+        # Replacing the catalogue drops cached results
+        manager.hymn_data = [
+            {'url': 'https://hymnary.org/text/great_is_thy_faithfulness',
+             'title': 'Great Is Thy Faithfulness', 'title_lower': 'great is thy faithfulness'},
+        ]
+        assert len(manager.query_cache) == 0
+        assert [h['title'] for h in manager.search_hymns("great")] == ["Great Is Thy Faithfulness"]
+        print("   Cache invalidated on catalogue swap")
+    
+    print("\n" + "=" * 50)
+    print("✓ Query cache tests passed!")
+    return True
+
+def test_async_search():
+    """Test that async searches run off the event loop, coalesce and time out."""
+    print("\nTesting Async Search...")
+    print("-" * 50)
+    
+    import time
+    import asyncio
+    import tempfile
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        manager = SitemapManager(sitemap_dir=Path(tmpdir))
+        manager.hymn_data = [
+            {'url': 'https://hymnary.org/text/how_great_thou_art',
+             'title': 'How Great Thou Art', 'title_lower': 'how great thou art'},
+        ]
+        catalogue = manager.catalogue
+        real_search = catalogue.search
+        calls = []
+        
+        def slow_search(query, max_results=10, record_type=None):
+            calls.append(query)
+            time.sleep(0.3)
+            return real_search(query, max_results, record_type)
+        catalogue.search = slow_search
+        
+        async def run():
+            # The event loop keeps ticking while the searches run
+            lag = 0.0
+            async def ticker():
+                nonlocal lag
+                for _ in range(20):
+                    start = time.monotonic()
+                    await asyncio.sleep(0.01)
+                    lag = max(lag, time.monotonic() - start - 0.01)
+            
+            ticking = asyncio.ensure_future(ticker())
+            results = await asyncio.gather(*(manager.search_hymns_async("great") for _ in range(5)))
+            await ticking
+            assert all([h['title'] for h in r] == ["How Great Thou Art"] for r in results)
+            assert calls == ["great"] and manager.coalesced_searches == 4
+            assert lag < 0.1, f"event loop stalled for {lag:.3f}s"
+            print(f"   5 concurrent searches ran once; max loop lag {lag * 1000:.1f}ms")
+            
+            # Served from the cache without a worker thread
+            assert await manager.search_hymns_async("GREAT") == results[0]
+            assert len(calls) == 1
+            
+            try:
+                await manager.search_hymns_async("thou", timeout=0.05)
+                assert False, "expected a timeout"
+            except asyncio.TimeoutError:
+                print("   Slow search timed out")
+            # Repeating it joins the timed-out search still running instead of starting another
+            coalesced = manager.coalesced_searches
+            assert await manager.search_hymns_async("thou") and calls.count("thou") == 1
+            assert manager.coalesced_searches == coalesced + 1
+            # Once it's finished it's forgotten, and its results come from the cache
+            await asyncio.sleep(0)
+            assert not manager._inflight
+            assert await manager.search_hymns_async("thou") and calls.count("thou") == 1
+        
+        asyncio.run(run())
+        manager.close()
+    
+    print("\n" + "=" * 50)
+    print("✓ Async search tests passed!")
+    return True
+
+def test_benchmark():
+    """Test that the benchmark harness runs end to end on a tiny catalogue."""
+    print("\nTesting Benchmark Harness...")
+    print("-" * 50)
+    
+    from benchmark import make_titles, run_benchmark
+    
+    assert make_titles(50, seed=1) == make_titles(50, seed=1)
+    result = run_benchmark(300, query_count=30, measure_memory=False)
+    assert result['size'] == 300 and result['sitemaps'] == 1
+    for name in ('search', 'complete', 'cached_search'):
+        assert result[name]['count'] == 30
+        assert result[name]['p50_ms'] <= result[name]['p99_ms']
+    print(f"   search p50 {result['search']['p50_ms']}ms, p99 {result['search']['p99_ms']}ms")
+    
+    print("\n" + "=" * 50)
+    print("✓ Benchmark harness tests passed!")
+    return True
+
+def test_metrics():
+    """Test timing histograms, collectors and the metrics endpoint."""
+    print("\nTesting Metrics...")
+    print("-" * 50)
+    
+    import socket
+    import asyncio
+    import tempfile
+    import urllib.request
+    from metrics import Metrics, start_metrics_server
+    
+    metrics = Metrics()
+    metrics.describe('test_seconds', "Test timings", buckets=(0.1, 1.0))
+    metrics.observe('test_seconds', 0.05, stage='a')
+    metrics.observe('test_seconds', 0.5, stage='a')
+    with metrics.timer('test_seconds', stage='b'):
+        pass
+    metrics.register_collector(lambda: {'test_items': 3, 'test_hits_total': 7})
+    
+    text = metrics.render()
+    assert 'test_seconds_bucket{stage="a",le="0.1"} 1' in text
+    assert 'test_seconds_bucket{stage="a",le="+Inf"} 2' in text
+    assert 'test_seconds_count{stage="b"} 1' in text
+    assert '# TYPE test_hits_total counter' in text and 'test_items 3' in text
+    summary = metrics.snapshot()
+    assert summary['test_seconds{stage="a"}']['count'] == 2
+    assert summary['test_seconds{stage="a"}']['p99'] == 1.0
+    print(f"   Rendered {len(text.splitlines())} lines")
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        manager = SitemapManager(sitemap_dir=Path(tmpdir))
+        manager.hymn_data = [
+            {'url': 'https://hymnary.org/text/how_great_thou_art',
+             'title': 'How Great Thou Art', 'title_lower': 'how great thou art'},
+        ]
+        manager.search_hymns("great")
+        manager.search_hymns("great")
+        stats = manager.stats()
+        assert stats['hymnbot_catalogue_hymns'] == 1
+        assert stats['hymnbot_query_cache_hits_total'] == 1
+    
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+    
+    async def scrape():
+        runner = await start_metrics_server(port, metrics=metrics)
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                None, lambda: urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics").read().decode())
+        finally:
+            await runner.cleanup()
+    
+    assert asyncio.run(scrape()) == metrics.render()
+    print(f"   Served metrics on port {port}")
+    
+    print("\n" + "=" * 50)
+    print("✓ Metrics tests passed!")
+    return True
+
+def test_hymn_payloads():
+    """Test that cached select options and share embeds match freshly built ones."""
+    print("\nTesting Hymn Payloads...")
+    print("-" * 50)
+    
+    import discord
+    from hymn_payloads import HymnPayloads, truncate
+    
+    long_title = "O " * 60
+    hymns = [
+        {'url': 'https://hymnary.org/text/how_great_thou_art', 'title': 'How Great Thou Art'},
+        {'url': 'https://hymnary.org/text/' + 'o_' * 60, 'title': long_title},
+    ]
+    assert truncate("short") == "short"
+    assert len(truncate(long_title)) == 100 and truncate(long_title).endswith("...")
+    
+    payloads = HymnPayloads()
+    options = payloads.options(hymns)
+    assert [o.label for o in options] == ['How Great Thou Art', long_title[:97] + "..."]
+    assert [o.value for o in options] == ['0', '1']
+    assert options[1].description == hymns[1]['url'][:97] + "..."
+    
+    # The same results reuse the same options, in a list the caller may modify
+    again = payloads.options(hymns)
+    assert again == options and again is not options
+    assert again[0] is options[0]
+    assert payloads.option_lists.hits == 1
+    
+    embed = payloads.share_embed(hymns[0], "Alice")
+    expected = discord.Embed(
+        title='How Great Thou Art',
+        url=hymns[0]['url'],
+        description=f"[View on Hymnary]({hymns[0]['url']})",
+        color=discord.Color.blue()
+    )
+    expected.set_footer(text="Shared by Alice")
+    assert embed.to_dict() == expected.to_dict()
+    assert payloads.share_embed(hymns[0], "Bob").footer.text == "Shared by Bob"
+    assert embed.footer.text == "Shared by Alice"
+    print("   Options and embeds reused")
+    
+    print("\n" + "=" * 50)
+    print("✓ Hymn payload tests passed!")
+    return True
+
+def test_result_cursors():
+    """Test paging through results and that abandoned cursors are reclaimed."""
+    print("\nTesting Result Cursors...")
+    print("-" * 50)
+    
+    from result_cursors import CursorStore, ResultCursor
+    
+    pulled = []
+    
+    def results():
+        for i in range(60):
+            pulled.append(i)
+            yield {'url': f'https://hymnary.org/text/hymn_{i}', 'title': f'Hymn {i}'}
+    
+    cursor = ResultCursor(results(), page_size=25)
+    assert [h['title'] for h in cursor.page(0)][:2] == ['Hymn 0', 'Hymn 1']
+    assert len(pulled) == 25
+    assert cursor.has_next(0) and len(pulled) == 26
+    assert [h['title'] for h in cursor.page(2)] == [f'Hymn {i}' for i in range(50, 60)]
+    assert not cursor.has_next(2) and cursor.page(3) == []
+    # Going back reuses pages already pulled
+    assert cursor.page(1)[0]['title'] == 'Hymn 25' and len(pulled) == 60
+    print("   Pages pulled lazily from the result stream")
+    
+    now = [0.0]
+    store = CursorStore(max_cursors=2, ttl=180, clock=lambda: now[0])
+    first = store.open(results())
+    assert store.get(first) is not None
+    now[0] = 100.0
+    assert store.get(first) is not None  # Using a cursor keeps it alive
+    now[0] = 250.0
+    assert store.get(first) is not None
+    now[0] = 500.0
+    assert store.get(first) is None
+    
+    # Old cursors are dropped to make room, and expired ones when others open
+    a, b = store.open([]), store.open([])
+    c = store.open([])
+    assert store.get(a) is None and store.get(b) is not None
+    store.close(c)
+    assert store.get(c) is None
+    now[0] = 1000.0
+    store.open([])
+    assert store.stats()['hymnbot_result_cursors_open'] == 1
+    print(f"   Cursor store stats: {store.stats()}")
+    
+    # Clicking Next more times than there are pages stays on the last page
+    import asyncio
+    from load_test import load_bot
+    from fake_discord import FakeChannel, FakeDiscord, FakeInteraction, FakeMessage, FakeUser
+    bot = load_bot()
+    
+    async def page_past_end():
+        api = FakeDiscord()
+        channel, user = FakeChannel(api, 1), FakeUser(1, "user")
+        hymns = list(results())
+        view = bot.HymnSelectView(bot.result_cursors.open(hymns), len(hymns), FakeInteraction(api, channel, user))
+        for _ in range(4):
+            await view.next_callback(FakeInteraction(api, channel, user, message=FakeMessage(view=view)))
+        return view
+    
+    view = asyncio.run(page_past_end())
+    assert view.page == 2 and [h['title'] for h in view.hymns] == [f'Hymn {i}' for i in range(50, 60)]
+    print("   Next past the last page stays on it")
+    
+    print("\n" + "=" * 50)
+    print("✓ Result cursor tests passed!")
+    return True
+
+def test_load_test():
+    """Test the fake Discord layer and a small offline load test of /find and sharing."""
+    print("\nTesting Load Test Harness...")
+    print("-" * 50)
+    
+    import asyncio
+    import discord
+    from fake_discord import FakeChannel, FakeDiscord, FakeInteraction, FakeUser
+    from load_test import run_load_test
+    
+    async def exercise_fakes():
+        clock = [0.0]
+        api = FakeDiscord(channel_limit=(2, 0.05), clock=lambda: clock[0])
+        channel = FakeChannel(api, 1)
+        interaction = FakeInteraction(api, channel, FakeUser(1, "Tester"))
+        await interaction.response.defer(ephemeral=True)
+        try:
+            await interaction.response.send_message("twice")
+            assert False, "an interaction can only be responded to once"
+        except discord.InteractionResponded:
+            pass
+        await interaction.edit_original_response(content="Edited")
+        assert interaction.original_response.content == "Edited"
+        
+        # The third post inside the window is rate limited until the window frees up
+        await channel.send("one")
+        await channel.send("two")
+        clock[0] = 0.06
+        await channel.send("three")
+        assert [m.content for m in channel.messages] == ["one", "two", "three"]
+        assert api.stats()['calls']['channel.send'] == 3
+        
+        late = FakeInteraction(api, channel, FakeUser(2, "Slow"))
+        clock[0] += 4
+        await late.response.defer()
+        assert api.expired_interactions == 1
+    
+    asyncio.run(exercise_fakes())
+    print("   Fake interactions enforce one response, rate limits and the 3 second deadline")
+    
+    result = run_load_test(size=500, flows=80, concurrency=20, channels=40, rate_limit=0.1, retry_after=0.001,
+                           channel_limit=(50, 0.01))
+    assert sum(result['outcomes'].values()) == 80
+    assert result['outcomes'].get('results', 0) > 0
+    assert result['outcomes'].get('error', 0) == 0
+    assert result['hymns_shared'] == result['outcomes']['results'] == result['share']['count']
+    assert result['api']['calls']['channel.send'] == result['messages_posted']
+    assert sum(result['api']['rate_limited'].values()) > 0
+    assert result['find']['p50_ms'] <= result['find']['p99_ms']
+    assert result['flows_per_second'] > 0
+    print(f"   {result['flows']} flows at {result['flows_per_second']}/s, "
+          f"find p99 {result['find']['p99_ms']}ms, {sum(result['api']['rate_limited'].values())} 429s retried")
+    
+    print("\n" + "=" * 50)
+    print("✓ Load test harness tests passed!")
+    return True
+
+def test_send_queue():
+    """Test that channel posts are paced, coalesced and retried, and shares take one round trip."""
+    print("\nTesting Channel Send Queue...")
+    print("-" * 50)
+    
+    import asyncio
+    import discord
+    from fake_discord import FakeChannel, FakeDiscord, FakeInteraction, FakeMessage, FakeUser
+    from load_test import load_bot
+    from send_queue import ChannelSendQueue
+    
+    def embeds(count: int):
+        return [discord.Embed(title=f"Hymn {n}") for n in range(count)]
+    
+    async def coalesce():
+        api = FakeDiscord(latency=0.01)
+        channel = FakeChannel(api, 1)
+        queue = ChannelSendQueue()
+        shares = embeds(12)
+        messages = await asyncio.gather(*(queue.send(channel, embed) for embed in shares))
+        # Shares arriving together go out together, up to ten per message
+        assert [len(m.embeds) for m in channel.messages] == [10, 2]
+        assert [e.title for m in channel.messages for e in m.embeds] == [e.title for e in shares]
+        assert all(embed in message.embeds for embed, message in zip(shares, messages))
+        assert queue.stats()['hymnbot_send_queue_coalesced_total'] == 12
+        
+        # One arriving while a post is in flight waits for it, then goes out with the next
+        first = asyncio.ensure_future(queue.send(channel, shares[0]))
+        await asyncio.sleep(0.005)
+        await asyncio.gather(first, *(queue.send(channel, embed) for embed in shares[1:4]))
+        assert [len(m.embeds) for m in channel.messages[2:]] == [1, 3]
+        assert queue.stats()['hymnbot_send_queue_channels'] == 0
+    
+    async def pace():
+        api = FakeDiscord(channel_limit=(2, 0.05))
+        channel = FakeChannel(api, 1)
+        queue = ChannelSendQueue(rate_limit=(2, 0.05))
+        for embed in embeds(5):
+            await queue.send(channel, embed)
+        assert len(channel.messages) == 5 and not api.rate_limited
+    
+    async def retry():
+        # Every call that draws a 429 fails at once, so only the queue's retries save it
+        api = FakeDiscord(rate_limit_chance=0.5, max_tries=1, seed=3)
+        channel = FakeChannel(api, 1)
+        queue = ChannelSendQueue(rate_limit=(100, 1.0), attempts=30, retry_delay=0.0001)
+        for embed in embeds(20):
+            await queue.send(channel, embed)
+        assert len(channel.messages) == 20
+        assert queue.retries > 0 and api.failed['channel.send'] == queue.retries
+    
+    async def forget():
+        # Channels nobody has posted to for a whole window don't keep their post times
+        now = [0.0]
+        api = FakeDiscord()
+        queue = ChannelSendQueue(rate_limit=(5, 5.0), clock=lambda: now[0])
+        for channel_id in range(100):
+            await queue.send(FakeChannel(api, channel_id), embeds(1)[0])
+        assert len(queue._sent) == 100
+        now[0] = 10.0
+        await queue.send(FakeChannel(api, 0), embeds(1)[0])
+        assert list(queue._sent) == [0]
+    
+    asyncio.run(coalesce())
+    asyncio.run(pace())
+    asyncio.run(retry())
+    asyncio.run(forget())
+    print("   Bursts coalesced, posts paced to the channel limit, 429s retried, idle channels forgotten")
+    
+    bot = load_bot()
+    hymn = {'url': "https://hymnary.org/text/holy_holy_holy", 'title': "Holy Holy Holy",
+            'title_lower': "holy holy holy"}
+    
+    async def select(cancel: bool):
+        api = FakeDiscord(latency=0.02)
+        channel = FakeChannel(api, 1)
+        user = FakeUser(1, "Tester")
+        command = FakeInteraction(api, channel, user)
+        view = bot.HymnSelectView(bot.result_cursors.open([hymn]), 1, command, "holy")
+        menu = FakeMessage(view=view)
+        click = FakeInteraction(api, channel, user, data={'values': ["0"]}, message=menu)
+        start = asyncio.get_running_loop().time()
+        await (view.cancel_callback(click) if cancel else view.select_callback(click))
+        return api, channel, menu, asyncio.get_running_loop().time() - start
+    
+    api, channel, menu, elapsed = asyncio.run(select(cancel=False))
+    assert menu.content == "✅ Shared: **Holy Holy Holy**" and menu.view is None
+    assert [m.embed.title for m in channel.messages] == ["Holy Holy Holy"]
+    # Confirming and posting run side by side: about one 20ms round trip, not three
+    assert api.stats()['calls'] == {'interaction.edit_message': 1, 'channel.send': 1}
+    assert elapsed < 0.05, elapsed
+    
+    api, channel, menu, _ = asyncio.run(select(cancel=True))
+    assert menu.content.startswith("❌ Cancelled") and menu.view is None and not channel.messages
+    assert api.stats()['calls'] == {'interaction.edit_message': 1}
+    print(f"   Share confirmed and posted in {elapsed * 1000:.0f}ms over a 20ms link")
+    
+    print("\n" + "=" * 50)
+    print("✓ Channel send queue tests passed!")
+    return True
+
 def test_bot_imports():
     """Test that bot modules can be imported."""
     print("\nTesting Bot Module Imports...")
@@ -102,6 +1374,15 @@ def test_bot_imports():
         assert hasattr(sitemap_module, 'initialize_sitemaps')
         print("✓ initialize_sitemaps function exists")
         
+        # SHARD_IDS without a numeric SHARD_COUNT is refused before discord.py sees it
+        import os
+        import subprocess
+        for shard_count in ["", "auto"]:
+            env = dict(os.environ, DISCORD_TOKEN="test", SHARD_IDS="0,1", SHARD_COUNT=shard_count)
+            result = subprocess.run([sys.executable, "-c", "import bot"], env=env, capture_output=True, text=True)
+            assert result.returncode != 0 and "SHARD_IDS requires SHARD_COUNT" in result.stderr
+        print("✓ SHARD_IDS without a numeric SHARD_COUNT rejected")
+        
         print("\n" + "=" * 50)
         print("✓ All import tests passed!")
         return True
@@ -125,6 +1406,60 @@ def main():
         
         if not test_sitemap_manager():
             success = False
+        
+        if not test_search_index():
+            success = False
+        
+        if not test_catalogue_snapshot():
+            success = False
+        
+        if not test_sitemap_fetcher():
+            success = False
+        
+        if not test_resumable_download():
+            success = False
+        
+        if not test_background_loading():
+            success = False
+        
+        if not test_parallel_parsing():
+            success = False
+        
+        if not test_catalogue_refresh():
+            success = False
+        
+        if not test_typed_search():
+            success = False
+        
+        if not test_sqlite_backend():
+            success = False
+        
+        if not test_search_keys():
+            success = False
+        
+        if not test_query_cache():
+            success = False
+        
+        if not test_async_search():
+            success = False
+        
+        if not test_benchmark():
+            success = False
+        
+        if not test_metrics():
+            success = False
+        
+        if not test_hymn_payloads():
+            success = False
+        
+        if not test_result_cursors():
+            success = False
+        
+        if not test_load_test():
+            success = False
+        
+        if not test_send_queue():
+            success = False
             
     except Exception as e:
         print(f"\n✗ Test failed with error: {e}")